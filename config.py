@@ -5,6 +5,27 @@
 sessionLength = 1  # Length of session in seconds.
 virtualSessionLength = 600  # Number of virtual timesteps per sessionLength.
 verbose = False  # Adds additional output for debugging.
+orderbookBackend = 'levels'  # Exchange order book: 'levels' (sorted price levels) or 'ladder' (one array slot per tick)
+tapeWindow = 10  # Number of most recent trades and cancellations on the tape published to traders.
+tapeFile = None  # Binary file all trades and cancels are appended to, over every run until deleted. None: temporary.
+tapeCsv = True  # Export each session's trades from the tape to transactions.csv at its end. False: tape file only.
+latencyFile = None  # CSV file each session's per-trader latency percentiles are appended to. None: off.
+traderWakeup = 'poll'  # 'poll': traders wake every 10ms. 'event': traders wait for a market event or timeout.
+traderWakeupTimeout = 0.1  # Longest a trader waits for a market event in 'event' mode, in seconds.
+marketDataRingSize = 1024  # Number of trades held for traders to read; a trader further behind skips ahead.
+traderExecution = 'thread'  # 'thread': all traders share one process. 'process': traders get their own processes.
+tradersPerProcess = 1  # Number of traders run in each process when traderExecution = 'process'.
+sharedRingSlotSize = 32768  # Largest LOB snapshot or trade message, in bytes, shared between processes.
+numWorkers = 1  # Number of trials run at once, each in its own process. 1 runs trials one after another.
+timeMode = 'real'  # 'real': sessions last sessionLength seconds. 'virtual': run by a discrete-event engine, flat out.
+virtualSeed = None  # In 'virtual' time mode, seed for each session's random numbers (with its ID); None for unseeded.
+virtualComputeScale = 1.0  # In 'virtual' time mode, multiplier on traders' measured compute time; 0 is reproducible.
+batchRespond = False  # In 'virtual' time mode, ZIP and AA traders respond in batches to every order processed.
+eventLogDir = None  # Directory each session's orders and kills are recorded to, for tbse_replay.py. None: off.
+metricsDir = None  # In 'real' time mode, directory each session's exchange metrics CSV is written to. None: off.
+metricsInterval = 1.0  # Seconds of real time covered by each row of the exchange metrics.
+precomputeOrders = False  # Generate each session's customer orders up front, instead of a batch at a time.
+orderSeed = None  # With precomputeOrders, seed for customer orders, reused by all trials of a schedule. None: fresh.
 
 # BSE ONLY
 start_time = 0.0
@@ -23,7 +44,9 @@ numSHVR = 0
 # Order Schedule
 useOffset = True  # Use an offset function to vary equilibrium price, this is disabled if useInputFile = True
 useInputFile = True  # Use an input file to define order schedule (e.g. Real World Trading data)
-input_file = "RWD/IBM-310817.csv" # Path to real world data input file
+input_file = "RWD/IBM-310817.csv" # Path to real world data input file (CSV, or xlsx laid out the same way)
+inputCacheDir = "RWD/cache"  # Directory of pre-parsed binary copies of input files; None to parse each run.
+inputResolution = None  # Seconds per offset event, resampling the input file; None for one per row.
 stepmode = 'fixed'  # Valid values: 'fixed', 'jittered', 'random'
 timemode = 'periodic'  # Valid values: 'periodic', 'drip-fixed', 'drip-jitter', 'drip-poisson'
 interval = 30  # Virtual seconds between new set of customer orders being generated.
@@ -71,6 +94,72 @@ def parse_config():
     if not isinstance(verbose, bool):
         print("CONFIG ERROR: verbose must be bool.")
         valid = False
+    if not isinstance(orderbookBackend, str):
+        print("CONFIG ERROR: orderbookBackend must be string.")
+        valid = False
+    if not isinstance(tapeWindow, int):
+        print("CONFIG ERROR: tapeWindow must be integer.")
+        valid = False
+    if tapeFile is not None and not isinstance(tapeFile, str):
+        print("CONFIG ERROR: tapeFile must be string or None.")
+        valid = False
+    if not isinstance(tapeCsv, bool):
+        print("CONFIG ERROR: tapeCsv must be bool.")
+        valid = False
+    if latencyFile is not None and not isinstance(latencyFile, str):
+        print("CONFIG ERROR: latencyFile must be string or None.")
+        valid = False
+    if not isinstance(traderWakeup, str):
+        print("CONFIG ERROR: traderWakeup must be string.")
+        valid = False
+    if not isinstance(traderWakeupTimeout, float):
+        print("CONFIG ERROR: traderWakeupTimeout must be a float.")
+        valid = False
+    if not isinstance(marketDataRingSize, int):
+        print("CONFIG ERROR: marketDataRingSize must be integer.")
+        valid = False
+    if not isinstance(traderExecution, str):
+        print("CONFIG ERROR: traderExecution must be string.")
+        valid = False
+    if not (isinstance(tradersPerProcess, int) and isinstance(sharedRingSlotSize, int)):
+        print("CONFIG ERROR: tradersPerProcess and sharedRingSlotSize must be integer.")
+        valid = False
+    if not isinstance(numWorkers, int):
+        print("CONFIG ERROR: numWorkers must be integer.")
+        valid = False
+    if not isinstance(timeMode, str):
+        print("CONFIG ERROR: timeMode must be string.")
+        valid = False
+    if virtualSeed is not None and not isinstance(virtualSeed, int):
+        print("CONFIG ERROR: virtualSeed must be integer or None.")
+        valid = False
+    if not isinstance(virtualComputeScale, (int, float)):
+        print("CONFIG ERROR: virtualComputeScale must be a number.")
+        valid = False
+    if not isinstance(batchRespond, bool):
+        print("CONFIG ERROR: batchRespond must be bool.")
+        valid = False
+    if eventLogDir is not None and not isinstance(eventLogDir, str):
+        print("CONFIG ERROR: eventLogDir must be string or None.")
+        valid = False
+    if metricsDir is not None and not isinstance(metricsDir, str):
+        print("CONFIG ERROR: metricsDir must be string or None.")
+        valid = False
+    if not isinstance(metricsInterval, (int, float)):
+        print("CONFIG ERROR: metricsInterval must be a number.")
+        valid = False
+    if inputResolution is not None and not (isinstance(inputResolution, (int, float)) and inputResolution > 0):
+        print("CONFIG ERROR: inputResolution must be a positive number or None.")
+        valid = False
+    if inputCacheDir is not None and not isinstance(inputCacheDir, str):
+        print("CONFIG ERROR: inputCacheDir must be string or None.")
+        valid = False
+    if not isinstance(precomputeOrders, bool):
+        print("CONFIG ERROR: precomputeOrders must be bool.")
+        valid = False
+    if orderSeed is not None and not isinstance(orderSeed, int):
+        print("CONFIG ERROR: orderSeed must be integer or None.")
+        valid = False
     if not isinstance(start_time, float):
         print("CONFIG ERROR: start_time must be a float.")
         valid = False
@@ -120,6 +209,36 @@ def parse_config():
     if sessionLength <= 0 or virtualSessionLength <= 0:
         print("CONFIG ERROR: Session lengths must be greater than 0.")
         valid = False
+    if traderWakeup not in ['poll', 'event']:
+        print("CONFIG ERROR: traderWakeup must be 'poll' or 'event'.")
+        valid = False
+    if traderWakeupTimeout <= 0:
+        print("CONFIG ERROR: traderWakeupTimeout must be greater than 0.")
+        valid = False
+    if marketDataRingSize < 1:
+        print("CONFIG ERROR: marketDataRingSize must be greater than or equal to 1.")
+        valid = False
+    if traderExecution not in ['thread', 'process']:
+        print("CONFIG ERROR: traderExecution must be 'thread' or 'process'.")
+        valid = False
+    if tradersPerProcess < 1 or sharedRingSlotSize < 1:
+        print("CONFIG ERROR: tradersPerProcess and sharedRingSlotSize must be greater than or equal to 1.")
+        valid = False
+    if numWorkers < 1:
+        print("CONFIG ERROR: numWorkers must be greater than or equal to 1.")
+        valid = False
+    if timeMode not in ['real', 'virtual']:
+        print("CONFIG ERROR: timeMode must be 'real' or 'virtual'.")
+        valid = False
+    if virtualComputeScale < 0:
+        print("CONFIG ERROR: virtualComputeScale must be greater than or equal to 0.")
+        valid = False
+    if metricsInterval <= 0:
+        print("CONFIG ERROR: metricsInterval must be greater than 0.")
+        valid = False
+    if tapeWindow < 1:
+        print("CONFIG ERROR: tapeWindow must be greater than or equal to 1.")
+        valid = False
     if start_time < 0:
         print("CONFIG ERROR: start_time must be greater than or equal to 0.")
         valid = False
@@ -129,6 +248,9 @@ def parse_config():
     if numAA < 0 or numGDX < 0 or numGVWY < 0 or numSHVR < 0 or numZIC < 0 or numZIP < 0:
         print("CONFIG ERROR: All trader schedule values must be greater than or equal to 0.")
         valid = False
+    if orderbookBackend not in ['levels', 'ladder']:
+        print("CONFIG ERROR: orderbookBackend must be 'levels' or 'ladder'.")
+        valid = False
     if stepmode not in ['fixed', 'jittered', 'random']:
         print("CONFIG ERROR: stepmode must be 'fixed', 'jittered' or 'random'.")
         valid = False
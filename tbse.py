@@ -43,166 +43,69 @@ major simplifications in this version:
 
 NB this code has been written to be readable/intelligible, not efficient!"""
 
+import bisect
 import csv
 import math
+import multiprocessing
+import os
 import queue
 import random
 import sys
 import threading
 import time
-from datetime import datetime
 
 import config
-from tbse_customer_orders import customer_orders
+from tbse_customer_orders import customer_orders, precompute_customer_orders, issue_customer_orders
 from tbse_exchange import Exchange
-from tbse_trader_agents import TraderGiveaway, TraderShaver, TraderSniper, \
-    TraderZic, TraderZip, TraderAa, TraderGdx
-
-
-# Adapted from original BSE code
-def trade_stats(expid, traders, dumpfile):
-    """dump CSV statistics on exchange data and trader population to file for later analysis
-    this makes no assumptions about the number of types of traders, or
-    the number of traders of any one type -- allows either/both to change
-    between successive calls, but that does make it inefficient as it has to
-    re-analyse the entire set of traders on each call"""
-    trader_types = {}
-    for t in traders:
-        trader_type = traders[t].ttype
-        t_time1 = 0
-        t_time2 = 0
-        if trader_type in trader_types:
-            t_balance = trader_types[trader_type]['balance_sum'] + traders[t].balance
-            t_trades = trader_types[trader_type]['trades_sum'] + traders[t].n_trades
-            if traders[t].last_quote is not None:
-                t_time1 = trader_types[trader_type]['time1'] + traders[t].times[0] / traders[t].times[2]
-                t_time2 = trader_types[trader_type]['time2'] + traders[t].times[1] / traders[t].times[3]
-            n = trader_types[trader_type]['n'] + 1
-        else:
-            t_balance = traders[t].balance
-            if traders[t].last_quote is not None:
-                t_time1 = traders[t].times[0] / traders[t].times[2]
-                t_time2 = traders[t].times[1] / traders[t].times[3]
-            n = 1
-            t_trades = traders[t].n_trades
-        trader_types[trader_type] = {'n': n, 'balance_sum': t_balance, 'trades_sum': t_trades, 'time1': t_time1,
-                                     'time2': t_time2}
-
-    dumpfile.write(f"{expid}")
-    for trader_type in sorted(list(trader_types.keys())):
-        n = trader_types[trader_type]['n']
-        s = trader_types[trader_type]['balance_sum']
-        t = trader_types[trader_type]['trades_sum']
-        time1 = trader_types[trader_type]['time1']
-        time2 = trader_types[trader_type]['time2']
-        dumpfile.write(f", {trader_type}, {s}, {n}, {(s / float(n)):.2f}, "
-                       f"{(t / float(n)):.2f}, {(time1 / float(n)):.8f}, {(time2 / float(n)):.8f}")
-
-    dumpfile.write('\n')
-
-
-# From original BSE code
-def populate_market(trader_spec, traders, shuffle, verbose):
-    """create a bunch of trader_list from trader_spec
-    returns tuple (n_buyers, n_sellers)
-    optionally shuffles the pack of buyers and the pack of sellers"""
-    # pylint: disable=too-many-return-statements
-    def create_trader(robot_type, name):
-        """
-        Function that creates instances of the different Trader Types
-        :param robot_type: String representing type of trader to be created
-        :param name: String, name given to trader
-        :return: Instantiated Trader object
-        """
-        if robot_type == 'GVWY':
-            return TraderGiveaway('GVWY', name, 0.00, 0)
-        if robot_type == 'ZIC':
-            return TraderZic('ZIC', name, 0.00, 0)
-        if robot_type == 'SHVR':
-            return TraderShaver('SHVR', name, 0.00, 0)
-        if robot_type == 'SNPR':
-            return TraderSniper('SNPR', name, 0.00, 0)
-        if robot_type == 'ZIP':
-            return TraderZip('ZIP', name, 0.00, 0)
-        if robot_type == 'AA':
-            return TraderAa('AA', name, 0.00, 0)
-        if robot_type == 'GDX':
-            return TraderGdx('GDX', name, 0.00, 0)
-        sys.exit(f'FATAL: don\'t know robot type {robot_type}\n')
-
-    def shuffle_traders(ttype_char, n, trader_list):
-        """
-        Shuffles traders to avoid any biases caused by trader position.
-        :param ttype_char: 'B' if buyers, 'S' if sellers
-        :param n: int - number of traders being shuffles
-        :param trader_list: list of traders to shuffle
-        """
-        for swap in range(n):
-            t1 = (n - 1) - swap
-            t2 = random.randint(0, t1)
-            t1name = f"{ttype_char}{str(t1).zfill(2)}"
-            t2name = f"{ttype_char}{str(t2).zfill(2)}"
-            trader_list[t1name].tid = t2name
-            trader_list[t2name].tid = t1name
-            temp = trader_list[t1name]
-            trader_list[t1name] = trader_list[t2name]
-            trader_list[t2name] = temp
-
-    n_buyers = 0
-    for bs in trader_spec['buyers']:
-        trader_type = bs[0]
-        for _ in range(bs[1]):
-            trader_name = f"B{str(n_buyers).zfill(2)}"  # buyer i.d. string
-            traders[trader_name] = create_trader(trader_type, trader_name)
-            n_buyers = n_buyers + 1
-
-    if n_buyers < 1:
-        sys.exit('FATAL: no buyers specified\n')
-
-    if shuffle:
-        shuffle_traders('B', n_buyers, traders)
-
-    n_sellers = 0
-    for ss in trader_spec['sellers']:
-        trader_type = ss[0]
-        for _ in range(ss[1]):
-            trader_name = f"S{str(n_sellers).zfill(2)}"  # buyer i.d. string
-            traders[trader_name] = create_trader(trader_type, trader_name)
-            n_sellers = n_sellers + 1
-
-    if n_sellers < 1:
-        sys.exit('FATAL: no sellers specified\n')
-
-    if shuffle:
-        shuffle_traders('S', n_sellers, traders)
+from tbse_market import latency_stats, open_event_log, populate_market, process_order, session_complete, \
+    trade_stats, trader_wakeup
+from tbse_metrics import ExchangeMetrics
+from tbse_msg_classes import BroadcastRing
+from tbse_multiprocess import SharedRing, SharedRingReader, SharedExchangeView, TraderProxy, FillQueue
+from tbse_rwd import load_offset_events
+from tbse_trials import run_trials
+from tbse_virtual import virtual_market_session
 
-    if verbose:
-        for t in range(n_buyers):
-            bname = f"B{str(t).zfill(2)}"
-            print(traders[bname])
-        for t in range(n_sellers):
-            bname = f"S{str(t).zfill(2)}"
-            print(traders[bname])
 
-    return {'n_buyers': n_buyers, 'n_sellers': n_sellers}
+def process_kills(exchange, kill_q, virtual_time, event_log, metrics):
+    """
+    Deletes from the exchange every order waiting on kill_q
+    :param exchange: Exchange object
+    :param kill_q: Queue where orders to be removed from the exchange are placed
+    :param virtual_time: Current virtual time
+    :param event_log: EventLog every kill taken is recorded to, or None
+    :param metrics: ExchangeMetrics instrumenting the exchange, or None
+    """
+    while kill_q.empty() is False:
+        kill = kill_q.get()
+        if event_log is not None:
+            event_log.record_kill(virtual_time, kill)
+        if metrics is not None:
+            metrics.record_cancel()
+        exchange.del_order(virtual_time, kill)
 
 
-# pylint: disable=too-many-arguments
+# pylint: disable=too-many-arguments,too-many-locals
 def run_exchange(
         exchange,
         order_q,
-        trader_qs,
+        market_data,
+        fill_qs,
         kill_q,
         start_event,
         start_time,
         sess_length,
         virtual_end,
-        process_verbose):
+        process_verbose,
+        lob_ring=None,
+        event_log=None,
+        metrics=None):
     """
     Function for running of the exchange.
     :param exchange: Exchange object
     :param order_q: Queue on which new orders are sent to the queue
-    :param trader_qs: Queues by which traders receive updates from the exchange
+    :param market_data: BroadcastRing on which every trade is published to all traders
+    :param fill_qs: Dictionary of queues, indexed by Trader ID, on which each trader is sent its own trades
     :param kill_q: Queue where orders to be removed from the exchange are placed
     :param start_event: Event indicating if the exchange is active
     :param start_time: float, represents the start t (seconds since 1970)
@@ -210,31 +113,53 @@ def run_exchange(
     :param virtual_end: The number of virtual seconds the trading day lasts for
     :param process_verbose: Flag indicating whether additional information about order processing should be printed
                             to console
+    :param lob_ring: SharedRing each new LOB snapshot is published to for traders in other processes, or None
+    :param event_log: EventLog every order and kill taken is recorded to, or None
+    :param metrics: ExchangeMetrics instrumenting the exchange, or None
     :return: Returns 0 on completion of trading day
     """
     completed_coid = {}
+    # visible state of the last snapshot in lob_ring, so changes traders cannot see are not published to it nor wake
+    # trader processes; market_session publishes the first before the session starts
+    lob_visible = exchange.lob_visible
     start_event.wait()
-    while start_event.isSet():
+    while start_event.is_set():
 
-        virtual_time = (time.time() - start_time) * (virtual_end / sess_length)
+        elapsed = time.time() - start_time
+        virtual_time = elapsed * (virtual_end / sess_length)
+        if metrics is not None:
+            metrics.sample(elapsed, order_q, kill_q, fill_qs)
 
-        while kill_q.empty() is False:
-            exchange.del_order(virtual_time, kill_q.get())
+        process_kills(exchange, kill_q, virtual_time, event_log, metrics)
+        if lob_ring is not None and exchange.lob_visible != lob_visible:
+            lob_ring.publish(exchange.publish_lob(virtual_time, False))
+            lob_visible = exchange.lob_visible
 
-        order = order_q.get()
-        if order.coid in completed_coid:
-            if completed_coid[order.coid]:
+        if metrics is None:
+            order = order_q.get()
+        else:
+            # wake at least once an interval, so the queues are sampled and idle intervals still get their row
+            try:
+                order = order_q.get(timeout=metrics.interval)
+            except queue.Empty:
                 continue
+        if order is None:
+            # the session has ended
+            break
+        if event_log is not None:
+            event_log.record_order(virtual_time, order)
+        if metrics is None:
+            process_order(exchange, order, virtual_time, completed_coid, market_data, fill_qs, process_verbose)
         else:
-            completed_coid[order.coid] = False
-
-        (trade, lob) = exchange.process_order2(virtual_time, order, process_verbose)
-
-        if trade is not None:
-            completed_coid[order.coid] = True
-            completed_coid[trade['counter']] = True
-            for q in trader_qs:
-                q.put([trade, order, lob])
+            skipped = completed_coid.get(order.coid, False)
+            time1 = time.perf_counter_ns()
+            trade = process_order(exchange, order, virtual_time, completed_coid, market_data, fill_qs,
+                                  process_verbose)
+            metrics.record_order(order, time1, time.perf_counter_ns(), trade is not None, skipped)
+        if lob_ring is not None and exchange.lob_visible != lob_visible:
+            # published after any trade, so traders never see a LOB before the trade that changed it
+            lob_ring.publish(exchange.publish_lob(virtual_time, False))
+            lob_visible = exchange.lob_visible
     return 0
 
 
@@ -243,11 +168,13 @@ def run_trader(
         trader,
         exchange,
         order_q,
-        trader_q,
+        market_data,
+        fill_q,
         start_event,
         start_time,
         sess_length,
         virtual_end,
+        wakeup_timeout,
         respond_verbose,
         bookkeep_verbose):
     """
@@ -255,57 +182,134 @@ def run_trader(
     :param trader: The trader this function is controlling
     :param exchange: The exchange object
     :param order_q: Queue where the trader places new orders to send to the exchange
-    :param trader_q: Queue where the exchange updates this trader on activities in the market
+    :param market_data: This trader's RingReader on the exchange's broadcast of trades
+    :param fill_q: Queue where the exchange sends this trader its own trades, for bookkeeping
     :param start_event: Event flagging whether the market session is in progress
     :param start_time: Time at which market session begins
     :param sess_length: Length of market session in real world seconds
     :param virtual_end: Virtual number of seconds the market session ends at
+    :param wakeup_timeout: None to poll every 10 ms, otherwise wait for a market event for at most this many seconds
     :param respond_verbose: Should the trader display additional information on its response
     :param bookkeep_verbose: Should there be additional bookkeeping information displayed on the console
     :return: Returns 0 at the end of the market session
     """
     start_event.wait()
 
-    while start_event.isSet():
-        time.sleep(0.01)
+    market_seq = None
+    # customer order, type, price and quantity of the last quote sent
+    last_sent = None
+    while start_event.is_set():
+        if wakeup_timeout is None:
+            time.sleep(0.01)
+        else:
+            market_seq = exchange.wait_for_market(market_seq, wakeup_timeout)
         virtual_time = (time.time() - start_time) * (virtual_end / sess_length)
         time_left = (virtual_end - virtual_time) / virtual_end
-        trade = None
-        while trader_q.empty() is False:
-            [trade, order, lob] = trader_q.get(block=False)
-            if trade['party1'] == trader.tid:
-                trader.bookkeep(trade, order, bookkeep_verbose, virtual_time)
-            if trade['party2'] == trader.tid:
-                trader.bookkeep(trade, order, bookkeep_verbose, virtual_time)
-            time1 = time.time()
-            trader.respond(virtual_time, lob, trade, respond_verbose)
-            time2 = time.time()
-            trader.times[1] += time2 - time1
-            trader.times[3] += 1
-
-        lob = exchange.publish_lob(virtual_time, False)
-        time1 = time.time()
-        trader.respond(virtual_time, lob, trade, respond_verbose)
-        time2 = time.time()
-        order = trader.get_order(virtual_time, time_left, lob)
-        time3 = time.time()
-        trader.times[1] += time2 - time1
-        trader.times[3] += 1
+        order = trader_wakeup(trader, exchange, market_data, fill_q, virtual_time, time_left, respond_verbose,
+                              bookkeep_verbose)
         if order is not None:
-            if order.otype == 'Ask' and order.price < trader.orders[order.coid].price:
-                sys.exit('Bad ask')
-            if order.otype == 'Bid' and order.price > trader.orders[order.coid].price:
-                sys.exit('Bad bid')
-            trader.n_quotes = 1
+            quote = (order.coid, order.otype, order.price, order.qty)
+            if wakeup_timeout is not None and quote == last_sent:
+                # the same quote is already resting on the book, so resending it would change nothing but cost the
+                # exchange an order to process; a resting quote can never cross, as it would have traded on arrival
+                continue
+            last_sent = quote
+            order.enqueued = time.perf_counter_ns()
             order_q.put(order)
-            trader.times[0] += time3 - time2
-            trader.times[2] += 1
 
     return 0
 
 
-# one session in the market
 # pylint: disable=too-many-arguments,too-many-locals
+def run_trader_group(
+        traders,
+        order_q,
+        kill_q,
+        control_q,
+        result_q,
+        lob_ring,
+        trade_ring,
+        start_event,
+        start_time,
+        sess_length,
+        virtual_end,
+        wakeup_timeout,
+        respond_verbose,
+        bookkeep_verbose):
+    """
+    Function run in its own process for a group of traders, when config.traderExecution is 'process'.
+    Each trader runs on a thread of this process under run_trader(), reading the LOB and trades from shared memory;
+    this thread delivers the customer orders and fills sent on control_q, and issues any cancellations they need.
+    :param traders: Dictionary of the traders in this group, indexed by Trader ID
+    :param order_q: Queue where the traders place new orders to send to the exchange
+    :param kill_q: Queue where orders to be removed from the exchange are placed
+    :param control_q: Queue of ('order', tid, order) and ('fill', tid, [trade, order]) messages, ended by None
+    :param result_q: Queue on which the traders are sent back at the end of the session, with the number of their
+                     threads that ran until it ended
+    :param lob_ring: SharedRing of LOB snapshots
+    :param trade_ring: SharedRing of [trade, order, lob] messages
+    :param start_event: Event flagging whether the market session is in progress
+    :param start_time: Shared value holding the time at which market session begins, set before start_event
+    :param sess_length: Length of market session in real world seconds
+    :param virtual_end: Virtual number of seconds the market session ends at
+    :param wakeup_timeout: None to poll every 10 ms, otherwise wait for a market event for at most this many seconds
+    :param respond_verbose: Should the trader display additional information on its response
+    :param bookkeep_verbose: Should there be additional bookkeeping information displayed on the console
+    """
+    exchange = SharedExchangeView(lob_ring, trade_ring)
+    # tell the exchange's process this one is up, then wait for the session to start
+    result_q.put(None)
+    start_event.wait()
+    fill_qs = {}
+    trader_threads = []
+    finished = []
+
+    def run_to_end(*args):
+        # a trader thread that dies early never gets to record that it finished
+        finished.append(run_trader(*args))
+
+    for tid in traders:
+        fill_qs[tid] = queue.Queue()
+        trader_threads.append(threading.Thread(target=run_to_end, args=(
+            traders[tid],
+            exchange,
+            order_q,
+            SharedRingReader(trade_ring),
+            fill_qs[tid],
+            start_event,
+            start_time.value,
+            sess_length,
+            virtual_end,
+            wakeup_timeout,
+            respond_verbose,
+            bookkeep_verbose)))
+    for thread in trader_threads:
+        thread.start()
+
+    message = control_q.get()
+    while message is not None:
+        [kind, tid, payload] = message
+        if kind == 'fill':
+            fill_qs[tid].put(payload)
+        else:
+            response = traders[tid].add_order(payload, False)
+            if response == 'LOB_Cancel' and traders[tid].last_quote is not None:
+                kill_q.put(traders[tid].last_quote)
+            exchange.local_events += 1
+        message = control_q.get()
+
+    for thread in trader_threads:
+        thread.join()
+    # the exchange has stopped reading orders, so don't wait to flush any sent after the session ended
+    order_q.cancel_join_thread()
+    kill_q.cancel_join_thread()
+    lob_ring.close()
+    trade_ring.close()
+    result_q.put([traders, len(finished)])
+
+
+# one session in the market
+# pylint: disable=too-many-arguments,too-many-locals,too-many-branches,too-many-statements
 def market_session(
         sess_id,
         sess_length,
@@ -313,7 +317,9 @@ def market_session(
         trader_spec,
         order_schedule,
         start_event,
-        verbose):
+        verbose,
+        dumpfile=None,
+        output_dir=None):
     """
     Function representing a market session
     :param sess_id: ID of the session
@@ -321,16 +327,58 @@ def market_session(
     :param virtual_end: Number of virtual seconds before the session ends
     :param trader_spec: JSON data representing the number and types of traders on the market
     :param order_schedule: JSON data representing the supply/demand curve of the market
-    :param start_event: Event showing whether the market session is in progress
+    :param start_event: Event showing whether the market session is in progress (replaced by a process-safe Event
+                        when traders run in their own processes)
     :param verbose: Should additional information be printed to the console
+    :param dumpfile: File the session's trade_stats are written to; None for the module's tdump
+    :param output_dir: Directory the session's transactions.csv, tape file and latency file are written to; None for
+                       the working directory
     :return: Returns the number of threads operating at the end of the session. Used to check threads didn't crash.
     """
-    # initialise the exchange
-    exchange = Exchange()
-    order_q = queue.Queue()
-    kill_q = queue.Queue()
+    if dumpfile is None:
+        dumpfile = tdump
+    transactions_file = 'transactions.csv'
+    tape_file = config.tapeFile
+    latency_file = config.latencyFile
+    if output_dir is not None:
+        transactions_file = os.path.join(output_dir, transactions_file)
+        if tape_file is not None:
+            tape_file = os.path.join(output_dir, os.path.basename(tape_file))
+        if latency_file is not None:
+            latency_file = os.path.join(output_dir, os.path.basename(latency_file))
+    if config.timeMode == 'virtual':
+        return virtual_market_session(sess_id, sess_length, virtual_end, trader_spec, order_schedule, verbose,
+                                      dumpfile, transactions_file, tape_file, latency_file)
+
+    use_processes = config.traderExecution == 'process'
+    if use_processes:
+        # traders in other processes need process-safe queues and events, and read market data from shared memory
+        start_event = multiprocessing.Event()
+        order_q = multiprocessing.Queue()
+        kill_q = multiprocessing.Queue()
+        lob_ring = SharedRing(4, config.sharedRingSlotSize)
+        market_data = SharedRing(config.marketDataRingSize, config.sharedRingSlotSize)
+    else:
+        order_q = queue.Queue()
+        kill_q = queue.Queue()
+        lob_ring = None
+        market_data = BroadcastRing(config.marketDataRingSize)
+
+    seed = None
+    if config.eventLogDir is not None:
+        # seeded afresh and the seed recorded, so the traders and their shuffling can be recreated
+        seed = random.getrandbits(63)
+        random.seed(seed)
+    event_log = open_event_log(sess_id, seed)
+    metrics = None
+    if config.metricsDir is not None:
+        os.makedirs(config.metricsDir, exist_ok=True)
+        metrics = ExchangeMetrics(os.path.join(config.metricsDir, f'{sess_id}.metrics.csv'), config.metricsInterval)
 
-    start_time = time.time()
+    # initialise the exchange
+    exchange = Exchange(config.orderbookBackend, config.tapeWindow, tape_file)
+    if use_processes:
+        lob_ring.publish(exchange.publish_lob(0, False))
 
     orders_verbose = False
     process_verbose = False
@@ -339,36 +387,91 @@ def market_session(
     # create a bunch of traders
     traders = {}
     trader_threads = []
-    trader_qs = []
+    trader_processes = []
+    control_qs = []
+    result_q = multiprocessing.Queue() if use_processes else None
+    fill_qs = {}
     trader_stats = populate_market(trader_spec, traders, True, verbose)
+    order_stream = None
+    if config.precomputeOrders:
+        # batches drawn as the 10 ms main loop below would draw them
+        order_stream = precompute_customer_orders(order_schedule, trader_stats, virtual_end,
+                                                  0.01 * virtual_end / sess_length, config.orderSeed)
+    if config.traderWakeup == 'event':
+        wakeup_timeout = config.traderWakeupTimeout
+    else:
+        wakeup_timeout = None
 
-    # create threads and queues for traders
-    for i in range(0, len(traders)):
-        trader_qs.append(queue.Queue())
-        tid = list(traders.keys())[i]
-        trader_threads.append(threading.Thread(target=run_trader, args=(
-            traders[tid],
-            exchange,
-            order_q,
-            trader_qs[i],
-            start_event,
-            start_time,
-            sess_length,
-            virtual_end,
-            respond_verbose,
-            bookkeep_verbose)))
+    # the session clock starts once the traders and their customer orders are ready, so precomputing them takes
+    # none of the session's time
+    start_time = time.time()
+    shared_start_time = multiprocessing.Value('d', start_time) if use_processes else None
+
+    if use_processes:
+        # create a process for each group of traders, leaving proxies for them here
+        tids = list(traders.keys())
+        for i in range(0, len(tids), config.tradersPerProcess):
+            group = {tid: traders[tid] for tid in tids[i:i + config.tradersPerProcess]}
+            control_q = multiprocessing.Queue()
+            control_qs.append(control_q)
+            trader_processes.append(multiprocessing.Process(target=run_trader_group, args=(
+                group,
+                order_q,
+                kill_q,
+                control_q,
+                result_q,
+                lob_ring,
+                market_data,
+                start_event,
+                shared_start_time,
+                sess_length,
+                virtual_end,
+                wakeup_timeout,
+                respond_verbose,
+                bookkeep_verbose)))
+            for tid in group:
+                fill_qs[tid] = FillQueue(tid, control_q)
+                traders[tid] = TraderProxy(tid, control_q)
+        # start the session clock only once every trader process is up
+        for process in trader_processes:
+            process.start()
+        for _ in trader_processes:
+            result_q.get()
+        start_time = time.time()
+        shared_start_time.value = start_time
+    else:
+        # create threads and queues for traders
+        for (tid, trader) in traders.items():
+            fill_qs[tid] = queue.Queue()
+            trader_threads.append(threading.Thread(target=run_trader, args=(
+                trader,
+                exchange,
+                order_q,
+                market_data.reader(),
+                fill_qs[tid],
+                start_event,
+                start_time,
+                sess_length,
+                virtual_end,
+                wakeup_timeout,
+                respond_verbose,
+                bookkeep_verbose)))
 
     ex_thread = threading.Thread(
         target=run_exchange, args=(
             exchange,
             order_q,
-            trader_qs,
+            market_data,
+            fill_qs,
             kill_q,
             start_event,
             start_time,
             sess_length,
             virtual_end,
-            process_verbose,))
+            process_verbose,
+            lob_ring,
+            event_log,
+            metrics))
 
     # start exchange thread
     ex_thread.start()
@@ -380,6 +483,7 @@ def market_session(
     start_event.set()
 
     pending_cust_orders = []
+    next_order = 0  # index in order_stream of the next customer order to be issued
 
     if verbose:
         print(f'\n{sess_id};  ')
@@ -389,8 +493,19 @@ def market_session(
     while time.time() < (start_time + sess_length):
         virtual_time = (time.time() - start_time) * (virtual_end / sess_length)
         # distribute customer orders
-        [pending_cust_orders, kills, cuid] = customer_orders(virtual_time, cuid, traders, trader_stats,
-                                                             order_schedule, pending_cust_orders, orders_verbose)
+        if order_stream is None:
+            n_pending = len(pending_cust_orders)
+            [pending_cust_orders, kills, cuid] = customer_orders(virtual_time, cuid, traders, trader_stats,
+                                                                 order_schedule, pending_cust_orders, orders_verbose)
+            issued = len(pending_cust_orders) < n_pending
+        else:
+            n_issued = next_order
+            [next_order, kills] = issue_customer_orders(virtual_time, order_stream, next_order, traders,
+                                                        orders_verbose)
+            issued = next_order > n_issued
+        if issued:
+            # customer orders have been issued to traders
+            exchange.notify_traders()
         # if any newly-issued customer orders mean quotes on the LOB need to be cancelled, kill them
         if len(kills) > 0:
             if verbose:
@@ -405,21 +520,54 @@ def market_session(
         time.sleep(0.01)
 
     start_event.clear()
-    len_threads = len(threading.enumerate())
+    # main thread, exchange thread and trader threads still running (the tape writer thread is not counted)
+    len_threads = 1 + ex_thread.is_alive() + sum(thread.is_alive() for thread in trader_threads)
+    # wake any traders waiting for a market event, and the exchange, so they see the session has ended
+    exchange.notify_traders()
+    order_q.put(None)
+    for control_q in control_qs:
+        control_q.put(None)
 
     # close exchange thread
     ex_thread.join()
+    if event_log is not None:
+        event_log.close(virtual_end, len(exchange.tape))
+    if metrics is not None:
+        metrics.close(fill_qs)
 
     # close trader threads
     for thread in trader_threads:
         thread.join()
 
-    # end of an experiment -- dump the tape
-    exchange.tape_dump('transactions.csv', 'a', 'keep')
-
-    # write trade_stats for this experiment NB end-of-session summary only
+    # collect the traders, and the number of their threads that ran until the end, back from their processes
+    for _ in trader_processes:
+        try:
+            [group, n_finished] = result_q.get(timeout=10)
+        except queue.Empty:
+            break
+        traders.update(group)
+        len_threads += n_finished
+    for process in trader_processes:
+        process.join()
+    if use_processes:
+        # as in the trader processes, anything still queued for the exchange is discarded
+        order_q.cancel_join_thread()
+        kill_q.cancel_join_thread()
+        for ring in (lob_ring, market_data):
+            ring.close()
+            ring.unlink()
+
+    # end of an experiment -- the tape has been streamed to tape_file, optionally export its trades as CSV
+    if config.tapeCsv:
+        exchange.tape_dump(transactions_file, 'a', 'keep')
+    exchange.close()
+
+    # write trade_stats and latency_stats for this experiment NB end-of-session summary only
     if len_threads == len(traders) + 2:
-        trade_stats(sess_id, traders, tdump)
+        trade_stats(sess_id, traders, dumpfile)
+        if latency_file is not None:
+            with open(latency_file, 'a', encoding="utf-8") as latency_dump:
+                latency_stats(sess_id, traders, latency_dump)
 
     return len_threads
 
@@ -486,63 +634,22 @@ def real_world_schedule_offset_function(t, params):
     :return: The offset
     """
     end_time = float(params[0])
-    offset_events = params[1]
-    # this is quite inefficient: on every call it walks the event-list
-    # come back and make it better
+    [event_times, event_offsets] = params[1]
+    if len(event_times) < 1:
+        return 0
+    # the offset is that of the first event after the elapsed fraction of the session, or else of the last event
     percent_elapsed = t / end_time
-    offset = 0
-    for event in offset_events:
-        offset = event[1]
-        if percent_elapsed < event[0]:
-            break
-    return offset
+    i = bisect.bisect_right(event_times, percent_elapsed)
+    return event_offsets[min(i, len(event_offsets) - 1)]
 
-# pylint: disable:too-many-locals
 def get_offset_event_list():
     """
     read in a real-world-data data-file for the SDS offset function
-    having this here means it's only read in once
-    this is all quite skanky, just to get it up and running
-    assumes data file is all for one date, sorted in t order, in correct format, etc. etc.
-    :return: list of offset events
+    it is parsed only once, then loaded from memory or from config.inputCacheDir
+    :return: offset events as [normalised event times, offsets], two arrays in time order for bisection
     """
-    with open(config.input_file, 'r', encoding="utf-8") as input_file:
-        rwd_csv = csv.reader(input_file)
-        scale_factor = 80
-        # first pass: get t & price events, find out how long session is, get min & max price
-        min_price = None
-        max_price = None
-        first_time_obj = None
-        price_events = []
-        time_since_start = 0
-        for line in rwd_csv:
-            t = line[1]
-            if first_time_obj is None:
-                first_time_obj = datetime.strptime(t, '%H:%M:%S')
-            time_obj = datetime.strptime(t, '%H:%M:%S')
-            price = float(line[2])
-            if min_price is None or price < min_price:
-                min_price = price
-            if max_price is None or price > max_price:
-                max_price = price
-            time_since_start = (time_obj - first_time_obj).total_seconds()
-            price_events.append([time_since_start, price])
-        # second pass: normalise times to fractions of entire t-series duration
-        #              & normalise price range
-        price_range = max_price - min_price
-        end_time = float(time_since_start)
-        offset_function_event_list = []
-        for event in price_events:
-            # normalise price
-            normld_price = (event[1] - min_price) / price_range
-            # clip
-            normld_price = min(normld_price, 1.0)
-            normld_price = max(0.0, normld_price)
-            # scale & convert to integer cents
-            price = int(round(normld_price * scale_factor))
-            normld_event = [event[0] / end_time, price]
-            offset_function_event_list.append(normld_event)
-        return offset_function_event_list
+    scale_factor = 80
+    return load_offset_events(config.input_file, scale_factor, config.inputResolution, config.inputCacheDir)
 
 
 # # Below here is where we set up and run a series of experiments
@@ -610,48 +717,52 @@ if __name__ == "__main__":
 
         file_name = f"{str(NUM_ZIC).zfill(2)}-{str(NUM_ZIP).zfill(2)}-{str(NUM_GDX).zfill(2)}-" \
                     f"{str(NUM_AA).zfill(2)}-{str(NUM_GVWY).zfill(2)}-{str(NUM_SHVR).zfill(2)}.csv"
-        with open(file_name, 'w', encoding="utf-8") as tdump:
-
-            trader_count = 0
-            for ttype in buyers_spec:
-                trader_count += ttype[1]
-            for ttype in sellers_spec:
-                trader_count += ttype[1]
-
-            if trader_count > 40:
-                print("WARNING: Too many traders can cause unstable behaviour.")
-
-            trial = 1
-            if config.numTrials > 1:
-                dump_all = False
-            else:
-                dump_all = True
-
-            while trial < (config.numTrials + 1):
-                trial_id = f'trial{str(trial).zfill(7)}'
-                start_session_event = threading.Event()
-                try:
-                    NUM_THREADS = market_session(
-                        trial_id,
-                        config.sessionLength,
-                        config.virtualSessionLength,
-                        traders_spec,
-                        order_sched,
-                        start_session_event,
-                        False)
-
-                    if NUM_THREADS != trader_count + 2:
+        trader_count = 0
+        for ttype in buyers_spec:
+            trader_count += ttype[1]
+        for ttype in sellers_spec:
+            trader_count += ttype[1]
+
+        if trader_count > 40:
+            print("WARNING: Too many traders can cause unstable behaviour.")
+
+        if config.numWorkers > 1:
+            run_trials(market_session, [[file_name, f'trial{str(trial).zfill(7)}', traders_spec, order_sched]
+                        for trial in range(1, config.numTrials + 1)])
+        else:
+            with open(file_name, 'w', encoding="utf-8") as tdump:
+
+                trial = 1
+                if config.numTrials > 1:
+                    dump_all = False
+                else:
+                    dump_all = True
+
+                while trial < (config.numTrials + 1):
+                    trial_id = f'trial{str(trial).zfill(7)}'
+                    start_session_event = threading.Event()
+                    try:
+                        NUM_THREADS = market_session(
+                            trial_id,
+                            config.sessionLength,
+                            config.virtualSessionLength,
+                            traders_spec,
+                            order_sched,
+                            start_session_event,
+                            False)
+
+                        if not session_complete(trial_id, NUM_THREADS, trader_count):
+                            trial = trial - 1
+                            start_session_event.clear()
+                            time.sleep(0.5)
+                    except Exception as e:  # pylint: disable=broad-except
+                        print("Error: Market session failed, trying again.")
+                        print(e)
                         trial = trial - 1
                         start_session_event.clear()
                         time.sleep(0.5)
-                except Exception as e:  # pylint: disable=broad-except
-                    print("Error: Market session failed, trying again.")
-                    print(e)
-                    trial = trial - 1
-                    start_session_event.clear()
-                    time.sleep(0.5)
-                tdump.flush()
-                trial = trial + 1
+                    tdump.flush()
+                    trial = trial + 1
 
     # To use this section of code run TBSE with 'python3 tbse.py <csv>'
     # and have a CSV file with name <string>.csv with a list of values
@@ -679,6 +790,8 @@ if __name__ == "__main__":
             sys.exit()
 
         trial_number = 1
+        # trials queued for the trial pool when config.numWorkers > 1, run once every ratio has been read
+        trials = []
         for ratio in ratios:
             try:
                 NUM_ZIC = int(ratio[0])
@@ -724,6 +837,13 @@ if __name__ == "__main__":
                     if trader_count > 40:
                         print("WARNING: Too many traders can cause unstable behaviour.")
 
+                    if config.numWorkers > 1:
+                        for _ in range(config.numTrialsPerSchedule):
+                            trials.append([file_name, f'trial{str(trial_number).zfill(7)}', traders_spec,
+                                           order_sched])
+                            trial_number = trial_number + 1
+                        continue
+
                     trial = 1
                     while trial <= config.numTrialsPerSchedule:
                         trial_id = f'trial{str(trial_number).zfill(7)}'
@@ -736,7 +856,7 @@ if __name__ == "__main__":
                                                          order_sched,
                                                          start_session_event,
                                                          False)
-                            if NUM_THREADS != trader_count + 2:
+                            if not session_complete(trial_id, NUM_THREADS, trader_count):
                                 trial = trial - 1
                                 trial_number = trial_number - 1
                                 start_session_event.clear()
@@ -751,6 +871,9 @@ if __name__ == "__main__":
                         trial = trial + 1
                         trial_number = trial_number + 1
 
+        if trials:
+            run_trials(market_session, trials)
+
         sys.exit('Done Now')
 
     else:
@@ -0,0 +1,354 @@
+"""
+Benchmark suite for the exchange's matching path, run on the exchange alone with no traders or threads
+
+Each flow is a reproducible, seeded sequence of calls on a fresh Exchange. Micro flows time one method at a time;
+macro flows replay synthetic order flows through process_order2() and del_order() as run_exchange() does:
+    add          add_order() of non-crossing quotes from many traders
+    delete       del_order() of every order on a book resting at all 500 ticks
+    publish      publish_lob() of a book resting at all 500 ticks, each call first building the snapshot of the
+                 book after one of its quotes is replaced, as the first trader to wake after a change does
+    random_walk  quotes scattered about an equilibrium price that random walks a tick at a time
+    churn        quotes from a small crowd, each as likely to be cancelled as to be replaced
+    deep_book    quotes, a tenth of them crossing, against a book resting at all 500 ticks
+    overwrite    a handful of traders replacing their own quotes over and over
+Each flow is run for every order book backend: calls per second and per-call latency percentiles are taken over
+timed runs, and bytes allocated per call and peak memory over a separate run under tracemalloc. Results are printed
+and appended, with a label, to a CSV file; each row is compared with the first row of the file for the same backend
+and flow, so a change can be judged against a baseline:
+    $ python3 tbse_bench_exchange.py <results csv> <label> [calls per flow]
+"""
+import gc
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from tbse_exchange import Exchange
+from tbse_latency import LatencyHistogram
+from tbse_msg_classes import Order
+from tbse_sys_consts import TBSE_SYS_MAX_PRICE, TBSE_SYS_MIN_PRICE
+
+BACKENDS = ('levels', 'ladder')
+BENCH_SEED = 0
+BENCH_REPEATS = 3  # timed runs of each flow; the fastest gives calls per second
+RESULTS_HEADER = 'label, python, backend, flow, calls, seconds, calls per s, p50, p99, p99.9, max, ' \
+                 'bytes per call, peak bytes\n'
+MID_PRICE = (TBSE_SYS_MIN_PRICE + TBSE_SYS_MAX_PRICE) // 2
+
+
+class FlowBuilder:
+    """
+    Builds the calls of a flow: lists of [kind, order], kind being 'add' (add_order), 'order' (process_order2),
+    'kill' (del_order) or 'publish' (publish_lob, made once the order has replaced a resting quote untimed)
+    """
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.coid = 0
+        self.setup = []  # calls made before timing starts
+        self.calls = []
+
+    def order(self, tid, otype, price):
+        """
+        :param tid: Trader ID
+        :param otype: 'Bid' or 'Ask'
+        :param price: Price of the order
+        :return: New order of quantity 1 with the next customer order id
+        """
+        self.coid += 1
+        return Order(tid, otype, price, 1, self.coid * 0.001, self.coid, None)
+
+    def fill_book(self, per_tick):
+        """
+        Rests orders at every tick, bids on the lower half of the price range and asks on the upper half
+        :param per_tick: Orders resting at each tick
+        :return: The resting orders
+        """
+        resting = []
+        for price in range(TBSE_SYS_MIN_PRICE, TBSE_SYS_MAX_PRICE + 1):
+            otype = 'Bid' if price <= MID_PRICE else 'Ask'
+            for i in range(per_tick):
+                order = self.order(f'{otype[0]}{price:03d}{i}', otype, price)
+                self.setup.append(['order', order])
+                resting.append(order)
+        return resting
+
+
+def add_flow(builder, n_calls):
+    """
+    add_order() of quotes from 1000 traders a side, never crossing
+    :param builder: FlowBuilder the calls are added to
+    :param n_calls: Number of calls
+    """
+    for _ in range(n_calls):
+        otype = builder.rng.choice(('Bid', 'Ask'))
+        tid = f'{otype[0]}{builder.rng.randrange(1000):04d}'
+        if otype == 'Bid':
+            price = builder.rng.randint(TBSE_SYS_MIN_PRICE, MID_PRICE)
+        else:
+            price = builder.rng.randint(MID_PRICE + 1, TBSE_SYS_MAX_PRICE)
+        builder.calls.append(['add', builder.order(tid, otype, price)])
+
+
+def delete_flow(builder, n_calls):
+    """
+    del_order() of orders resting at all 500 ticks, in random order
+    :param builder: FlowBuilder the calls are added to
+    :param n_calls: Number of calls
+    """
+    resting = builder.fill_book(max(1, n_calls // (TBSE_SYS_MAX_PRICE - TBSE_SYS_MIN_PRICE + 1)))
+    builder.rng.shuffle(resting)
+    builder.calls.extend(['kill', order] for order in resting[:n_calls])
+
+
+def publish_flow(builder, n_calls):
+    """
+    publish_lob() of a book resting at all 500 ticks, after a random trader replaces its quote at the same price
+    :param builder: FlowBuilder the calls are added to
+    :param n_calls: Number of calls
+    """
+    resting = builder.fill_book(1)
+    for _ in range(n_calls):
+        order = builder.rng.choice(resting)
+        builder.calls.append(['publish', builder.order(order.tid, order.otype, order.price)])
+
+
+def random_walk_flow(builder, n_calls):
+    """
+    Quotes from 20 traders a side about an equilibrium price that random walks a tick at a time
+    :param builder: FlowBuilder the calls are added to
+    :param n_calls: Number of calls
+    """
+    equilibrium = MID_PRICE
+    for _ in range(n_calls):
+        equilibrium = min(max(equilibrium + builder.rng.choice((-1, 0, 1)), TBSE_SYS_MIN_PRICE + 20),
+                          TBSE_SYS_MAX_PRICE - 20)
+        otype = builder.rng.choice(('Bid', 'Ask'))
+        spread = builder.rng.randint(-2, 20)
+        price = equilibrium - spread if otype == 'Bid' else equilibrium + spread
+        builder.calls.append(['order', builder.order(f'{otype[0]}{builder.rng.randrange(20):02d}', otype, price)])
+
+
+def churn_flow(builder, n_calls):
+    """
+    Quotes from 10 traders a side, each call as likely to cancel a trader's last quote as to replace it
+    :param builder: FlowBuilder the calls are added to
+    :param n_calls: Number of calls
+    """
+    last_quotes = {}
+    for _ in range(n_calls):
+        otype = builder.rng.choice(('Bid', 'Ask'))
+        tid = f'{otype[0]}{builder.rng.randrange(10):02d}'
+        if tid in last_quotes and builder.rng.random() < 0.5:
+            builder.calls.append(['kill', last_quotes.pop(tid)])
+            continue
+        spread = builder.rng.randint(1, 30)
+        price = MID_PRICE - spread if otype == 'Bid' else MID_PRICE + spread
+        last_quotes[tid] = builder.order(tid, otype, price)
+        builder.calls.append(['order', last_quotes[tid]])
+
+
+def deep_book_flow(builder, n_calls):
+    """
+    Quotes from the traders resting at all 500 ticks, four to a tick, a tenth of them crossing the spread
+    :param builder: FlowBuilder the calls are added to
+    :param n_calls: Number of calls
+    """
+    resting = builder.fill_book(4)
+    for _ in range(n_calls):
+        order = builder.rng.choice(resting)
+        if builder.rng.random() < 0.1:
+            price = TBSE_SYS_MAX_PRICE if order.otype == 'Bid' else TBSE_SYS_MIN_PRICE
+        elif order.otype == 'Bid':
+            price = builder.rng.randint(TBSE_SYS_MIN_PRICE, MID_PRICE)
+        else:
+            price = builder.rng.randint(MID_PRICE + 1, TBSE_SYS_MAX_PRICE)
+        builder.calls.append(['order', builder.order(order.tid, order.otype, price)])
+
+
+def overwrite_flow(builder, n_calls):
+    """
+    Two traders a side replacing their own quotes near the spread, never crossing
+    :param builder: FlowBuilder the calls are added to
+    :param n_calls: Number of calls
+    """
+    for _ in range(n_calls):
+        otype = builder.rng.choice(('Bid', 'Ask'))
+        spread = builder.rng.randint(0, 10)
+        price = MID_PRICE - spread if otype == 'Bid' else MID_PRICE + 1 + spread
+        builder.calls.append(['order', builder.order(f'{otype[0]}{builder.rng.randrange(2):02d}', otype, price)])
+
+
+FLOWS = {
+    'add': add_flow,
+    'delete': delete_flow,
+    'publish': publish_flow,
+    'random_walk': random_walk_flow,
+    'churn': churn_flow,
+    'deep_book': deep_book_flow,
+    'overwrite': overwrite_flow
+}
+
+
+def build_flow(flow, n_calls):
+    """
+    :param flow: Name of the flow, a key of FLOWS
+    :param n_calls: Number of calls timed
+    :return: [setup calls, timed calls] of the flow, the same for every run as each flow has its own seed
+    """
+    builder = FlowBuilder(f'{BENCH_SEED}-{flow}')
+    FLOWS[flow](builder, n_calls)
+    return [builder.setup, builder.calls]
+
+
+def prepare_call(exchange, kind, order):
+    """
+    Makes the untimed part of one call of a flow: for 'publish', replaces a resting quote so the LOB has changed
+    :param exchange: Exchange object
+    :param kind: Kind of call, as listed by FlowBuilder
+    :param order: Order the call is made with
+    """
+    if kind == 'publish':
+        with exchange.lob_lock:
+            exchange.add_order(order, False)
+            exchange.snapshot_lob(0)
+
+
+def make_call(exchange, kind, order):
+    """
+    Makes one call of a flow on the exchange
+    :param exchange: Exchange object
+    :param kind: Kind of call, as listed by FlowBuilder
+    :param order: Order the call is made with
+    """
+    if kind == 'order':
+        exchange.process_order2(0, order, False)
+    elif kind == 'kill':
+        exchange.del_order(0, order)
+    elif kind == 'add':
+        exchange.add_order(order, False)
+    else:
+        exchange.publish_lob(0, False)
+
+
+def run_flow(backend, flow, n_calls, histogram=None):
+    """
+    Runs a flow on a fresh exchange
+    :param backend: Order book backend
+    :param flow: Name of the flow
+    :param n_calls: Number of calls timed
+    :param histogram: LatencyHistogram each call's latency is recorded to, or None to time only the whole run
+    :return: [number of calls, seconds taken by them]
+    """
+    [setup, calls] = build_flow(flow, n_calls)
+    exchange = Exchange(backend)
+    for [kind, order] in setup:
+        make_call(exchange, kind, order)
+    gc.collect()
+    if histogram is None and all(kind != 'publish' for [kind, _] in calls):
+        time1 = time.perf_counter_ns()
+        for [kind, order] in calls:
+            make_call(exchange, kind, order)
+        elapsed = time.perf_counter_ns() - time1
+    else:
+        # calls with an untimed part are timed one at a time, their latencies summed
+        elapsed = 0
+        for [kind, order] in calls:
+            prepare_call(exchange, kind, order)
+            time2 = time.perf_counter_ns()
+            make_call(exchange, kind, order)
+            latency = time.perf_counter_ns() - time2
+            elapsed += latency
+            if histogram is not None:
+                histogram.record(latency)
+    exchange.close()
+    return [len(calls), elapsed / 1e9]
+
+
+def measure_allocations(backend, flow, n_calls):
+    """
+    Runs a flow under tracemalloc, which slows it too much for its timings to be kept
+    :param backend: Order book backend
+    :param flow: Name of the flow
+    :param n_calls: Number of calls made
+    :return: [bytes allocated per call and still held at the end of the run, peak bytes allocated during it]
+    """
+    [setup, calls] = build_flow(flow, n_calls)
+    exchange = Exchange(backend)
+    for [kind, order] in setup:
+        make_call(exchange, kind, order)
+    gc.collect()
+    tracemalloc.start()
+    for [kind, order] in calls:
+        prepare_call(exchange, kind, order)
+        make_call(exchange, kind, order)
+    [current, peak] = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    exchange.close()
+    return [current / max(len(calls), 1), peak]
+
+
+def bench(backend, flow, n_calls):
+    """
+    Benchmarks a flow: one run timing each call, BENCH_REPEATS runs timing the whole flow, and one run under
+    tracemalloc
+    :param backend: Order book backend
+    :param flow: Name of the flow
+    :param n_calls: Number of calls made in each run
+    :return: [calls, seconds, calls per second, p50, p99, p99.9, max, bytes per call, peak bytes] for a flow, with
+             latencies in nanoseconds
+    """
+    histogram = LatencyHistogram()
+    run_flow(backend, flow, n_calls, histogram)
+    best = None
+    for _ in range(BENCH_REPEATS):
+        [calls, seconds] = run_flow(backend, flow, n_calls)
+        best = seconds if best is None else min(best, seconds)
+    [bytes_per_call, peak] = measure_allocations(backend, flow, n_calls)
+    return [calls, best, calls / best, histogram.percentile(50), histogram.percentile(99), histogram.percentile(99.9),
+            histogram.max, bytes_per_call, peak]
+
+
+def read_baselines(results_file, header=RESULTS_HEADER):
+    """
+    :param results_file: CSV file of earlier results
+    :param header: Header line of the file, giving the number of fields in a row
+    :return: Dictionary of the first row of the file for each pair of its third and fourth fields, as (backend,
+             flow), each row a list of its fields
+    """
+    baselines = {}
+    if os.path.isfile(results_file):
+        with open(results_file, encoding="utf-8") as results:
+            for line in results.readlines()[1:]:
+                row = [field.strip() for field in line.split(',')]
+                if len(row) == len(header.split(',')) and (row[2], row[3]) not in baselines:
+                    baselines[(row[2], row[3])] = row
+    return baselines
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [3, 4]:
+        sys.exit('Usage: python3 tbse_bench_exchange.py <results csv> <label> [calls per flow]')
+    results_name = sys.argv[1]
+    label = sys.argv[2]
+    calls_per_flow = int(sys.argv[3]) if len(sys.argv) == 4 else 20000
+    previous = read_baselines(results_name)
+    with open(results_name, 'a', encoding="utf-8") as results_out:
+        if results_out.tell() == 0:
+            results_out.write(RESULTS_HEADER)
+        print(f'{"backend":8} {"flow":12} {"calls/s":>10} {"p50":>7} {"p99":>7} {"p99.9":>7} {"max":>8} '
+              f'{"B/call":>7} {"peak KiB":>8}  vs baseline')
+        for bench_backend in BACKENDS:
+            for bench_flow in FLOWS:
+                result = bench(bench_backend, bench_flow, calls_per_flow)
+                results_out.write(f'{label}, {platform.python_version()}, {bench_backend}, {bench_flow}, '
+                                  f'{result[0]}, {result[1]:.6f}, {result[2]:.0f}, {result[3]}, {result[4]}, '
+                                  f'{result[5]}, {result[6]}, {result[7]:.1f}, {result[8]}\n')
+                results_out.flush()
+                comparison = ''
+                if (bench_backend, bench_flow) in previous:
+                    baseline = previous[(bench_backend, bench_flow)]
+                    comparison = f'{result[2] / float(baseline[6]):.2f}x calls/s of {baseline[0]}'
+                print(f'{bench_backend:8} {bench_flow:12} {result[2]:10.0f} {result[3]:7} {result[4]:7} '
+                      f'{result[5]:7} {result[6]:8} {result[7]:7.1f} {result[8] / 1024:8.1f}  {comparison}')
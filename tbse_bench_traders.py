@@ -0,0 +1,206 @@
+"""
+Benchmark suite for the decision latency of the trader algorithms, run with no exchange thread or trader threads
+
+A market is recorded once, as the LOB and any trade after each order and kill: either replayed from a session's
+event log (see tbse_replay.py), or made by feeding a seeded random walk flow from tbse_bench_exchange.py through an
+exchange. Every trader type is then driven through that same market, a group of buyers and sellers at a time, each
+trader responding to every event and then being asked for an order, as if it woke after each one. Customer orders
+are reissued every ORDER_PERIOD events, from a seeded generator, so every type faces the same customers; the
+traders' own random numbers are seeded too, so a run is reproducible.
+For each type, latency percentiles of respond() and get_order() are taken over BENCH_REPEATS runs, and memory growth
+over a separate run under tracemalloc, from the end of its first tenth to its end. Results are printed and
+appended, with a label, to a CSV file; each row is compared with the first row of the file for the same market and
+trader type, so a slowdown in an algorithm shows up against a baseline:
+    $ python3 tbse_bench_traders.py <results csv> <label> [events | event log]
+"""
+import gc
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from tbse_bench_exchange import build_flow, read_baselines
+from tbse_latency import CALL_SITES, LatencyHistogram
+from tbse_msg_classes import Order
+from tbse_replay import read_event_log, replay
+from tbse_trader_agents import TraderGiveaway, TraderShaver, TraderSniper, TraderZic, TraderZip, TraderAa, \
+    TraderGdx, GDX_VALUE_TABLES
+
+TRADER_TYPES = {
+    'GVWY': TraderGiveaway,
+    'ZIC': TraderZic,
+    'SHVR': TraderShaver,
+    'SNPR': TraderSniper,
+    'ZIP': TraderZip,
+    'AA': TraderAa,
+    'GDX': TraderGdx
+}
+BENCH_SEED = 0
+BENCH_REPEATS = 3  # timed runs of each trader type, their latencies merged
+TRADERS_PER_SIDE = 5
+ORDER_PERIOD = 50  # events between customer orders
+SYNTHETIC_END = 600  # virtual seconds a synthetic market lasts, as a default session does
+RESULTS_HEADER = 'label, python, market, ttype, events, get_order mean, get_order p50, get_order p99, ' \
+                 'get_order p99.9, get_order max, respond mean, respond p50, respond p99, respond p99.9, ' \
+                 'respond max, memory growth\n'
+
+
+def record_market(header, events):
+    """
+    :param header: Header of an event log, as returned by read_event_log()
+    :param events: Events of an event log, as returned by read_event_log()
+    :return: [end time, market], the market a list of [virtual time, LOB, trade or None] after each order and kill
+    """
+    market = []
+    replay(header, events, lambda virtual_time, lob, trade: market.append([virtual_time, lob, trade]))
+    end_time = events[-1][1] if len(events) > 0 and events[-1][0] == 'End' else market[-1][0]
+    return [end_time, market]
+
+
+def synthetic_market(n_events):
+    """
+    :param n_events: Number of orders in the market
+    :return: [end time, market] as returned by record_market(), from the random walk flow of tbse_bench_exchange.py
+             spread evenly over SYNTHETIC_END virtual seconds
+    """
+    [_, calls] = build_flow('random_walk', n_events)
+    events = [['Order', i * SYNTHETIC_END / n_events, order] for (i, [_, order]) in enumerate(calls)]
+    return record_market([None, 'levels', 10], events)
+
+
+def issue_orders(traders, rng, virtual_time):
+    """
+    Replaces each trader's customer order with a new one, limits scattered about the middle of the price range
+    :param traders: List of the traders
+    :param rng: Random generator of the limit prices
+    :param virtual_time: Time the orders are issued
+    """
+    for trader in traders:
+        for coid in list(trader.orders):
+            trader.del_order(coid)
+        trader.n_quotes = 0
+        if trader.tid[0] == 'B':
+            trader.add_order(Order(trader.tid, 'Bid', rng.randint(230, 290), 1, virtual_time, rng.getrandbits(32),
+                                   None), False)
+        else:
+            trader.add_order(Order(trader.tid, 'Ask', rng.randint(210, 270), 1, virtual_time, rng.getrandbits(32),
+                                   None), False)
+
+
+def wake_traders(traders, event, time_left, latency):
+    """
+    Has each trader respond to an event of the market and then asks it for an order, as if it woke after the event
+    :param traders: List of the traders
+    :param event: [virtual time, LOB, trade or None], as recorded by record_market()
+    :param time_left: Fraction of the market's time still to run
+    :param latency: Dictionary of LatencyHistogram, indexed by call site, each call is recorded to; None to not time
+    """
+    [virtual_time, lob, trade] = event
+    for trader in traders:
+        time1 = time.perf_counter_ns()
+        trader.respond(virtual_time, lob, trade, False)
+        time2 = time.perf_counter_ns()
+        order = trader.get_order(virtual_time, time_left, lob)
+        time3 = time.perf_counter_ns()
+        if order is not None:
+            trader.n_quotes = 1
+        if latency is not None:
+            latency['respond'].record(time2 - time1)
+            latency['get_order'].record(time3 - time2)
+
+
+def run_traders(ttype, end_time, market, latency=None, memory_from=None):
+    """
+    Drives a fresh group of traders of one type through a recorded market
+    :param ttype: Trader type, a key of TRADER_TYPES
+    :param end_time: Virtual time at which the market ends
+    :param market: Market as returned by record_market()
+    :param latency: Dictionary of LatencyHistogram, indexed by call site, each call is recorded to; None to not time
+    :param memory_from: Index of the event from which tracemalloc traces memory; None to not trace
+    :return: Bytes of memory allocated from memory_from to the end and still held, or None if not traced
+    """
+    random.seed(f'{BENCH_SEED}-{ttype}')
+    GDX_VALUE_TABLES.clear()
+    rng = random.Random(BENCH_SEED)
+    traders = [TRADER_TYPES[ttype](ttype, f'{side}{i:02d}', 0.00, 0)
+               for side in ('B', 'S') for i in range(TRADERS_PER_SIDE)]
+    gc.collect()
+    memory_start = None
+    for (i, event) in enumerate(market):
+        if i == memory_from:
+            tracemalloc.start()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        if i % ORDER_PERIOD == 0:
+            issue_orders(traders, rng, event[0])
+        wake_traders(traders, event, (end_time - event[0]) / end_time, latency)
+    if memory_start is None:
+        return None
+    growth = tracemalloc.get_traced_memory()[0] - memory_start
+    tracemalloc.stop()
+    return growth
+
+
+def bench(ttype, end_time, market):
+    """
+    Benchmarks a trader type: BENCH_REPEATS runs timing each call, and one run under tracemalloc
+    :param ttype: Trader type, a key of TRADER_TYPES
+    :param end_time: Virtual time at which the market ends
+    :param market: Market as returned by record_market()
+    :return: [dictionary of LatencyHistogram indexed by call site, bytes of memory growth]
+    """
+    latency = {call: LatencyHistogram() for call in CALL_SITES}
+    for _ in range(BENCH_REPEATS):
+        run_traders(ttype, end_time, market, latency)
+    growth = run_traders(ttype, end_time, market, memory_from=len(market) // 10)
+    return [latency, growth]
+
+
+def summarise(histogram):
+    """
+    :param histogram: LatencyHistogram
+    :return: [mean, p50, p99, p99.9, max] of the histogram's latencies
+    """
+    return [histogram.mean(), histogram.percentile(50), histogram.percentile(99), histogram.percentile(99.9),
+            histogram.max]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [3, 4]:
+        sys.exit('Usage: python3 tbse_bench_traders.py <results csv> <label> [events | event log]')
+    results_name = sys.argv[1]
+    label = sys.argv[2]
+    market_source = sys.argv[3] if len(sys.argv) == 4 else '5000'
+    if market_source.isdigit():
+        market_name = f'random_walk-{market_source}'
+        [market_end, recorded_market] = synthetic_market(int(market_source))
+    else:
+        market_name = os.path.basename(market_source)
+        with open(market_source, 'rb') as in_file:
+            [market_end, recorded_market] = record_market(*read_event_log(in_file))
+    previous = read_baselines(results_name, RESULTS_HEADER)
+    print(f'market {market_name}: {len(recorded_market)} events, {TRADERS_PER_SIDE} buyers and sellers of each type; '
+          f'latencies in ns')
+    print(f'{"ttype":5} {"get_order":>9} {"p50":>7} {"p99":>7} {"p99.9":>8} {"max":>9} {"respond":>8} {"p50":>7} '
+          f'{"p99":>7} {"p99.9":>8} {"max":>9} {"mem KiB":>8}  vs baseline')
+    with open(results_name, 'a', encoding="utf-8") as results_out:
+        if results_out.tell() == 0:
+            results_out.write(RESULTS_HEADER)
+        for bench_type in TRADER_TYPES:
+            [histograms, memory_growth] = bench(bench_type, market_end, recorded_market)
+            get_order = summarise(histograms['get_order'])
+            respond = summarise(histograms['respond'])
+            results_out.write(f'{label}, {platform.python_version()}, {market_name}, {bench_type}, '
+                              f'{len(recorded_market)}, {get_order[0]:.0f}, {get_order[1]}, {get_order[2]}, '
+                              f'{get_order[3]}, {get_order[4]}, {respond[0]:.0f}, {respond[1]}, {respond[2]}, '
+                              f'{respond[3]}, {respond[4]}, {memory_growth}\n')
+            results_out.flush()
+            comparison = ''
+            if (market_name, bench_type) in previous:
+                baseline = previous[(market_name, bench_type)]
+                comparison = f'{get_order[0] / max(float(baseline[5]), 1):.2f}x get_order and ' \
+                             f'{respond[0] / max(float(baseline[10]), 1):.2f}x respond mean of {baseline[0]}'
+            print(f'{bench_type:5} {get_order[0]:9.0f} {get_order[1]:7} {get_order[2]:7} {get_order[3]:8} '
+                  f'{get_order[4]:9} {respond[0]:8.0f} {respond[1]:7} {respond[2]:7} {respond[3]:8} {respond[4]:9} '
+                  f'{memory_growth / 1024:8.1f}  {comparison}')
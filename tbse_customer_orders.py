@@ -1,8 +1,11 @@
 """
 Module containing code for production of customer orders
 """
+import bisect
+import heapq
 import random
 import sys
+from array import array
 
 import config
 from tbse_msg_classes import Order
@@ -19,7 +22,7 @@ def customer_orders(time, coid, traders, trader_stats, order_sched, pending, ver
     :param traders: List of traders
     :param trader_stats: number of buyers and number of sellers
     :param order_sched: order schedule
-    :param pending: pending orders to be distributed
+    :param pending: pending orders to be distributed, as a heap of (issue time, coid, order)
     :param verbose: should verbose logging be printed to console
     :return: List containing left over pending orders, cancellations to be made and the final customer ID used
     """
@@ -217,7 +220,7 @@ def customer_orders(time, coid, traders, trader_stats, order_sched, pending, ver
             t_name = f'B{str(t).zfill(2)}'
             order_price = get_order_price(t, sched, sched_end, n_buyers, mode, issue_time)
             order = Order(t_name, order_type, order_price, 1, issue_time, coid, -3.14)
-            new_pending.append(order)
+            heapq.heappush(new_pending, (issue_time, coid, order))
             coid += 1
 
         # supply side (sellers)
@@ -229,25 +232,103 @@ def customer_orders(time, coid, traders, trader_stats, order_sched, pending, ver
             t_name = f'S{str(t).zfill(2)}'
             order_price = get_order_price(t, sched, sched_end, n_sellers, mode, issue_time)
             order = Order(t_name, order_type, order_price, 1, issue_time, coid, -3.14)
-            new_pending.append(order)
+            heapq.heappush(new_pending, (issue_time, coid, order))
             coid += 1
     else:
-        # there are pending future orders: issue any whose timestamp is in the past
-        new_pending = []
-        for order in pending:
-            if order.time < time:
-                # this order should have been issued by now
-                # issue it to the trader
-                t_name = order.tid
-                response = traders[t_name].add_order(order, verbose)
+        # there are pending future orders: issue any whose timestamp has been reached, earliest first
+        new_pending = pending
+        while len(new_pending) > 0 and new_pending[0][0] <= time:
+            # this order should have been issued by now
+            # issue it to the trader, taking it off the pending heap
+            order = heapq.heappop(new_pending)[2]
+            t_name = order.tid
+            response = traders[t_name].add_order(order, verbose)
+            if verbose:
+                print(f'Customer order: {response} {order}')
+            if response == 'LOB_Cancel':
+                cancellations.append(t_name)
                 if verbose:
-                    print(f'Customer order: {response} {order}')
-                if response == 'LOB_Cancel':
-                    cancellations.append(t_name)
-                    if verbose:
-                        print(f'Cancellations: {cancellations}')
-                # and then don't add it to new_pending (i.e., delete it)
-            else:
-                # this order stays on the pending list
-                new_pending.append(order)
+                    print(f'Cancellations: {cancellations}')
     return [new_pending, cancellations, coid]
+
+
+def next_issue_time(pending):
+    """
+    :param pending: pending orders, as returned by customer_orders()
+    :return: The time the next pending order is due to be issued, or None if there are none left
+    """
+    if len(pending) < 1:
+        return None
+    return pending[0][0]
+
+
+# Precomputed customer order streams, indexed by (id(order_sched), seed, n_buyers, n_sellers, end time, batch gap),
+# each held as [order_sched, stream] so a recycled id() is never mistaken for the schedule it was computed from
+PRECOMPUTED = {}
+
+
+def precompute_customer_orders(order_sched, trader_stats, end_time, gap, seed=None):
+    """
+    Generates every customer order of a session up front, with the same generator customer_orders() uses, so the
+    market loop only has to index into them. Batches follow one another as they do live: each is drawn gap after
+    the last order of the previous batch is issued.
+    Streams drawn from a seed are cached, so every session run with the same order schedule and seed reuses them.
+    :param order_sched: order schedule
+    :param trader_stats: number of buyers and number of sellers
+    :param end_time: time the session ends
+    :param gap: time between the last order of a batch being issued and the next batch being drawn
+    :param seed: seed for the random numbers drawn, or None to draw from the global random state without caching
+    :return: Dictionary of columns, sorted by issue time: 'times' and 'coids' arrays, 'tids', 'otypes' and 'prices'
+    """
+    key = (id(order_sched), seed, trader_stats['n_buyers'], trader_stats['n_sellers'], end_time, gap)
+    if seed is not None and key in PRECOMPUTED and PRECOMPUTED[key][0] is order_sched:
+        return PRECOMPUTED[key][1]
+
+    if seed is not None:
+        # draw from the seed without disturbing anyone else's random numbers
+        state = random.getstate()
+        random.seed(seed)
+    stream = {'times': array('d'), 'coids': array('q'), 'tids': [], 'otypes': [], 'prices': []}
+    batch_time = 0.0
+    coid = 0
+    while batch_time < end_time:
+        # with nothing pending, customer_orders() draws a new batch without issuing any of it
+        [batch, _, coid] = customer_orders(batch_time, coid, {}, trader_stats, order_sched, [], False)
+        batch.sort()
+        for (issue_time, order_coid, order) in batch:
+            stream['times'].append(issue_time)
+            stream['coids'].append(order_coid)
+            stream['tids'].append(order.tid)
+            stream['otypes'].append(order.otype)
+            stream['prices'].append(order.price)
+        batch_time = batch[-1][0] + gap
+    if seed is not None:
+        random.setstate(state)
+        PRECOMPUTED[key] = [order_sched, stream]
+    return stream
+
+
+def issue_customer_orders(time, stream, cursor, traders, verbose):
+    """
+    Issues the precomputed customer orders whose issue time has been reached
+    :param time: current time
+    :param stream: customer orders, as returned by precompute_customer_orders()
+    :param cursor: index in stream of the next order to be issued
+    :param traders: List of traders
+    :param verbose: should verbose logging be printed to console
+    :return: List containing the index of the next order to be issued and cancellations to be made
+    """
+    end = bisect.bisect_right(stream['times'], time, cursor)
+    cancellations = []
+    for i in range(cursor, end):
+        t_name = stream['tids'][i]
+        order = Order(t_name, stream['otypes'][i], stream['prices'][i], 1, stream['times'][i], stream['coids'][i],
+                      -3.14)
+        response = traders[t_name].add_order(order, verbose)
+        if verbose:
+            print(f'Customer order: {response} {order}')
+        if response == 'LOB_Cancel':
+            cancellations.append(t_name)
+            if verbose:
+                print(f'Cancellations: {cancellations}')
+    return [end, cancellations]
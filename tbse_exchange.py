@@ -3,15 +3,42 @@ Module containing classes for describing a simulated exchange
 
 Minor adaptions from the original BSE code by Dave Cliff
 """
+import bisect
 import sys
+import threading
+from array import array
+from types import MappingProxyType
 
-from tbse_sys_consts import TBSE_SYS_MIN_PRICE, TBSE_SYS_MAX_PRICE
+from tbse_sys_consts import TBSE_SYS_MIN_PRICE, TBSE_SYS_MAX_PRICE, TICK_SIZE
+from tbse_tape import Tape, export_csv
+
+
+# pylint: disable=too-few-public-methods
+class LobEntry:
+    """
+    An order resting in a price level's queue: its time, quantity, trader id, trader order id and arrival sequence
+    number; slotted, as one is allocated for every order added to the book
+    """
+    __slots__ = ('time', 'qty', 'tid', 'toid', 'seq')
+
+    def __init__(self, order, seq):
+        """
+        :param order: Order being added to the book
+        :param seq: Arrival sequence number of the trader's resting order, its place in time priority
+        """
+        self.time = order.time
+        self.qty = order.qty
+        self.tid = order.tid
+        self.toid = order.toid
+        self.seq = seq
 
 
 # pylint: disable=too-many-instance-attributes
 class OrderbookHalf:
     """
     OrderbookHalf is one side of the book: a list of bids or a list of asks, each sorted best-first
+    The book is maintained incrementally: every add, overwrite, cancel and fill updates only the price level it
+    touches, rather than rebuilding the whole lob from the order dictionary.
     """
     def __init__(self, book_type, worst_price):
         # book_type: bids or asks?
@@ -20,8 +47,21 @@ class OrderbookHalf:
         self.orders = {}
         # limit order book, dictionary indexed by price, with order info
         self.lob = {}
-        # anonymized LOB, lists, with only price/qty info
-        self.lob_anon = []
+        # prices currently on the lob, sorted ascending
+        self.prices = []
+        # arrival sequence number of each trader's resting order: an overwrite keeps its place in the queue
+        self.seqs = {}
+        self.next_seq = 0
+        # anonymized LOB, tuples, with only price/qty info, rebuilt lazily when the book has changed
+        self.anon = ()
+        self.anon_stale = False
+        # count of changes to this side of the book, and the read-only summary last published for it
+        self.version = 0
+        self.published = None
+        # count of the changes traders can see: an overwrite at the same price and quantity leaves the summary as it
+        # was, and the version the last published summary was checked at
+        self.visible_version = 0
+        self.published_version = None
         # summary stats
         self.best_price = None
         self.best_tid = None
@@ -29,54 +69,106 @@ class OrderbookHalf:
         self.n_orders = 0  # how many orders?
         self.lob_depth = 0  # how many different prices on lob?
 
+    @property
+    def lob_anon(self):
+        """
+        :return: anonymized LOB, a tuple of (price, qty) sorted by ascending price
+        """
+        if self.anon_stale:
+            self.anonymize_lob()
+        return self.anon
+
     def anonymize_lob(self):
         """
         anonymize a lob, strip out order details, format as a sorted list
         NB for asks, the sorting should be reversed
         """
-        self.lob_anon = []
-        for price in list(sorted(self.lob)):
-            qty = self.lob[price][0]
-            self.lob_anon.append([price, qty])
+        self.anon = tuple((price, self.lob[price][0]) for price in self.prices)
+        self.anon_stale = False
 
-    def build_lob(self):
-        """"
-        take a list of orders and build a limit-order-book (lob) from it
-        NB the exchange needs to know arrival times and trader-id associated with each order
-        returns lob as a dictionary (i.e., unsorted)
-        also builds anonymized version (just price/quantity, sorted, as a list) for publishing to traders
+    @staticmethod
+    def queue_index(order_list, seq):
         """
-        lob_verbose = False
-        self.lob = {}
-
-        for tid in list(self.orders):
-            # 	order = orders_cp.get(tid)
-            order = self.orders.get(tid)
-            price = order.price
-            if price in self.lob:
-                # update existing entry
-                qty = self.lob[price][0]
-                order_list = self.lob[price][1]
-                order_list.append([order.time, order.qty, order.tid, order.toid])
-                self.lob[price] = [qty + order.qty, order_list]
+        binary search of a price level's queue, which is sorted by arrival sequence number
+        :param order_list: queue of LobEntry entries at one price
+        :param seq: Arrival sequence number
+        :return: Index of the first entry in the queue that arrived at or after seq
+        """
+        low = 0
+        high = len(order_list)
+        while low < high:
+            mid = (low + high) // 2
+            if order_list[mid].seq < seq:
+                low = mid + 1
             else:
-                # create a new dictionary entry
-                self.lob[price] = [order.qty, [[order.time, order.qty, order.tid, order.toid]]]
-        # create anonymized version
-        self.anonymize_lob()
-        # record best price and associated trader-id
-        if len(self.lob) > 0:
+                high = mid
+        return low
+
+    def enqueue(self, order_list, entry):
+        """
+        insert an entry into a price level's queue, behind every order that arrived before it
+        an overwrite that moved price keeps its original place in time priority
+        :param order_list: queue of LobEntry entries at one price
+        :param entry: LobEntry to be inserted
+        """
+        if len(order_list) == 0 or order_list[-1].seq < entry.seq:
+            order_list.append(entry)
+        else:
+            order_list.insert(self.queue_index(order_list, entry.seq), entry)
+
+    def dequeue(self, order_list, tid):
+        """
+        remove a trader's entry from a price level's queue
+        :param order_list: queue of LobEntry entries at one price
+        :param tid: Trader ID of the entry to be removed, which must still have its arrival sequence number
+        """
+        del order_list[self.queue_index(order_list, self.seqs[tid])]
+
+    def level_add(self, order):
+        """
+        add an order to the queue at its price level, creating the level if needed
+        queues are kept in arrival sequence, so the head of each queue is the earliest resting order
+        :param order: Order to be added
+        """
+        price = order.price
+        entry = LobEntry(order, self.seqs[order.tid])
+        level = self.lob.get(price)
+        if level is None:
+            self.lob[price] = [order.qty, [entry]]
+            bisect.insort(self.prices, price)
+        else:
+            self.enqueue(level[1], entry)
+            level[0] += order.qty
+
+    def level_del(self, order):
+        """
+        remove an order from the queue at its price level, removing the level if it is now empty
+        :param order: Order to be removed, must currently be resting on the book
+        """
+        price = order.price
+        level = self.lob[price]
+        order_list = level[1]
+        self.dequeue(order_list, order.tid)
+        level[0] -= order.qty
+        if len(order_list) == 0:
+            del self.lob[price]
+            del self.prices[bisect.bisect_left(self.prices, price)]
+
+    def update_best(self):
+        """
+        record best price and associated trader-id, and flag the anonymized lob as out of date
+        """
+        if len(self.prices) > 0:
             if self.book_type == 'Bid':
-                self.best_price = self.lob_anon[-1][0]
+                self.best_price = self.prices[-1]
             else:
-                self.best_price = self.lob_anon[0][0]
-            self.best_tid = self.lob[self.best_price][1][0][2]
+                self.best_price = self.prices[0]
+            self.best_tid = self.lob[self.best_price][1][0].tid
         else:
             self.best_price = None
             self.best_tid = None
-
-        if lob_verbose:
-            print(self.lob)
+        self.lob_depth = len(self.prices)
+        self.anon_stale = True
 
     def book_add(self, order):
         """
@@ -84,17 +176,26 @@ class OrderbookHalf:
         either overwrites old order from this trader
         or dynamically creates new entry in the dictionary
         so, max of one order per trader per list
-        checks whether length or order list has changed, to distinguish addition/overwrite
+        :param order: Order to be added
+        :return: 'Addition' if the trader had no order on this side of the book, 'Overwrite' otherwise
         """
-
-        n_orders = self.n_orders
+        old_order = self.orders.get(order.tid)
+        if old_order is None:
+            self.seqs[order.tid] = self.next_seq
+            self.next_seq += 1
+            response = 'Addition'
+            self.visible_version += 1
+        else:
+            self.level_del(old_order)
+            response = 'Overwrite'
+            if old_order.price != order.price or old_order.qty != order.qty:
+                self.visible_version += 1
         self.orders[order.tid] = order
         self.n_orders = len(self.orders)
-        self.build_lob()
-
-        if n_orders != self.n_orders:
-            return 'Addition'
-        return 'Overwrite'
+        self.level_add(order)
+        self.update_best()
+        self.version += 1
+        return response
 
     def book_del(self, order):
         """
@@ -103,11 +204,33 @@ class OrderbookHalf:
         checks that the Trader ID does actually exist in the dict before deletion
         :param order: Order to be deleted
         """
-
-        if self.orders.get(order.tid) is not None:
+        old_order = self.orders.get(order.tid)
+        if old_order is not None:
+            self.level_del(old_order)
             del self.orders[order.tid]
+            del self.seqs[order.tid]
             self.n_orders = len(self.orders)
-            self.build_lob()
+            self.update_best()
+            self.version += 1
+            self.visible_version += 1
+
+    def publish(self):
+        """
+        read-only summary of this side of the book, as published to traders
+        the same object is returned until this side of the book changes in a way traders can see
+        :return: mapping of best price, worst price, number of orders, anonymized lob and visible version
+        """
+        if self.published_version != self.version:
+            self.published_version = self.version
+            if self.published is None or self.published['version'] != self.visible_version:
+                self.published = MappingProxyType({
+                    'best': self.best_price,
+                    'worst': self.worst_price,
+                    'n': self.n_orders,
+                    'lob': self.lob_anon,
+                    'version': self.visible_version
+                })
+        return self.published
 
     def delete_best(self):
         """
@@ -115,33 +238,100 @@ class OrderbookHalf:
         the TraderID of the deleted order is return-value, as counterparty to the trade
         :return: Trader ID of the counterparty to the trade
         """
-        best_price_orders = self.lob[self.best_price]
-        best_price_qty = best_price_orders[0]
-        best_price_counterparty = best_price_orders[1][0][2]
-        if best_price_qty == 1:
-            # here the order deletes the best price
-            del self.lob[self.best_price]
-            del self.orders[best_price_counterparty]
-            self.n_orders = self.n_orders - 1
-            if self.n_orders > 0:
-                if self.book_type == 'Bid':
-                    self.best_price = max(self.lob.keys())
-                else:
-                    self.best_price = min(self.lob.keys())
-                self.lob_depth = len(self.lob.keys())
+        best_price_counterparty = self.best_tid
+        self.book_del(self.orders[best_price_counterparty])
+        return best_price_counterparty
+
+
+class OrderbookLadderHalf(OrderbookHalf):
+    """
+    OrderbookHalf backed by a dense price ladder: one slot per tick from TBSE_SYS_MIN_PRICE to TBSE_SYS_MAX_PRICE,
+    each holding the total quantity and the queue of orders at that price, so an order reaches its queue by
+    indexing rather than hashing. The occupied ticks are kept in the sorted prices list, as for the levels backend,
+    so the best price and the anonymized lob never walk the empty ticks between them. Quotes outside the system
+    price range grow the ladder rather than being rejected.
+    The lob dictionary is not used by this backend.
+    """
+    def __init__(self, book_type, worst_price):
+        super().__init__(book_type, worst_price)
+        # price held in slot 0 of the ladder
+        self.base_price = TBSE_SYS_MIN_PRICE
+        n_ticks = (TBSE_SYS_MAX_PRICE - TBSE_SYS_MIN_PRICE) // TICK_SIZE + 1
+        # total quantity at each tick
+        self.qtys = array('l', [0]) * n_ticks
+        # queue of LobEntry entries at each tick, None if nothing rests there
+        self.queues = [None] * n_ticks
+
+    def slot(self, price):
+        """
+        find the ladder slot for a price, growing the ladder if the price lies outside it
+        prices are whole ticks, but customer order prices may arrive as integral floats
+        :param price: Price of an order
+        :return: Index of the slot holding that price
+        """
+        i = int((price - self.base_price) // TICK_SIZE)
+        if i < 0:
+            self.qtys = array('l', [0]) * -i + self.qtys
+            self.queues = [None] * -i + self.queues
+            self.base_price += i * TICK_SIZE
+            i = 0
+        elif i >= len(self.queues):
+            n_new = i - len(self.queues) + 1
+            self.qtys.extend(array('l', [0]) * n_new)
+            self.queues.extend([None] * n_new)
+        return i
+
+    def anonymize_lob(self):
+        """
+        anonymize a lob, strip out order details, format as a sorted list
+        visits only the occupied ticks
+        """
+        qtys = self.qtys
+        base_price = self.base_price
+        self.anon = tuple((price, qtys[(price - base_price) // TICK_SIZE]) for price in self.prices)
+        self.anon_stale = False
+
+    def level_add(self, order):
+        """
+        add an order to the queue at its tick, recording the tick as occupied if it was empty
+        :param order: Order to be added
+        """
+        i = self.slot(order.price)
+        entry = LobEntry(order, self.seqs[order.tid])
+        if self.queues[i] is None:
+            self.queues[i] = [entry]
+            bisect.insort(self.prices, self.base_price + i * TICK_SIZE)
+        else:
+            self.enqueue(self.queues[i], entry)
+        self.qtys[i] += order.qty
+
+    def level_del(self, order):
+        """
+        remove an order from the queue at its tick, recording the tick as empty if that was its last order
+        :param order: Order to be removed, must currently be resting on the book
+        """
+        i = self.slot(order.price)
+        self.dequeue(self.queues[i], order.tid)
+        self.qtys[i] -= order.qty
+        if len(self.queues[i]) == 0:
+            self.queues[i] = None
+            del self.prices[bisect.bisect_left(self.prices, self.base_price + i * TICK_SIZE)]
+
+    def update_best(self):
+        """
+        record best price and associated trader-id, and flag the anonymized lob as out of date
+        """
+        if len(self.prices) > 0:
+            if self.book_type == 'Bid':
+                self.best_price = self.prices[-1]
             else:
-                self.best_price = self.worst_price
-                self.lob_depth = 0
+                self.best_price = self.prices[0]
+            self.best_tid = self.queues[self.slot(self.best_price)][0].tid
         else:
-            # best_bid_qty>1 so the order decrements the quantity of the best bid
-            # update the lob with the decremented order data
-            self.lob[self.best_price] = [best_price_qty - 1, best_price_orders[1][1:]]
-
-            # update the bid list: counterparty's bid has been deleted
-            del self.orders[best_price_counterparty]
-            self.n_orders = self.n_orders - 1
-        self.build_lob()
-        return best_price_counterparty
+            self.best_price = None
+            self.best_tid = None
+        self.lob_depth = len(self.prices)
+        self.anon_stale = True
 
 
 class Orderbook:
@@ -149,10 +339,21 @@ class Orderbook:
     Orderbook for a single instrument: list of bids and list of asks
     """
 
-    def __init__(self):
-        self.bids = OrderbookHalf('Bid', TBSE_SYS_MIN_PRICE)
-        self.asks = OrderbookHalf('Ask', TBSE_SYS_MAX_PRICE)
-        self.tape = []
+    def __init__(self, backend='levels', tape_window=10, tape_file=None):
+        """
+        :param backend: 'levels' for sorted price levels, 'ladder' for a fixed-size array with one slot per tick
+        :param tape_window: Number of most recent tape records published to traders
+        :param tape_file: Binary file the full tape is streamed to; None for a temporary file
+        """
+        if backend == 'levels':
+            half = OrderbookHalf
+        elif backend == 'ladder':
+            half = OrderbookLadderHalf
+        else:
+            sys.exit(f'FATAL: don\'t know orderbook backend {backend}')
+        self.bids = half('Bid', TBSE_SYS_MIN_PRICE)
+        self.asks = half('Ask', TBSE_SYS_MAX_PRICE)
+        self.tape = Tape(tape_window, tape_file)
         self.quote_id = 0  # unique ID code for each quote accepted onto the book
 
     def get_quote_id(self):
@@ -172,9 +373,45 @@ class Exchange(Orderbook):
     """
     Exchange's internal orderbook
     """
+    def __init__(self, backend='levels', tape_window=10, tape_file=None):
+        super().__init__(backend, tape_window, tape_file)
+        # sequence number of the current state of the book and tape, the time of its last change, and the snapshot
+        # published for it: None until first asked for, so a change nobody reads costs no snapshot
+        self.lob_version = 0
+        self.lob_time = 0
+        self.lob_snapshot = None
+        # held while the book is changed and while a snapshot is built from it, as traders read in their own threads
+        self.lob_lock = threading.Lock()
+        # visible versions of each side and tape length traders were last woken for
+        self.lob_visible = None
+        # sequence number of market events traders can wait on: LOB changes, trades and customer orders
+        self.market_seq = 0
+        self.market_event = threading.Condition()
+        self.snapshot_lob(0)
+
+    def notify_traders(self):
+        """
+        Signals a market event, waking every trader blocked in wait_for_market()
+        """
+        with self.market_event:
+            self.market_seq += 1
+            self.market_event.notify_all()
+
+    def wait_for_market(self, seq, timeout):
+        """
+        Blocks until there has been a market event since seq, or until timeout seconds have passed
+        :param seq: Market sequence number the caller last saw, None to return immediately
+        :param timeout: Maximum number of seconds to wait
+        :return: Current market sequence number
+        """
+        with self.market_event:
+            self.market_event.wait_for(lambda: self.market_seq != seq, timeout)
+            return self.market_seq
+
     def add_order(self, order, verbose):
         """
         add a quote/order to the exchange and update all internal records; return unique i.d.
+        does not take lob_lock: while traders read the LOB from their own threads, callers must hold it
         :param order: order to be added to the exchange
         :param verbose: should verbose logging be printed to console
         :return: List containing order trader ID and the response from the OrderbookHalf (Either addition or overwrite)
@@ -187,14 +424,8 @@ class Exchange(Orderbook):
 
         if order.otype == 'Bid':
             response = self.bids.book_add(order)
-            best_price = self.bids.lob_anon[-1][0]
-            self.bids.best_price = best_price
-            self.bids.best_tid = self.bids.lob[best_price][1][0][2]
         else:
             response = self.asks.book_add(order)
-            best_price = self.asks.lob_anon[0][0]
-            self.asks.best_price = best_price
-            self.asks.best_tid = self.asks.lob[best_price][1][0][2]
         return [order.toid, response]
 
     def del_order(self, time, order):
@@ -203,62 +434,63 @@ class Exchange(Orderbook):
         :param time: Time when the order is being deleted
         :param order: The order to delete
         """
+        with self.lob_lock:
+            if order.otype == 'Bid':
+                self.bids.book_del(order)
+                cancel_record = {'type': 'Cancel', 't': time, 'order': order}
+                self.tape.append(cancel_record)
+
+            elif order.otype == 'Ask':
+                self.asks.book_del(order)
+                cancel_record = {'type': 'Cancel', 't': time, 'order': order}
+                self.tape.append(cancel_record)
+            else:
+                # neither bid nor ask?
+                sys.exit('bad order type in del_quote()')
+            self.snapshot_lob(time)
 
-        if order.otype == 'Bid':
-            self.bids.book_del(order)
-            if self.bids.n_orders > 0:
-                best_price = self.bids.lob_anon[-1][0]
-                self.bids.best_price = best_price
-                self.bids.best_tid = self.bids.lob[best_price][1][0][2]
-            else:  # this side of book is empty
-                self.bids.best_price = None
-                self.bids.best_tid = None
-            cancel_record = {'type': 'Cancel', 't': time, 'order': order}
-            self.tape.append(cancel_record)
-
-        elif order.otype == 'Ask':
-            self.asks.book_del(order)
-            if self.asks.n_orders > 0:
-                best_price = self.asks.lob_anon[0][0]
-                self.asks.best_price = best_price
-                self.asks.best_tid = self.asks.lob[best_price][1][0][2]
-            else:  # this side of book is empty
-                self.asks.best_price = None
-                self.asks.best_tid = None
-            cancel_record = {'type': 'Cancel', 't': time, 'order': order}
-            self.tape.append(cancel_record)
-        else:
-            # neither bid nor ask?
-            sys.exit('bad order type in del_quote()')
+    def snapshot_lob(self, time):
+        """
+        record a change to the LOB: the snapshot published for it is built by publish_lob() when first asked for
+        only called from the thread that changes the book, holding lob_lock
+        :param time: Time of the change
+        """
+        self.lob_version += 1
+        self.lob_time = time
+        self.lob_snapshot = None
+        visible = (self.bids.visible_version, self.asks.visible_version, len(self.tape))
+        if visible != self.lob_visible:
+            # wake waiting traders only if something they can see has changed: not, say, a trader re-quoting the
+            # same price
+            self.lob_visible = visible
+            self.notify_traders()
 
     def publish_lob(self, time, verbose):
         """
         this returns the LOB data "published" by the exchange, i.e., what is accessible to the traders
+        the snapshot is built on the first call after a change, so repeated calls with nothing new return the same
+        object; sides of the book that have not changed, and the tape window if nothing has been added to it, are
+        shared with the previous snapshot rather than copied. Its 't' is the time of the last change and 'version'
+        is its sequence number
         :param time: Current t
         :param verbose: Flag indicate whether additional information should be printed to console
-        :return: JSON object representing the current state of the LOB
-        """
-        public_data = {
-            't': time,
-            'bids':
-                {
-                    'best': self.bids.best_price,
-                    'worst': self.bids.worst_price,
-                    'n': self.bids.n_orders,
-                    'lob': self.bids.lob_anon
-                },
-            'asks':
-                {
-                    'best': self.asks.best_price,
-                    'worst': self.asks.worst_price,
-                    'n': self.asks.n_orders,
-                    'lob': self.asks.lob_anon
-                },
-            'QID': self.quote_id,
-            'tape': self.tape
-        }
+        :return: Read-only mapping representing the current state of the LOB
+        """
+        public_data = self.lob_snapshot
+        if public_data is None:
+            with self.lob_lock:
+                if self.lob_snapshot is None:
+                    self.lob_snapshot = MappingProxyType({
+                        't': self.lob_time,
+                        'version': self.lob_version,
+                        'bids': self.bids.publish(),
+                        'asks': self.asks.publish(),
+                        'QID': self.quote_id,
+                        'tape': self.tape.recent_records()
+                    })
+                public_data = self.lob_snapshot
         if verbose:
-            print(f'publish_lob: t={time}')
+            print(f'publish_lob: t={time} version={public_data["version"]}')
             print(f'BID_lob={public_data["bids"]["lob"]}')
             print(f'ASK_lob={public_data["asks"]["lob"]}')
 
@@ -273,88 +505,96 @@ class Exchange(Orderbook):
         :param time: Current time
         :param order: Order being processed
         :param verbose: Should verbose logging be printed to the console
-        :return: transaction record and updated LOB
+        :return: transaction record and updated LOB if the order traded, otherwise None and None
         """
-        o_price = order.price
-        counterparty = None
-        counter_coid = None
-        [toid, response] = self.add_order(order, verbose)  # add it to the order lists -- overwriting any previous order
-        order.toid = toid
-        if verbose:
-            print(f'TOID: order.toid={order.toid}')
-            print(f'RESPONSE: {response}')
-        best_ask = self.asks.best_price
-        best_ask_tid = self.asks.best_tid
-        best_bid = self.bids.best_price
-        best_bid_tid = self.bids.best_tid
-        price = 0
-        if order.otype == 'Bid':
-            if self.asks.n_orders > 0 and best_bid >= best_ask:
-                # bid lifts the best ask
-                if verbose:
-                    print(f"Bid ${o_price} lifts best ask")
-                counterparty = best_ask_tid
-                counter_coid = self.asks.orders[counterparty].coid
-                price = best_ask  # bid crossed ask, so use ask price
-                if verbose:
-                    print('counterparty, price', counterparty, price)
-                # delete the ask just crossed
-                self.asks.delete_best()
-                # delete the bid that was the latest order
-                self.bids.delete_best()
-        elif order.otype == 'Ask':
-            if self.bids.n_orders > 0 and best_ask <= best_bid:
-                # ask hits the best bid
-                if verbose:
-                    print("Ask ${o_price} hits best bid")
-                # remove the best bid
-                counterparty = best_bid_tid
-                counter_coid = self.bids.orders[counterparty].coid
-                price = best_bid  # ask crossed bid, so use bid price
-                if verbose:
-                    print('counterparty, price', counterparty, price)
-                # delete the bid just crossed, from the exchange's records
-                self.bids.delete_best()
-                # delete the ask that was the latest order, from the exchange's records
-                self.asks.delete_best()
-        else:
-            # we should never get here
-            sys.exit('process_order() given neither Bid nor Ask')
-        # NB at this point we have deleted the order from the exchange's records
-        # but the two traders concerned still have to be notified
-        if verbose:
-            print(f'counterparty {counterparty}')
-
-        lob = self.publish_lob(time, False)
-        if counterparty is not None:
-            # process the trade
+        transaction_record = None
+        with self.lob_lock:
+            o_price = order.price
+            counterparty = None
+            counter_coid = None
+            # add it to the order lists -- overwriting any previous order
+            [toid, response] = self.add_order(order, verbose)
+            order.toid = toid
             if verbose:
-                print(f'>>>>>>>>>>>>>>>>>TRADE t={time:5.2f} ${price} {counterparty} {order.tid}')
-            transaction_record = {
-                'type': 'Trade',
-                't': time,
-                'price': price,
-                'party1': counterparty,
-                'party2': order.tid,
-                'qty': order.qty,
-                'coid': order.coid,
-                'counter': counter_coid
-            }
-            self.tape.append(transaction_record)
-            return transaction_record, lob
-        return None, lob
+                print(f'TOID: order.toid={order.toid}')
+                print(f'RESPONSE: {response}')
+            best_ask = self.asks.best_price
+            best_ask_tid = self.asks.best_tid
+            best_bid = self.bids.best_price
+            best_bid_tid = self.bids.best_tid
+            price = 0
+            if order.otype == 'Bid':
+                if self.asks.n_orders > 0 and best_bid >= best_ask:
+                    # bid lifts the best ask
+                    if verbose:
+                        print(f"Bid ${o_price} lifts best ask")
+                    counterparty = best_ask_tid
+                    counter_coid = self.asks.orders[counterparty].coid
+                    price = best_ask  # bid crossed ask, so use ask price
+                    if verbose:
+                        print('counterparty, price', counterparty, price)
+                    # delete the ask just crossed
+                    self.asks.delete_best()
+                    # delete the bid that was the latest order
+                    self.bids.delete_best()
+            elif order.otype == 'Ask':
+                if self.bids.n_orders > 0 and best_ask <= best_bid:
+                    # ask hits the best bid
+                    if verbose:
+                        print("Ask ${o_price} hits best bid")
+                    # remove the best bid
+                    counterparty = best_bid_tid
+                    counter_coid = self.bids.orders[counterparty].coid
+                    price = best_bid  # ask crossed bid, so use bid price
+                    if verbose:
+                        print('counterparty, price', counterparty, price)
+                    # delete the bid just crossed, from the exchange's records
+                    self.bids.delete_best()
+                    # delete the ask that was the latest order, from the exchange's records
+                    self.asks.delete_best()
+            else:
+                # we should never get here
+                sys.exit('process_order() given neither Bid nor Ask')
+            # NB at this point we have deleted the order from the exchange's records
+            # but the two traders concerned still have to be notified
+            if verbose:
+                print(f'counterparty {counterparty}')
+
+            if counterparty is not None:
+                # process the trade
+                if verbose:
+                    print(f'>>>>>>>>>>>>>>>>>TRADE t={time:5.2f} ${price} {counterparty} {order.tid}')
+                transaction_record = {
+                    'type': 'Trade',
+                    't': time,
+                    'price': price,
+                    'party1': counterparty,
+                    'party2': order.tid,
+                    'qty': order.qty,
+                    'coid': order.coid,
+                    'counter': counter_coid
+                }
+                self.tape.append(transaction_record)
+            self.snapshot_lob(time)
+        if transaction_record is None:
+            return None, None
+        return transaction_record, self.publish_lob(time, False)
+
+    def close(self):
+        """
+        Ends the exchange's session: writes out the rest of the tape, stops its writer thread and closes its file
+        """
+        self.tape.close()
 
     def tape_dump(self, file_name, file_mode, tape_mode):
         """
-        Dumps current tape to file
+        Exports the tape's trade history to a CSV file
         :param file_name: Name of file to dump tape to
         :param file_mode: mode by which to access file (R / R/W / W)
         :param tape_mode: Should tape be wiped after dump
         """
         with open(file_name, file_mode, encoding="utf-8") as dumpfile:
-            for tape_item in self.tape:
-                if tape_item['type'] == 'Trade':
-                    dumpfile.write(f'{tape_item["t"]}, {tape_item["price"]}\n')
+            export_csv(self.tape.history(), dumpfile)
             dumpfile.close()
             if tape_mode == 'wipe':
-                self.tape = []
+                self.tape.wipe()
@@ -0,0 +1,95 @@
+"""
+Module containing the latency histograms kept by each trader for each of its call sites
+
+Latencies are recorded in nanoseconds into log-bucketed histograms, as HdrHistogram does: values below
+SUB_BUCKETS get a bucket each, and each power of two above that is split into SUB_BUCKETS / 2 linear buckets, so
+every value is held to within 1 part in SUB_BUCKETS / 2 whatever its size, in a few hundred counters.
+Histograms can be merged exactly, so the latency distribution of a trader type is that of its traders combined.
+"""
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_BITS = SUB_BUCKET_BITS - 1
+CALL_SITES = ('get_order', 'respond')  # calls timed for every trader, indexing Trader.latency
+
+
+def bucket_index(value):
+    """
+    :param value: Non-negative integer
+    :return: Index of the histogram bucket holding value
+    """
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return (shift << HALF_BITS) + (value >> shift)
+
+
+def bucket_highest(index):
+    """
+    :param index: Index of a histogram bucket
+    :return: Highest value held in the bucket
+    """
+    if index < SUB_BUCKETS:
+        return index
+    shift = (index >> HALF_BITS) - 1
+    return ((index - (shift << HALF_BITS) + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed histogram of latencies, in nanoseconds
+    """
+    __slots__ = ('counts', 'n', 'total', 'max')
+
+    def __init__(self):
+        self.counts = []  # number of values recorded in each bucket, grown as larger values arrive
+        self.n = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        """
+        :param value: Latency in nanoseconds, as measured with time.perf_counter_ns()
+        """
+        index = bucket_index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.n += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """
+        Adds every value recorded in another histogram to this one
+        :param other: LatencyHistogram
+        """
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.n += other.n
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        """
+        :return: Mean latency in nanoseconds; 0 if nothing has been recorded
+        """
+        if self.n == 0:
+            return 0
+        return self.total / self.n
+
+    def percentile(self, percentile):
+        """
+        :param percentile: Percentile wanted, from 0 to 100
+        :return: Latency in nanoseconds at or below which that percentage of recorded values lie, to within the
+                 width of its bucket; 0 if nothing has been recorded
+        """
+        target = max(1, -(-self.n * percentile // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(bucket_highest(index), self.max)
+        return self.max
@@ -0,0 +1,287 @@
+"""
+Module containing the parts of a market session shared by real-time sessions, run by market_session() in tbse.py,
+and virtual-time sessions, run by virtual_market_session() in tbse_virtual.py: creating the traders, processing an
+order on the exchange, waking a trader, and writing the session's statistics
+"""
+import os
+import random
+import sys
+import time
+
+import config
+from tbse_latency import CALL_SITES, LatencyHistogram
+from tbse_replay import EventLog
+from tbse_trader_agents import TraderGiveaway, TraderShaver, TraderSniper, \
+    TraderZic, TraderZip, TraderAa, TraderGdx
+
+
+# Adapted from original BSE code
+def trade_stats(expid, traders, dumpfile):
+    """dump CSV statistics on exchange data and trader population to file for later analysis
+    this makes no assumptions about the number of types of traders, or
+    the number of traders of any one type -- allows either/both to change
+    between successive calls, but that does make it inefficient as it has to
+    re-analyse the entire set of traders on each call"""
+    trader_types = {}
+    for t in traders:
+        trader_type = traders[t].ttype
+        t_time1 = 0
+        t_time2 = 0
+        if trader_type in trader_types:
+            t_balance = trader_types[trader_type]['balance_sum'] + traders[t].balance
+            t_trades = trader_types[trader_type]['trades_sum'] + traders[t].n_trades
+            if traders[t].last_quote is not None:
+                t_time1 = trader_types[trader_type]['time1'] + traders[t].latency['get_order'].mean() / 1e9
+                t_time2 = trader_types[trader_type]['time2'] + traders[t].latency['respond'].mean() / 1e9
+            n = trader_types[trader_type]['n'] + 1
+        else:
+            t_balance = traders[t].balance
+            if traders[t].last_quote is not None:
+                t_time1 = traders[t].latency['get_order'].mean() / 1e9
+                t_time2 = traders[t].latency['respond'].mean() / 1e9
+            n = 1
+            t_trades = traders[t].n_trades
+        trader_types[trader_type] = {'n': n, 'balance_sum': t_balance, 'trades_sum': t_trades, 'time1': t_time1,
+                                     'time2': t_time2}
+
+    dumpfile.write(f"{expid}")
+    for trader_type in sorted(list(trader_types.keys())):
+        n = trader_types[trader_type]['n']
+        s = trader_types[trader_type]['balance_sum']
+        t = trader_types[trader_type]['trades_sum']
+        time1 = trader_types[trader_type]['time1']
+        time2 = trader_types[trader_type]['time2']
+        dumpfile.write(f", {trader_type}, {s}, {n}, {(s / float(n)):.2f}, "
+                       f"{(t / float(n)):.2f}, {(time1 / float(n)):.8f}, {(time2 / float(n)):.8f}")
+
+    dumpfile.write('\n')
+
+
+def latency_stats(expid, traders, latency_file):
+    """
+    Writes CSV latency distributions to file: for each trader, and for each trader type with its traders' histograms
+    merged (under the trader ID 'ALL'), one line per call site of
+    expid, tid, ttype, call site, calls, mean, p50, p99, p99.9, max
+    with latencies in nanoseconds
+    :param expid: ID of the session
+    :param traders: Dictionary of the session's traders, indexed by Trader ID
+    :param latency_file: Open text file to write to
+    """
+    rows = []
+    trader_types = {}
+    for tid in sorted(traders):
+        trader = traders[tid]
+        if trader.ttype not in trader_types:
+            trader_types[trader.ttype] = {call: LatencyHistogram() for call in CALL_SITES}
+        for call in CALL_SITES:
+            trader_types[trader.ttype][call].merge(trader.latency[call])
+            rows.append([tid, trader.ttype, call, trader.latency[call]])
+    for trader_type in sorted(trader_types):
+        for call in CALL_SITES:
+            rows.append(['ALL', trader_type, call, trader_types[trader_type][call]])
+    for [tid, trader_type, call, histogram] in rows:
+        latency_file.write(f"{expid}, {tid}, {trader_type}, {call}, {histogram.n}, {histogram.mean():.0f}, "
+                           f"{histogram.percentile(50)}, {histogram.percentile(99)}, {histogram.percentile(99.9)}, "
+                           f"{histogram.max}\n")
+
+
+# From original BSE code
+def populate_market(trader_spec, traders, shuffle, verbose):
+    """create a bunch of trader_list from trader_spec
+    returns tuple (n_buyers, n_sellers)
+    optionally shuffles the pack of buyers and the pack of sellers"""
+    # pylint: disable=too-many-return-statements
+    def create_trader(robot_type, name):
+        """
+        Function that creates instances of the different Trader Types
+        :param robot_type: String representing type of trader to be created
+        :param name: String, name given to trader
+        :return: Instantiated Trader object
+        """
+        if robot_type == 'GVWY':
+            return TraderGiveaway('GVWY', name, 0.00, 0)
+        if robot_type == 'ZIC':
+            return TraderZic('ZIC', name, 0.00, 0)
+        if robot_type == 'SHVR':
+            return TraderShaver('SHVR', name, 0.00, 0)
+        if robot_type == 'SNPR':
+            return TraderSniper('SNPR', name, 0.00, 0)
+        if robot_type == 'ZIP':
+            return TraderZip('ZIP', name, 0.00, 0)
+        if robot_type == 'AA':
+            return TraderAa('AA', name, 0.00, 0)
+        if robot_type == 'GDX':
+            return TraderGdx('GDX', name, 0.00, 0)
+        sys.exit(f'FATAL: don\'t know robot type {robot_type}\n')
+
+    def shuffle_traders(ttype_char, n, trader_list):
+        """
+        Shuffles traders to avoid any biases caused by trader position.
+        :param ttype_char: 'B' if buyers, 'S' if sellers
+        :param n: int - number of traders being shuffles
+        :param trader_list: list of traders to shuffle
+        """
+        for swap in range(n):
+            t1 = (n - 1) - swap
+            t2 = random.randint(0, t1)
+            t1name = f"{ttype_char}{str(t1).zfill(2)}"
+            t2name = f"{ttype_char}{str(t2).zfill(2)}"
+            trader_list[t1name].tid = t2name
+            trader_list[t2name].tid = t1name
+            temp = trader_list[t1name]
+            trader_list[t1name] = trader_list[t2name]
+            trader_list[t2name] = temp
+
+    n_buyers = 0
+    for bs in trader_spec['buyers']:
+        trader_type = bs[0]
+        for _ in range(bs[1]):
+            trader_name = f"B{str(n_buyers).zfill(2)}"  # buyer i.d. string
+            traders[trader_name] = create_trader(trader_type, trader_name)
+            n_buyers = n_buyers + 1
+
+    if n_buyers < 1:
+        sys.exit('FATAL: no buyers specified\n')
+
+    if shuffle:
+        shuffle_traders('B', n_buyers, traders)
+
+    n_sellers = 0
+    for ss in trader_spec['sellers']:
+        trader_type = ss[0]
+        for _ in range(ss[1]):
+            trader_name = f"S{str(n_sellers).zfill(2)}"  # buyer i.d. string
+            traders[trader_name] = create_trader(trader_type, trader_name)
+            n_sellers = n_sellers + 1
+
+    if n_sellers < 1:
+        sys.exit('FATAL: no sellers specified\n')
+
+    if shuffle:
+        shuffle_traders('S', n_sellers, traders)
+
+    if verbose:
+        for t in range(n_buyers):
+            bname = f"B{str(t).zfill(2)}"
+            print(traders[bname])
+        for t in range(n_sellers):
+            bname = f"S{str(t).zfill(2)}"
+            print(traders[bname])
+
+    return {'n_buyers': n_buyers, 'n_sellers': n_sellers}
+
+
+# pylint: disable=too-many-arguments
+def process_order(exchange, order, virtual_time, completed_coid, market_data, fill_qs, process_verbose):
+    """
+    Processes one order on the exchange, unless its customer order has already been filled, and sends any trade to
+    its two parties and to every trader on the market data broadcast
+    :param exchange: Exchange object
+    :param order: Order to be processed
+    :param virtual_time: Current virtual time
+    :param completed_coid: Dictionary, indexed by customer order ID, of whether each customer order has been filled
+    :param market_data: BroadcastRing on which every trade is published to all traders
+    :param fill_qs: Dictionary of queues, indexed by Trader ID, on which each trader is sent its own trades
+    :param process_verbose: Flag indicating whether additional information about order processing should be printed
+                            to console
+    :return: The trade, or None if the order did not trade
+    """
+    if order.coid in completed_coid:
+        if completed_coid[order.coid]:
+            return None
+    else:
+        completed_coid[order.coid] = False
+
+    (trade, lob) = exchange.process_order2(virtual_time, order, process_verbose)
+
+    if trade is not None:
+        completed_coid[order.coid] = True
+        completed_coid[trade['counter']] = True
+        fill_qs[trade['party1']].put([trade, order])
+        fill_qs[trade['party2']].put([trade, order])
+        market_data.publish([trade, order, lob])
+        exchange.notify_traders()
+    return trade
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def trader_wakeup(trader, exchange, market_data, fill_q, virtual_time, time_left, respond_verbose, bookkeep_verbose,
+                  batch=None):
+    """
+    One wakeup of a trader: bookkeeps its own trades, responds to the trades broadcast since its last wakeup and to
+    the current LOB, then asks it for an order
+    :param trader: The trader being woken
+    :param exchange: The exchange object
+    :param market_data: This trader's RingReader on the exchange's broadcast of trades
+    :param fill_q: Queue where the exchange sends this trader its own trades, for bookkeeping
+    :param virtual_time: Current virtual time
+    :param time_left: Proportion of the market session remaining
+    :param respond_verbose: Should the trader display additional information on its response
+    :param bookkeep_verbose: Should there be additional bookkeeping information displayed on the console
+    :param batch: TraderBatch that has already responded to every market event on the trader's behalf, or None
+    :return: The trader's new order, or None
+    """
+    while fill_q.empty() is False:
+        [fill, fill_order] = fill_q.get(block=False)
+        trader.bookkeep(fill, fill_order, bookkeep_verbose, virtual_time)
+    if batch is not None:
+        lob = exchange.publish_lob(virtual_time, False)
+        batch.prepare(trader)
+        time2 = time.perf_counter_ns()
+        order = trader.get_order(virtual_time, time_left, lob)
+        time3 = time.perf_counter_ns()
+    else:
+        respond_latency = trader.latency['respond']
+        trade = None
+        for [trade, order, lob] in market_data.read():
+            time1 = time.perf_counter_ns()
+            trader.respond(virtual_time, lob, trade, respond_verbose)
+            respond_latency.record(time.perf_counter_ns() - time1)
+
+        lob = exchange.publish_lob(virtual_time, False)
+        time1 = time.perf_counter_ns()
+        trader.respond(virtual_time, lob, trade, respond_verbose)
+        time2 = time.perf_counter_ns()
+        order = trader.get_order(virtual_time, time_left, lob)
+        time3 = time.perf_counter_ns()
+        respond_latency.record(time2 - time1)
+    if order is not None:
+        if order.otype == 'Ask' and order.price < trader.orders[order.coid].price:
+            sys.exit('Bad ask')
+        if order.otype == 'Bid' and order.price > trader.orders[order.coid].price:
+            sys.exit('Bad bid')
+        trader.n_quotes = 1
+        trader.latency['get_order'].record(time3 - time2)
+    return order
+
+
+def open_event_log(sess_id, seed):
+    """
+    :param sess_id: ID of the session
+    :param seed: Seed of the session's random numbers, or None if unseeded
+    :return: EventLog recording the session's exchange inputs to config.eventLogDir, or None if not recording
+    """
+    if config.eventLogDir is None:
+        return None
+    os.makedirs(config.eventLogDir, exist_ok=True)
+    return EventLog(os.path.join(config.eventLogDir, f'{sess_id}.events'), seed, config.orderbookBackend,
+                    config.tapeWindow)
+
+
+def session_complete(sess_id, num_threads, trader_count):
+    """
+    Decides whether a market session needs no retry: every one of its threads ran to the end, or it was a seeded
+    virtual-time session, whose retry would be run from the same seed and crash the same way. Such a crash is
+    reported instead, and the session left without trade_stats.
+    :param sess_id: ID of the session
+    :param num_threads: Number of threads that ran to the end of the session, as returned by market_session()
+    :param trader_count: Number of traders on the market
+    :return: True if the session should not be run again
+    """
+    if num_threads == trader_count + 2:
+        return True
+    if config.timeMode == 'virtual' and config.virtualSeed is not None:
+        print(f'Error: {trader_count + 2 - num_threads} of {trader_count} traders crashed in market session '
+              f'{sess_id}; seeded virtual sessions are not retried, as they would crash the same way.')
+        return True
+    return False
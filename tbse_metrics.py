@@ -0,0 +1,151 @@
+"""
+Module containing the instrumentation of a real-time session's exchange
+
+Every order is stamped with time.perf_counter_ns() as its trader puts it on order_q; the exchange times when it takes
+the order and when it has finished processing it. That clock is system-wide, so stamps taken in trader processes
+compare with the exchange's. For each interval of the session a row is written of orders processed, trades, cancels
+and orders skipped because their customer order was already filled; the deepest order_q, kill_q and trader fill
+queue seen; and percentiles of how long orders waited on order_q and took to process, in nanoseconds. A last row,
+with t of 'ALL', covers the whole session. Orders piling up on order_q with long waits but short processing times
+mean the exchange was saturated; short waits with few orders mean the traders were slow to quote.
+"""
+from tbse_latency import LatencyHistogram
+
+METRICS_HEADER = 't, orders, trades, cancels, skipped, order_q max, kill_q max, fill_q max, wait p50, wait p99, ' \
+                 'wait max, process p50, process p99, process max\n'
+
+
+def queue_depth(q):
+    """
+    :param q: Queue
+    :return: Approximate number of items on the queue, or -1 if it cannot tell, as for a multiprocessing.Queue on
+             macOS or a FillQueue forwarding to another process
+    """
+    try:
+        return q.qsize()
+    except (AttributeError, NotImplementedError):
+        return -1
+
+
+# pylint: disable=too-many-instance-attributes
+class MetricsInterval:
+    """
+    Counts and latencies of one interval of a session
+    """
+    __slots__ = ('orders', 'trades', 'cancels', 'skipped', 'order_q_max', 'kill_q_max', 'fill_q_max', 'wait',
+                 'process')
+
+    def __init__(self):
+        self.orders = 0
+        self.trades = 0
+        self.cancels = 0
+        self.skipped = 0
+        self.order_q_max = 0
+        self.kill_q_max = 0
+        self.fill_q_max = -1  # until sampled
+        self.wait = LatencyHistogram()  # time from an order being put on order_q to the exchange taking it
+        self.process = LatencyHistogram()  # time the exchange took to process an order
+
+    def merge(self, other):
+        """
+        Adds another interval's counts and latencies to this one's
+        :param other: MetricsInterval
+        """
+        self.orders += other.orders
+        self.trades += other.trades
+        self.cancels += other.cancels
+        self.skipped += other.skipped
+        self.order_q_max = max(self.order_q_max, other.order_q_max)
+        self.kill_q_max = max(self.kill_q_max, other.kill_q_max)
+        self.fill_q_max = max(self.fill_q_max, other.fill_q_max)
+        self.wait.merge(other.wait)
+        self.process.merge(other.process)
+
+    def row(self, t):
+        """
+        :param t: Start of the interval, in seconds since the session started, or 'ALL'
+        :return: CSV line of the interval
+        """
+        return f'{t}, {self.orders}, {self.trades}, {self.cancels}, {self.skipped}, {self.order_q_max}, ' \
+               f'{self.kill_q_max}, {self.fill_q_max}, {self.wait.percentile(50)}, {self.wait.percentile(99)}, ' \
+               f'{self.wait.max}, {self.process.percentile(50)}, {self.process.percentile(99)}, ' \
+               f'{self.process.max}\n'
+
+
+class ExchangeMetrics:
+    """
+    Instrumentation of a session's exchange, written to a CSV file an interval at a time; only ever used from the
+    exchange's thread
+    """
+    def __init__(self, file_name, interval):
+        """
+        :param file_name: File the metrics are written to, replacing any already there
+        :param interval: Seconds of real time covered by each row
+        """
+        # pylint: disable=consider-using-with
+        self.metrics_file = open(file_name, 'w', encoding="utf-8")
+        self.metrics_file.write(METRICS_HEADER)
+        self.interval = interval
+        self.index = 0  # index of the interval being counted
+        self.current = MetricsInterval()
+        self.session = MetricsInterval()
+
+    def sample(self, elapsed, order_q, kill_q, fill_qs):
+        """
+        Samples the depth of the exchange's queues, first writing out the interval being counted if it has ended,
+        and a row for each interval since then that passed without a sample; called at least once an interval
+        :param elapsed: Seconds since the session started
+        :param order_q: Queue of orders for the exchange
+        :param kill_q: Queue of orders to be deleted from the exchange
+        :param fill_qs: Dictionary of queues, indexed by Trader ID, on which each trader is sent its own trades
+        """
+        index = int(elapsed // self.interval)
+        while self.index < index:
+            self.write_interval(fill_qs)
+            self.index += 1
+        self.current.order_q_max = max(self.current.order_q_max, queue_depth(order_q))
+        self.current.kill_q_max = max(self.current.kill_q_max, queue_depth(kill_q))
+
+    def record_cancel(self):
+        """
+        Counts an order taken from kill_q
+        """
+        self.current.cancels += 1
+
+    def record_order(self, order, start, end, traded, skipped):
+        """
+        :param order: Order taken from order_q
+        :param start: time.perf_counter_ns() as the exchange took the order
+        :param end: time.perf_counter_ns() once the exchange had processed the order
+        :param traded: Whether the order traded
+        :param skipped: Whether the order was dropped as its customer order was already filled
+        """
+        current = self.current
+        current.orders += 1
+        if traded:
+            current.trades += 1
+        if skipped:
+            current.skipped += 1
+        if order.enqueued is not None:
+            current.wait.record(max(start - order.enqueued, 0))
+        current.process.record(end - start)
+
+    def write_interval(self, fill_qs):
+        """
+        Writes out the interval being counted and starts a new one
+        :param fill_qs: Dictionary of queues, indexed by Trader ID, on which each trader is sent its own trades
+        """
+        # fill queues are drained by their traders, so are only sampled as each interval closes
+        self.current.fill_q_max = max((queue_depth(fill_q) for fill_q in fill_qs.values()), default=0)
+        self.metrics_file.write(self.current.row(round(self.index * self.interval, 6)))
+        self.session.merge(self.current)
+        self.current = MetricsInterval()
+
+    def close(self, fill_qs):
+        """
+        Writes out the last interval and the whole session, then closes the file
+        :param fill_qs: Dictionary of queues, indexed by Trader ID, on which each trader is sent its own trades
+        """
+        self.write_interval(fill_qs)
+        self.metrics_file.write(self.session.row('ALL'))
+        self.metrics_file.close()
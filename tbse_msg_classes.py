@@ -1,13 +1,16 @@
 """
 From original BSE code by Dave Cliff
-Module holding the Order class
+Module holding the Order class and the broadcast ring carrying market data from the exchange to traders
 """
 
-# pylint: disable=too-many-arguments,too-few-public-methods
+# pylint: disable=too-many-arguments,too-few-public-methods,too-many-instance-attributes
 class Order:
     """
     an Order/quote has a trader id, a type (buy/sell) price, quantity, timestamp, and unique i.d.
+    slotted, as every trader allocates a new one each time it quotes
     """
+    __slots__ = ('tid', 'otype', 'price', 'qty', 'time', 'coid', 'toid', 'enqueued')
+
     def __init__(self, tid, otype, price, qty, time, coid, toid):
         self.tid = tid  # trader i.d.
         self.otype = otype  # order type
@@ -16,7 +19,62 @@ class Order:
         self.time = time  # timestamp
         self.coid = coid  # customer order i.d. (unique to each quote customer order)
         self.toid = toid  # trader order i.d. (unique to each order posted by the trader)
+        self.enqueued = None  # time.perf_counter_ns() as the order was sent to the exchange, for its metrics
 
     def __str__(self):
         return f'[{self.tid} {self.otype} P={str(self.price).zfill(3)} Q={self.qty} ' \
                f'T={self.time:5.2f} COID:{self.coid} TOID:{self.toid}]'
+
+
+class BroadcastRing:
+    """
+    Single-writer broadcast log of market data messages
+    The writer overwrites the oldest slot, so publishing costs O(1) however many readers there are;
+    each reader keeps its own cursor, and one that falls a ring's length behind skips to the oldest message the
+    writer cannot be overwriting rather than backing up
+    """
+    def __init__(self, size):
+        self.size = size
+        self.slots = [None] * size
+        self.seq = 0  # number of messages ever published
+
+    def publish(self, message):
+        """
+        Appends a message to the log; only ever called from one thread
+        :param message: Message to be broadcast
+        """
+        self.slots[self.seq % self.size] = message
+        # the slot is filled before the sequence number moves, so readers never see an empty slot
+        self.seq += 1
+
+    def reader(self):
+        """
+        :return: A RingReader positioned after the last message published so far
+        """
+        return RingReader(self)
+
+
+class RingReader:
+    """
+    One reader's cursor into a BroadcastRing
+    """
+    def __init__(self, ring):
+        self.ring = ring
+        self.cursor = ring.seq
+        self.n_skipped = 0  # messages overwritten before this reader got to them
+
+    def read(self):
+        """
+        :return: List of messages published since the last read, oldest first
+        """
+        ring = self.ring
+        seq = ring.seq
+        messages = [ring.slots[i % ring.size] for i in range(self.cursor, seq)]
+        # anything the writer may have overwritten while we were copying is dropped, including the slot it may be
+        # filling now: it writes message ring.seq over message ring.seq - ring.size before moving the seq on
+        oldest = ring.seq - ring.size + 1
+        if oldest > self.cursor:
+            self.n_skipped += oldest - self.cursor
+            messages = messages[oldest - self.cursor:]
+        self.cursor = seq
+        return messages
@@ -0,0 +1,227 @@
+"""
+Module containing the plumbing for running traders in their own processes
+
+The exchange publishes LOB snapshots and trades into rings held in shared memory, which trader processes read
+without any locking; a seqlock on each slot lets readers detect a slot being rewritten under them.
+Customer orders and each trader's own trades are sent to its process on a control queue.
+"""
+import pickle
+import struct
+import time
+from multiprocessing import shared_memory
+from types import MappingProxyType
+
+SEQ = struct.Struct('<Q')
+SLOT_HEADER = struct.Struct('<QI')  # sequence number of the message held, length of its pickled payload
+
+
+def plain(message):
+    """
+    Converts the read-only mappings the exchange publishes into plain dictionaries, so they can be pickled
+    :param message: LOB snapshot, or list holding one
+    :return: Copy of message built from dictionaries and lists
+    """
+    if isinstance(message, MappingProxyType):
+        return {key: plain(value) for key, value in message.items()}
+    if isinstance(message, list):
+        return [plain(item) for item in message]
+    return message
+
+
+class SharedRing:
+    """
+    Single-writer ring of pickled messages in shared memory
+    Layout: the number of messages ever published, then n_slots slots of [sequence number, length, payload]
+    """
+    def __init__(self, n_slots, slot_size, name=None):
+        """
+        :param n_slots: Number of messages held before the oldest is overwritten
+        :param slot_size: Largest pickled message, in bytes
+        :param name: Name of an existing ring to attach to; None to create a new one
+        """
+        self.n_slots = n_slots
+        self.slot_size = slot_size
+        self.stride = SLOT_HEADER.size + slot_size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=SEQ.size + n_slots * self.stride)
+            SEQ.pack_into(self.shm.buf, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+    def seq(self):
+        """
+        :return: Number of messages ever published
+        """
+        return SEQ.unpack_from(self.shm.buf, 0)[0]
+
+    def publish(self, message):
+        """
+        Pickles a message into the next slot; only ever called from one thread of one process
+        :param message: Message to be published
+        """
+        data = pickle.dumps(plain(message), pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.slot_size:
+            raise ValueError(f'message of {len(data)} bytes does not fit a {self.slot_size} byte ring slot')
+        seq = self.seq()
+        offset = SEQ.size + (seq % self.n_slots) * self.stride
+        buf = self.shm.buf
+        # mark the slot as being rewritten, fill it, then stamp it and move the ring's sequence number on
+        SLOT_HEADER.pack_into(buf, offset, 0, 0)
+        buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(data)] = data
+        SLOT_HEADER.pack_into(buf, offset, seq + 1, len(data))
+        SEQ.pack_into(buf, 0, seq + 1)
+
+    def read(self, index):
+        """
+        Reads the message with a given index
+        :param index: Index of the message, counting from 0
+        :return: The message, or None if it has been overwritten
+        """
+        buf = self.shm.buf
+        offset = SEQ.size + (index % self.n_slots) * self.stride
+        stamp, length = SLOT_HEADER.unpack_from(buf, offset)
+        if stamp != index + 1:
+            return None
+        data = bytes(buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length])
+        if SLOT_HEADER.unpack_from(buf, offset)[0] != stamp:
+            # the writer lapped us while we were copying
+            return None
+        return pickle.loads(data)
+
+    def close(self):
+        """
+        Detaches from the shared memory
+        """
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Frees the shared memory; called once, by the process that created it
+        """
+        self.shm.unlink()
+
+
+# pylint: disable=too-few-public-methods
+class SharedRingReader:
+    """
+    One reader's cursor into a SharedRing, with the same interface as tbse_msg_classes.RingReader
+    """
+    def __init__(self, ring):
+        self.ring = ring
+        self.cursor = 0
+        self.n_skipped = 0  # messages overwritten before this reader got to them
+
+    def read(self):
+        """
+        :return: List of messages published since the last read, oldest first
+        """
+        seq = self.ring.seq()
+        messages = []
+        for index in range(max(self.cursor, seq - self.ring.n_slots), seq):
+            message = self.ring.read(index)
+            if message is None:
+                self.n_skipped += 1
+            else:
+                messages.append(message)
+        self.n_skipped += max(0, seq - self.ring.n_slots - self.cursor)
+        self.cursor = seq
+        return messages
+
+
+class SharedExchangeView:
+    """
+    A trader process's view of the exchange: stands in for the Exchange in run_trader
+    """
+    def __init__(self, lob_ring, trade_ring):
+        """
+        :param lob_ring: SharedRing of LOB snapshots
+        :param trade_ring: SharedRing of [trade, order, lob] messages
+        """
+        self.lob_ring = lob_ring
+        self.trade_ring = trade_ring
+        # cached latest snapshot and the ring sequence number it was read at
+        self.lob = None
+        self.lob_seq = 0
+        # count of customer orders delivered to this process, which also wake its traders
+        self.local_events = 0
+
+    def publish_lob(self, time_now, verbose):
+        """
+        :param time_now: Current t
+        :param verbose: Flag indicate whether additional information should be printed to console
+        :return: Latest LOB snapshot published by the exchange; the same object until a newer one arrives
+        """
+        seq = self.lob_ring.seq()
+        while seq != self.lob_seq:
+            lob = self.lob_ring.read(seq - 1)
+            if lob is not None:
+                self.lob = lob
+                self.lob_seq = seq
+            else:
+                seq = self.lob_ring.seq()
+        if verbose:
+            print(f'publish_lob: t={time_now} version={self.lob["version"]}')
+        return self.lob
+
+    def market_seq(self):
+        """
+        :return: Tuple that changes whenever there is a new LOB snapshot, trade or customer order
+        """
+        return self.lob_ring.seq(), self.trade_ring.seq(), self.local_events
+
+    def wait_for_market(self, seq, timeout):
+        """
+        Polls shared memory until there has been a market event since seq, or until timeout seconds have passed
+        it sleeps 1ms between polls, so a trader process wakes up to 1ms after an event, where a trader thread
+        blocked on Exchange.wait_for_market() is woken at once
+        :param seq: Market sequence the caller last saw, None to return immediately
+        :param timeout: Maximum number of seconds to wait
+        :return: Current market sequence
+        """
+        deadline = time.time() + timeout
+        current = self.market_seq()
+        while current == seq and time.time() < deadline:
+            time.sleep(0.001)
+            current = self.market_seq()
+        return current
+
+
+# pylint: disable=too-few-public-methods
+class TraderProxy:
+    """
+    Stands in for a trader living in another process, so customer_orders() can issue orders to it
+    Cancellations are made by the trader's own process, which knows its last quote
+    """
+    def __init__(self, tid, control_q):
+        self.tid = tid
+        self.control_q = control_q
+        self.last_quote = None
+
+    def add_order(self, order, verbose):
+        """
+        Sends a customer order to the trader's process
+        :param order: the order to be added
+        :param verbose: should verbose logging be printed to console
+        :return: Always "Proceed": any LOB cancellation is handled in the trader's process
+        """
+        self.control_q.put(('order', self.tid, order))
+        if verbose:
+            print('add_order < response=Proceed')
+        return 'Proceed'
+
+
+# pylint: disable=too-few-public-methods
+class FillQueue:
+    """
+    Stands in for a trader's fill queue in the exchange's process, forwarding fills to the trader's process
+    """
+    def __init__(self, tid, control_q):
+        self.tid = tid
+        self.control_q = control_q
+
+    def put(self, fill):
+        """
+        :param fill: [trade, order] to be bookkept by the trader
+        """
+        self.control_q.put(('fill', self.tid, fill))
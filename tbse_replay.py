@@ -0,0 +1,183 @@
+"""
+Module for recording the inputs a market session's exchange receives, and replaying them
+
+A session's event log holds every order the exchange takes from order_q and every kill it takes from kill_q, in the
+order it takes them and with the virtual time at which it does so, as fixed-width binary records. Replaying a log
+feeds the same inputs through the exchange single-threaded and at full speed, giving an identical workload however
+threads were scheduled in the recorded session, so the exchange can be profiled, and timed across changes, on it:
+    $ python3 tbse_replay.py <event log> [repeats]
+"""
+import struct
+import sys
+import time
+
+from tbse_exchange import Exchange
+from tbse_msg_classes import Order
+
+# magic number, session random seed, order book backend, tape window
+EVENT_LOG_HEADER = struct.Struct('<8s32s16si')
+EVENT_LOG_MAGIC = b'TBSEEVT1'
+# kind, order type, virtual time, price, qty, trader id, customer order id, trader order id (-1 for None), order time
+#   End records hold the session's final virtual time and, in qty, the number of records on its tape
+EVENT_RECORD = struct.Struct('<BBddi8sqqd')
+EVENT_KINDS = ('Order', 'Kill', 'End')
+ORDER_TYPES = ('Bid', 'Ask')
+
+
+class EventLog:
+    """
+    Recorder of the orders and kills taken by a session's exchange; only ever written from the exchange's thread
+    """
+    def __init__(self, file_name, seed, backend, tape_window):
+        """
+        :param file_name: File the log is written to, replacing any already there
+        :param seed: Seed of the session's random numbers, recorded so that the session can be re-run; None if unseeded
+        :param backend: Order book backend of the session's exchange
+        :param tape_window: Number of tape records the session's exchange publishes to traders
+        """
+        # pylint: disable=consider-using-with
+        self.log_file = open(file_name, 'wb')
+        self.log_file.write(EVENT_LOG_HEADER.pack(EVENT_LOG_MAGIC, str(seed or '').encode(), backend.encode(),
+                                                  tape_window))
+        self.n_events = 0
+
+    def record(self, kind, virtual_time, order):
+        """
+        :param kind: Index in EVENT_KINDS of the event
+        :param virtual_time: Virtual time at which the exchange took the order
+        :param order: Order taken by the exchange
+        """
+        toid = order.toid if isinstance(order.toid, int) else -1
+        self.log_file.write(EVENT_RECORD.pack(kind, ORDER_TYPES.index(order.otype), virtual_time, order.price,
+                                              order.qty, order.tid.encode(), order.coid, toid, order.time))
+        self.n_events += 1
+
+    def record_order(self, virtual_time, order):
+        """
+        Records an order taken from order_q, before the exchange processes it
+        :param virtual_time: Virtual time at which the exchange took the order
+        :param order: The order
+        """
+        self.record(0, virtual_time, order)
+
+    def record_kill(self, virtual_time, order):
+        """
+        Records a kill taken from kill_q, before the exchange deletes the order
+        :param virtual_time: Virtual time at which the exchange took the kill
+        :param order: The order to be deleted
+        """
+        self.record(1, virtual_time, order)
+
+    def close(self, virtual_time, n_tape_records):
+        """
+        Ends the log with a record of the session's outcome, against which replays are checked
+        :param virtual_time: Virtual time at the end of the session
+        :param n_tape_records: Number of trades and cancels on the session's tape
+        """
+        self.log_file.write(EVENT_RECORD.pack(2, 0, virtual_time, 0, n_tape_records, b'', -1, -1, 0))
+        self.log_file.close()
+
+
+def unpack_event(data, offset):
+    """
+    :param data: Records of an event log
+    :param offset: Offset in data of the record to be unpacked
+    :return: The record's event, as returned by read_event_log()
+    """
+    kind, otype, virtual_time, price, qty, tid, coid, toid, order_time = EVENT_RECORD.unpack_from(data, offset)
+    if kind == 2:
+        return [EVENT_KINDS[kind], virtual_time, qty]
+    if price.is_integer():
+        price = int(price)
+    order = Order(tid.rstrip(b'\0').decode(), ORDER_TYPES[otype], price, qty, order_time, coid,
+                  None if toid == -1 else toid)
+    return [EVENT_KINDS[kind], virtual_time, order]
+
+
+def read_event_log(log_file):
+    """
+    Reads a recorded event log
+    :param log_file: Open binary file holding the log
+    :return: [header, events]: header as [seed, backend, tape window], where seed is None for an unseeded session;
+             events as a list of [kind, virtual time, order] for orders and kills, and [kind, virtual time,
+             number of tape records] for the end of the session
+    """
+    magic, seed, backend, tape_window = EVENT_LOG_HEADER.unpack(log_file.read(EVENT_LOG_HEADER.size))
+    if magic != EVENT_LOG_MAGIC:
+        sys.exit('FATAL: not a TBSE event log')
+    seed = seed.rstrip(b'\0').decode() or None
+    header = [seed, backend.rstrip(b'\0').decode(), tape_window]
+    data = log_file.read()
+    events = [unpack_event(data, i) for i in range(0, len(data) - EVENT_RECORD.size + 1, EVENT_RECORD.size)]
+    return [header, events]
+
+
+def replay_order(exchange, virtual_time, order, completed_coid):
+    """
+    Processes a recorded order, unless its customer order has already been filled
+    :param exchange: Exchange the session is replayed on
+    :param virtual_time: Virtual time at which the exchange took the order
+    :param order: The order
+    :param completed_coid: Dictionary, indexed by customer order ID, of whether each customer order has been filled
+    :return: The trade, or None if the order did not trade
+    """
+    if order.coid not in completed_coid:
+        completed_coid[order.coid] = False
+    if completed_coid[order.coid]:
+        return None
+    (trade, _) = exchange.process_order2(virtual_time, order, False)
+    if trade is not None:
+        completed_coid[order.coid] = True
+        completed_coid[trade['counter']] = True
+    return trade
+
+
+def replay(header, events, observer=None):
+    """
+    Feeds a recorded session's orders and kills through a fresh exchange, in the recorded order and at the recorded
+    virtual times, single-threaded and without waiting
+    Orders for customer orders already filled are dropped, as process_order() in tbse_market.py drops them
+    :param header: Header of the log, as returned by read_event_log()
+    :param events: Events of the log, as returned by read_event_log(); the orders are copied, not changed
+    :param observer: Function called as observer(virtual time, LOB, trade or None) after each order and kill, or None
+    :return: [number of orders, number of kills, number of trades, seconds taken, number of records on the tape]
+    """
+    exchange = Exchange(header[1], header[2])
+    completed_coid = {}
+    counts = {'Order': 0, 'Kill': 0, 'Trade': 0}
+    time1 = time.perf_counter()
+    for [kind, virtual_time, order] in events:
+        if kind == 'End':
+            break
+        counts[kind] += 1
+        # the exchange gives orders their trader order ids, so each replay works on its own copies
+        order = Order(order.tid, order.otype, order.price, order.qty, order.time, order.coid, order.toid)
+        trade = None
+        if kind == 'Kill':
+            exchange.del_order(virtual_time, order)
+        else:
+            trade = replay_order(exchange, virtual_time, order, completed_coid)
+            if trade is not None:
+                counts['Trade'] += 1
+        if observer is not None:
+            observer(virtual_time, exchange.publish_lob(virtual_time, False), trade)
+    result = [counts['Order'], counts['Kill'], counts['Trade'], time.perf_counter() - time1, len(exchange.tape)]
+    exchange.close()
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [2, 3]:
+        sys.exit('Usage: python3 tbse_replay.py <event log> [repeats]')
+    with open(sys.argv[1], 'rb') as in_file:
+        [log_header, log_events] = read_event_log(in_file)
+    recorded_tape = None
+    if len(log_events) > 0 and log_events[-1][0] == 'End':
+        recorded_tape = log_events[-1][2]
+    print(f'seed={log_header[0]} backend={log_header[1]} tape window={log_header[2]}')
+    for repeat in range(int(sys.argv[2]) if len(sys.argv) == 3 else 1):
+        [orders, kills, trades, seconds, tape_records] = replay(log_header, log_events)
+        print(f'replay {repeat}: {orders} orders, {kills} kills, {trades} trades in {seconds:.4f}s '
+              f'({seconds / max(orders + kills, 1) * 1e6:.2f} us per event)')
+        if recorded_tape is not None and tape_records != recorded_tape:
+            print(f'WARNING: replay left {tape_records} records on the tape; the session left {recorded_tape}')
@@ -0,0 +1,260 @@
+"""
+Module containing the loading of real-world data (RWD) files for the real-world offset function
+
+CSV and xlsx files are streamed row by row and can be resampled to a coarser time resolution as they are read, so
+large tick files are never held in memory whole. Each file is parsed once into normalised offset events. These are
+kept in memory for the life of the process, and written to a fixed-layout binary cache keyed by a hash of the file,
+the scale factor and the resolution, so other processes and later runs load them with one read instead of parsing
+the file again.
+"""
+import csv
+import hashlib
+import itertools
+import os
+import struct
+import sys
+import tempfile
+import zipfile
+from array import array
+from datetime import datetime
+from xml.etree import ElementTree
+
+# magic number and number of events; followed by that many little-endian doubles (normalised event times),
+# then that many little-endian 64-bit integers (offsets)
+OFFSET_CACHE_HEADER = struct.Struct('<8sQ')
+OFFSET_CACHE_MAGIC = b'TBSERWD1'
+
+CSV_CHUNK_ROWS = 65536  # rows read from a CSV file at a time
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_FIRST_SHEET = 'xl/worksheets/sheet1.xml'
+
+# Offset events already loaded by this process, indexed by (file path, modification time, size, scale factor,
+# resolution)
+LOADED = {}
+
+
+def parse_clock(clock):
+    """
+    :param clock: Time of day as 'HH:MM:SS', optionally with fractions of a second
+    :return: Seconds since midnight
+    """
+    [hours, minutes, seconds] = clock.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def iter_csv_ticks(file_name):
+    """
+    Streams the price events of a CSV file of rows [date (dd/mm/YYYY), time, price, ...], chunk by chunk
+    :param file_name: Path to the CSV file
+    :return: Generator of (seconds since the start of the first date, price)
+    """
+    # dates repeat on row after row, so each one is parsed only once
+    day_offsets = {}
+    first_day = None
+    with open(file_name, 'r', encoding="utf-8-sig", newline='') as input_file:
+        rwd_csv = csv.reader(input_file)
+        for chunk in iter(lambda: list(itertools.islice(rwd_csv, CSV_CHUNK_ROWS)), []):
+            for line in chunk:
+                if len(line) < 3:
+                    continue
+                if line[0] not in day_offsets:
+                    day = datetime.strptime(line[0].strip(), '%d/%m/%Y').toordinal()
+                    if first_day is None:
+                        first_day = day
+                    day_offsets[line[0]] = (day - first_day) * 86400
+                yield day_offsets[line[0]] + parse_clock(line[1]), float(line[2])
+
+
+def iter_xlsx_ticks(file_name):
+    """
+    Streams the price events of the first worksheet of an xlsx file, laid out as the CSV files are: date in column A,
+    time in column B (as spreadsheet serial numbers, or as text) and price in column C.
+    The worksheet XML is parsed incrementally and each row is discarded once read, so the file is never held whole.
+    :param file_name: Path to the xlsx file
+    :return: Generator of (seconds since the start of the first date, price)
+    """
+    with zipfile.ZipFile(file_name) as workbook:
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in workbook.namelist():
+            with workbook.open('xl/sharedStrings.xml') as strings_xml:
+                for _, element in ElementTree.iterparse(strings_xml):
+                    if element.tag == XLSX_NS + 'si':
+                        shared_strings.append(''.join(text.text or '' for text in element.iter(XLSX_NS + 't')))
+                        element.clear()
+        first_day = None
+        with workbook.open(XLSX_FIRST_SHEET) as sheet_xml:
+            for _, element in ElementTree.iterparse(sheet_xml):
+                if element.tag != XLSX_NS + 'row':
+                    continue
+                cells = {}
+                for cell in element.iter(XLSX_NS + 'c'):
+                    value = cell.find(XLSX_NS + 'v')
+                    if value is not None:
+                        column = cell.get('r').rstrip('0123456789')
+                        cells[column] = shared_strings[int(value.text)] if cell.get('t') == 's' else value.text
+                element.clear()
+                if 'A' not in cells or 'B' not in cells or 'C' not in cells:
+                    continue
+                try:
+                    day = float(cells['A'])
+                except ValueError:
+                    day = datetime.strptime(cells['A'].strip(), '%d/%m/%Y').toordinal()
+                try:
+                    # day fractions carry float noise that could put a tick in the previous interval
+                    seconds = round(float(cells['B']) * 86400, 6)
+                except ValueError:
+                    seconds = parse_clock(cells['B'])
+                if first_day is None:
+                    first_day = day
+                yield (day - first_day) * 86400 + seconds, float(cells['C'])
+
+
+def resample_ticks(ticks, resolution):
+    """
+    Resamples a stream of price events onto a regular grid, keeping the first price in each interval as the minute
+    bar files' opening prices are kept
+    :param ticks: Iterable of (seconds, price), in time order
+    :param resolution: Seconds per interval; None to keep every event
+    :return: [event times, prices], as arrays of seconds since the first event and of prices
+    """
+    event_times = array('d')
+    prices = array('d')
+    first_time = None
+    last_bucket = None
+    for (seconds, price) in ticks:
+        if first_time is None:
+            first_time = seconds
+        if resolution is None:
+            event_times.append(seconds - first_time)
+            prices.append(price)
+            continue
+        bucket = int((seconds - first_time) // resolution)
+        if bucket != last_bucket:
+            event_times.append(bucket * resolution)
+            prices.append(price)
+            last_bucket = bucket
+    return [event_times, prices]
+
+
+def parse_offset_events(file_name, scale_factor, resolution=None):
+    """
+    read in a real-world-data data-file for the SDS offset function
+    rows are streamed from CSV or xlsx files and resampled as they are read, so only the resampled series is held
+    assumes data file is sorted in t order, in correct format, etc. etc.
+    :param file_name: Path to the CSV or xlsx file
+    :param scale_factor: Offset given to the highest price in the file, the lowest being given 0
+    :param resolution: Seconds per offset event, resampling the file; None for one event per row
+    :return: offset events as [normalised event times, offsets], two arrays in time order for bisection
+    """
+    if file_name.lower().endswith('.xlsx'):
+        ticks = iter_xlsx_ticks(file_name)
+    else:
+        ticks = iter_csv_ticks(file_name)
+    [event_times, prices] = resample_ticks(ticks, resolution)
+    if len(prices) < 1:
+        sys.exit(f'FATAL: no price events in real world data file {file_name}')
+
+    # normalise times to fractions of entire t-series duration & normalise price range
+    min_price = min(prices)
+    price_range = max(prices) - min_price
+    end_time = event_times[-1]
+    event_offsets = array('q')
+    for i, price in enumerate(prices):
+        # normalise price
+        normld_price = (price - min_price) / price_range
+        # clip
+        normld_price = min(normld_price, 1.0)
+        normld_price = max(0.0, normld_price)
+        # scale & convert to integer cents
+        event_offsets.append(int(round(normld_price * scale_factor)))
+        event_times[i] = event_times[i] / end_time
+    return [event_times, event_offsets]
+
+
+def file_digest(file_name):
+    """
+    :param file_name: Path to a file
+    :return: Hex SHA-256 digest of the file's contents
+    """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_offset_cache(cache_file):
+    """
+    Reads offset events back from a binary cache file
+    :param cache_file: Path to the cache file
+    :return: offset events as returned by parse_offset_events(), or None if the file is not a complete cache
+    """
+    with open(cache_file, 'rb') as cache:
+        header = cache.read(OFFSET_CACHE_HEADER.size)
+        if len(header) < OFFSET_CACHE_HEADER.size:
+            return None
+        magic, n_events = OFFSET_CACHE_HEADER.unpack(header)
+        if magic != OFFSET_CACHE_MAGIC:
+            return None
+        event_times = array('d')
+        event_offsets = array('q')
+        try:
+            event_times.fromfile(cache, n_events)
+            event_offsets.fromfile(cache, n_events)
+        except EOFError:
+            return None
+    if sys.byteorder == 'big':
+        event_times.byteswap()
+        event_offsets.byteswap()
+    return [event_times, event_offsets]
+
+
+def write_offset_cache(cache_file, events):
+    """
+    Writes offset events to a binary cache file, atomically so that concurrent readers never see part of one
+    :param cache_file: Path to the cache file
+    :param events: offset events as returned by parse_offset_events()
+    """
+    [event_times, event_offsets] = events
+    if sys.byteorder == 'big':
+        event_times = array('d', event_times)
+        event_offsets = array('q', event_offsets)
+        event_times.byteswap()
+        event_offsets.byteswap()
+    cache_dir = os.path.dirname(cache_file) or '.'
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', dir=cache_dir, delete=False) as cache:
+        cache.write(OFFSET_CACHE_HEADER.pack(OFFSET_CACHE_MAGIC, len(event_times)))
+        event_times.tofile(cache)
+        event_offsets.tofile(cache)
+    os.replace(cache.name, cache_file)
+
+
+def load_offset_events(file_name, scale_factor, resolution=None, cache_dir=None):
+    """
+    Loads the offset events of a real-world-data file, parsing it only if neither this process nor the cache has
+    already done so
+    :param file_name: Path to the CSV or xlsx file
+    :param scale_factor: Offset given to the highest price in the file, the lowest being given 0
+    :param resolution: Seconds per offset event, resampling the file; None for one event per row
+    :param cache_dir: Directory of binary cache files; None to cache in memory only
+    :return: offset events as returned by parse_offset_events(); treat as read-only, as they are shared
+    """
+    stat = os.stat(file_name)
+    key = (os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size, scale_factor, resolution)
+    if key in LOADED:
+        return LOADED[key]
+
+    events = None
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, f'{os.path.basename(file_name)}.{file_digest(file_name)}.'
+                                             f'{scale_factor}.{resolution}.offsets')
+        if os.path.isfile(cache_file):
+            events = read_offset_cache(cache_file)
+    if events is None:
+        events = parse_offset_events(file_name, scale_factor, resolution)
+        if cache_file is not None:
+            write_offset_cache(cache_file, events)
+    LOADED[key] = events
+    return events
@@ -0,0 +1,200 @@
+"""
+Module containing the exchange's tape: the record of trades and cancellations
+
+Recent records are held in memory for publication to traders. The full history is streamed to a compact
+fixed-width binary file by a background writer thread, and can be exported to CSV afterwards:
+    $ python3 tbse_tape.py <tape file> <csv file>
+"""
+import collections
+import queue
+import struct
+import sys
+import tempfile
+import threading
+
+# kind, order type, t, price, qty, trader id, counterparty trader id, customer order id, counterparty coid
+#   Trade rows hold party1, party2, coid and counter in the last four fields
+#   Cancel rows hold the cancelled order's tid, an empty tid, its coid and its toid (-1 if not yet assigned)
+TAPE_RECORD = struct.Struct('<BBddi8s8sqq')
+TAPE_KINDS = ('Trade', 'Cancel')
+ORDER_TYPES = ('Bid', 'Ask')
+
+
+def pack_record(record):
+    """
+    Packs a trade or cancel record into the fixed-width binary tape format
+    :param record: Trade or Cancel record, as appended to the tape by the exchange
+    :return: bytes of length TAPE_RECORD.size
+    """
+    if record['type'] == 'Trade':
+        return TAPE_RECORD.pack(0, 0, record['t'], record['price'], record['qty'], record['party1'].encode(),
+                                record['party2'].encode(), record['coid'], record['counter'])
+    order = record['order']
+    # an order killed before the exchange processed it has no toid yet
+    toid = order.toid if isinstance(order.toid, int) else -1
+    return TAPE_RECORD.pack(1, ORDER_TYPES.index(order.otype), record['t'], order.price, order.qty,
+                            order.tid.encode(), b'', order.coid, toid)
+
+
+def unpack_record(data):
+    """
+    Unpacks one fixed-width binary tape record
+    :param data: bytes of length TAPE_RECORD.size
+    :return: Trade rows as [type, t, price, party1, party2, qty, coid, counter]
+             Cancel rows as [type, t, tid, otype, price, qty, coid, toid]
+    """
+    kind, otype, t, price, qty, tid1, tid2, coid1, coid2 = TAPE_RECORD.unpack(data)
+    if price.is_integer():
+        price = int(price)
+    tid1 = tid1.rstrip(b'\0').decode()
+    if kind == 0:
+        return [TAPE_KINDS[kind], t, price, tid1, tid2.rstrip(b'\0').decode(), qty, coid1, coid2]
+    return [TAPE_KINDS[kind], t, tid1, ORDER_TYPES[otype], price, qty, coid1, coid2]
+
+
+def read_tape(tape_file, start=0):
+    """
+    Reads records back from a binary tape file
+    :param tape_file: Open binary file holding the tape
+    :param start: Offset in the file at which the records begin
+    :return: List of rows as returned by unpack_record(), oldest first
+    """
+    tape_file.seek(start)
+    data = tape_file.read()
+    return [unpack_record(data[i:i + TAPE_RECORD.size]) for i in range(0, len(data), TAPE_RECORD.size)]
+
+
+def export_csv(rows, csv_file):
+    """
+    Writes the trades among a list of tape rows as CSV, one 't, price' line per trade
+    :param rows: Rows as returned by read_tape()
+    :param csv_file: Open text file to write to
+    """
+    for row in rows:
+        if row[0] == 'Trade':
+            csv_file.write(f'{row[1]}, {row[2]}\n')
+
+
+class TapeWriter(threading.Thread):
+    """
+    Background thread that streams tape records to a binary file, packing and flushing them in batches
+    so the exchange thread only pays for putting each record on a queue
+    """
+    def __init__(self, tape_file, batch_size):
+        """
+        :param tape_file: Open binary file to append records to
+        :param batch_size: Maximum number of records written per flush
+        """
+        super().__init__(daemon=True)
+        self.tape_file = tape_file
+        self.batch_size = batch_size
+        self.records = queue.Queue()
+
+    def run(self):
+        """
+        Writes batches of records until the None sentinel is received
+        """
+        running = True
+        while running:
+            batch = [self.records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get(block=False))
+                except queue.Empty:
+                    break
+            data = []
+            for record in batch:
+                if record is None:
+                    running = False
+                else:
+                    data.append(pack_record(record))
+            self.tape_file.write(b''.join(data))
+            self.tape_file.flush()
+            for _ in batch:
+                self.records.task_done()
+
+
+class Tape:
+    """
+    Record of trades and cancellations on the exchange
+    Only the most recent records are held in memory, in a ring buffer whose contents are published to the traders;
+    the full history is streamed to a binary file by a TapeWriter thread as each record arrives
+    """
+    def __init__(self, window, file_name=None, batch_size=256):
+        """
+        :param window: Number of most recent records held in memory and published to traders
+        :param file_name: Binary file the history is appended to; None for a temporary file deleted on close
+        :param batch_size: Maximum number of records written per flush
+        """
+        self.recent = collections.deque(maxlen=window)
+        self.n_records = 0
+        # cached tuple of the recent records, and the record count it was taken at
+        self.window = ()
+        self.window_n = 0
+        if file_name is None:
+            self.tape_file = tempfile.TemporaryFile('w+b')
+        else:
+            # pylint: disable=consider-using-with
+            self.tape_file = open(file_name, 'a+b')
+        self.tape_file.seek(0, 2)
+        # offset at which this tape's records begin, as a file may hold the tapes of many sessions
+        self.start = self.tape_file.tell()
+        self.writer = TapeWriter(self.tape_file, batch_size)
+        self.writer.start()
+
+    def __len__(self):
+        return self.n_records
+
+    def append(self, record):
+        """
+        Adds a trade or cancel record to the in-memory window and queues it for writing
+        :param record: Trade or Cancel record
+        """
+        self.recent.append(record)
+        self.n_records += 1
+        self.writer.records.put(record)
+
+    def recent_records(self):
+        """
+        :return: Tuple of the most recent records, oldest first; the same tuple until another record is added
+        """
+        if self.window_n != self.n_records:
+            self.window = tuple(self.recent)
+            self.window_n = self.n_records
+        return self.window
+
+    def history(self):
+        """
+        Waits for queued records to be written, then reads back this tape's full history
+        :return: List of rows as returned by unpack_record(), oldest first
+        """
+        self.writer.records.join()
+        rows = read_tape(self.tape_file, self.start)
+        self.tape_file.seek(0, 2)
+        return rows
+
+    def wipe(self):
+        """
+        Discards all records, both in memory and on disk
+        """
+        self.writer.records.join()
+        self.recent.clear()
+        self.n_records = 0
+        self.window = ()
+        self.window_n = 0
+        self.tape_file.truncate(self.start)
+
+    def close(self):
+        """
+        Writes any queued records, stops the writer thread and closes the file
+        """
+        self.writer.records.put(None)
+        self.writer.join()
+        self.tape_file.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit('Usage: python3 tbse_tape.py <tape file> <csv file>')
+    with open(sys.argv[1], 'rb') as in_file, open(sys.argv[2], 'w', encoding="utf-8") as out_file:
+        export_csv(read_tape(in_file), out_file)
@@ -1,17 +1,143 @@
 """Module containing all trader algos"""
 # pylint: disable=too-many-lines
+import bisect
+import collections
 import math
 import random
 import sys
 
+from tbse_latency import CALL_SITES, LatencyHistogram
 from tbse_msg_classes import Order
 from tbse_sys_consts import TBSE_SYS_MAX_PRICE, TBSE_SYS_MIN_PRICE
 
 
+def counts_at_or_below(values, prices):
+    """
+    Counts, for each of a run of prices, how many of a sorted list of values are at or below it
+    Both lists are walked once together, so the cost is linear in their combined length
+    :param values: Values, sorted ascending
+    :param prices: Prices, sorted ascending
+    :return: List of counts, one per price
+    """
+    counts = []
+    i = 0
+    n_values = len(values)
+    for price in prices:
+        while i < n_values and values[i] <= price:
+            i += 1
+        counts.append(i)
+    return counts
+
+
+def counts_below(values, prices):
+    """
+    Counts, for each of a run of prices, how many of a sorted list of values are strictly below it
+    :param values: Values, sorted ascending
+    :param prices: Prices, sorted ascending
+    :return: List of counts, one per price
+    """
+    counts = []
+    i = 0
+    n_values = len(values)
+    for price in prices:
+        while i < n_values and values[i] < price:
+            i += 1
+        counts.append(i)
+    return counts
+
+
+def evidence_counts(prices, at_or_below, at_or_above):
+    """
+    Counts, for each of a run of prices, the values of several sorted lists lying on the side of it that counts
+    :param prices: Prices, sorted ascending
+    :param at_or_below: Lists of values, each sorted ascending, whose values at or below each price are counted
+    :param at_or_above: Lists of values, each sorted ascending, whose values at or above each price are counted
+    :return: List of counts, one per price
+    """
+    totals = [0] * len(prices)
+    for values in at_or_below:
+        totals = [total + n for (total, n) in zip(totals, counts_at_or_below(values, prices))]
+    for values in at_or_above:
+        totals = [total + len(values) - n for (total, n) in zip(totals, counts_below(values, prices))]
+    return totals
+
+
+def belief_ratios(for_counts, against_counts):
+    """
+    :param for_counts: Per-price counts of evidence that an offer at that price would trade
+    :param against_counts: Per-price counts of evidence that it would not
+    :return: List of beliefs, the fraction of the evidence at each price in favour of trading; 0 where there is none
+    """
+    return [0 if n_for + n_against == 0 else n_for / (n_for + n_against)
+            for (n_for, n_against) in zip(for_counts, against_counts)]
+
+
+def side_changes(prev_best, lob_best_p, trade, lob, sign):
+    """
+    Works out what has happened to the best price on one side of the LOB since an observer last saw it
+    :param prev_best: (price, quantity) of the best the observer last saw on this side, price None if it was empty
+    :param lob_best_p: Current best price on this side, or None if it is empty
+    :param trade: Trade which occurred to trigger this response, or None
+    :param lob: Current state of the limit order book
+    :param sign: 1 for the bid side, where higher prices are better; -1 for the ask side
+    :return: (improved, taken): whether the best price has improved, and whether the previous best was traded against
+    """
+    (prev_best_p, prev_best_q) = prev_best
+    if lob_best_p is not None:
+        # non-empty side of the LOB, whose best quantity is always taken to be 1
+        if prev_best_p is None:
+            return False, False
+        if sign * (lob_best_p - prev_best_p) > 0:
+            # best price has improved -- NB doesn't check if the improvement was by self
+            return True, False
+        # trade happened and best price has got worse, or stayed same but quantity reduced: assume it was taken
+        return False, trade is not None and (sign * (prev_best_p - lob_best_p) > 0 or (
+            prev_best_p == lob_best_p and prev_best_q > 1))
+    if prev_best_p is not None:
+        # this side of the LOB has been emptied: was it cancelled or taken?
+        return False, lob['tape'][-1]['type'] != 'Cancel'
+    return False, False
+
+
+def lob_changes(observer, lob, trade):
+    """
+    Works out what has happened on the LOB since an observer last saw it, as ZIP and AA judge it, then moves the
+    observer's memory of the best bid and ask (prev_best_bid_p, prev_best_bid_q, prev_best_ask_p, prev_best_ask_q)
+    on to the current LOB
+    :param observer: Trader, or TraderBatch, remembering the best prices and quantities it last saw
+    :param lob: Current state of the limit order book
+    :param trade: Trade which occurred to trigger this response, or None
+    :return: (bid_improved, bid_hit, ask_improved, ask_lifted)
+    """
+    lob_best_bid_p = lob['bids']['best']
+    lob_best_ask_p = lob['asks']['best']
+    (bid_improved, bid_hit) = side_changes((observer.prev_best_bid_p, observer.prev_best_bid_q), lob_best_bid_p,
+                                           trade, lob, 1)
+    (ask_improved, ask_lifted) = side_changes((observer.prev_best_ask_p, observer.prev_best_ask_q), lob_best_ask_p,
+                                              trade, lob, -1)
+
+    # remember the best LOB data ready for next response
+    observer.prev_best_bid_p = lob_best_bid_p
+    observer.prev_best_bid_q = None if lob_best_bid_p is None else 1
+    observer.prev_best_ask_p = lob_best_ask_p
+    observer.prev_best_ask_q = None if lob_best_ask_p is None else 1
+
+    return bid_improved, bid_hit, ask_improved, ask_lifted
+
+
+# GDX tables of expected values, indexed by (job, limit, gamma, holdings, offer opportunities, accepted bids, accepted
+# asks, outstanding bid prices, outstanding ask prices): everything the table is computed from
+GDX_VALUE_TABLES = {}
+GDX_VALUE_TABLES_MAX = 4096  # tables remembered before the memo is cleared
+
+
 # pylint: disable=too-many-instance-attributes
 class Trader:
     """Trader superclass - mostly unchanged from original BSE code by Dave Cliff
-    all Traders have a trader id, bank balance, blotter, and list of orders to execute"""
+    all Traders have a trader id, bank balance, blotter, and list of orders to execute
+    traders and their subclasses are slotted: each subclass lists only the attributes it adds"""
+    __slots__ = ('ttype', 'tid', 'balance', 'blotter', 'orders', 'n_quotes', 'willing', 'able', 'birth_time',
+                 'profit_per_time', 'n_trades', 'last_quote', 'latency')
 
     def __init__(self, ttype, tid, balance, time):
         self.ttype = ttype  # what type / strategy this trader is
@@ -26,7 +152,8 @@ class Trader:
         self.profit_per_time = 0  # profit per unit t
         self.n_trades = 0  # how many trades has this trader done?
         self.last_quote = None  # record of what its last quote was
-        self.times = [0, 0, 0, 0]  # values used to calculate timing elements
+        # latency histogram of each call site timed, indexed by name
+        self.latency = {call: LatencyHistogram() for call in CALL_SITES}
 
     def __str__(self):
         return f'[TID {self.tid} type {self.ttype} balance {self.balance} blotter {self.blotter} ' \
@@ -138,6 +265,8 @@ class TraderGiveaway(Trader):
     even dumber than a ZI-U: just give the deal away
     (but never makes a loss)
     """
+    __slots__ = ()
+
     def get_order(self, time, countdown, lob):
         """
         Get's giveaway traders order - in this case the price is just the limit price from the customer order
@@ -163,6 +292,8 @@ class TraderGiveaway(Trader):
 class TraderZic(Trader):
     """ Trader subclass ZI-C
     After Gode & Sunder 1993"""
+    __slots__ = ()
+
     def get_order(self, time, countdown, lob):
         """
         Gets ZIC trader, limit price is randomly selected
@@ -195,6 +326,8 @@ class TraderShaver(Trader):
     """Trader subclass Shaver
     shaves a penny off the best price
     if there is no best price, creates "stub quote" at system max/min"""
+    __slots__ = ()
+
     def get_order(self, time, countdown, lob):
         """
         Get's Shaver trader order by shaving/adding a penny to current best bid
@@ -233,6 +366,8 @@ class TraderSniper(Trader):
     Based on Shaver,
     "lurks" until t remaining < threshold% of the trading session
     then gets increasing aggressive, increasing "shave thickness" as t runs out"""
+    __slots__ = ()
+
     def get_order(self, time, countdown, lob):
         """
         :param time: Current time
@@ -276,6 +411,8 @@ class TraderZip(Trader):
     NB this implementation keeps separate margin values for buying & selling,
        so a single trader can both buy AND sell
        -- in the original, traders were either buyers OR sellers"""
+    __slots__ = ('job', 'active', 'prev_change', 'beta', 'momentum', 'ca', 'cr', 'margin', 'margin_buy', 'margin_sell',
+                 'price', 'limit', 'prev_best_bid_p', 'prev_best_bid_q', 'prev_best_ask_p', 'prev_best_ask_q')
 
     def __init__(self, ttype, tid, balance, time):
 
@@ -294,7 +431,6 @@ class TraderZip(Trader):
         self.margin_sell = m_fix + m_var * random.random()
         self.price = None
         self.limit = None
-        self.times = [0, 0, 0, 0]
         # memory of best price & quantity of best bid and ask, on LOB on previous update
         self.prev_best_bid_p = None
         self.prev_best_bid_q = None
@@ -331,7 +467,66 @@ class TraderZip(Trader):
             self.last_quote = order
         return order
 
-    # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+    def target_up(self, price):
+        """
+        generate a higher target price by randomly perturbing given price
+        :param price: Current price
+        :return: New price target
+        """
+        ptrb_abs = self.ca * random.random()  # absolute shift
+        ptrb_rel = price * (1.0 + (self.cr * random.random()))  # relative shift
+        target = int(round(ptrb_rel + ptrb_abs, 0))
+
+        return target
+
+    def target_down(self, price):
+        """
+        generate a lower target price by randomly perturbing given price
+        :param price: Current price
+        :return: New price target
+        """
+        ptrb_abs = self.ca * random.random()  # absolute shift
+        ptrb_rel = price * (1.0 - (self.cr * random.random()))  # relative shift
+        target = int(round(ptrb_rel - ptrb_abs, 0))
+
+        return target
+
+    def willing_to_trade(self, price):
+        """
+        am I willing to trade at this price?
+        :param price: Price to be traded out
+        :return: Is the trader willing to trade
+        """
+        willing = False
+        if self.job == 'Bid' and self.active and self.price >= price:
+            willing = True
+        if self.job == 'Ask' and self.active and self.price <= price:
+            willing = True
+        return willing
+
+    def profit_alter(self, price):
+        """
+        Update target profit margin
+        :param price: New target profit margin
+        """
+        old_price = self.price
+        diff = price - old_price
+        change = ((1.0 - self.momentum) * (self.beta * diff)) + (self.momentum * self.prev_change)
+        self.prev_change = change
+        new_margin = ((self.price + change) / self.limit) - 1.0
+
+        if self.job == 'Bid':
+            if new_margin < 0.0:
+                self.margin_buy = new_margin
+                self.margin = new_margin
+        else:
+            if new_margin > 0.0:
+                self.margin_sell = new_margin
+                self.margin = new_margin
+
+        # set the price from limit and profit-margin
+        self.price = int(round(self.limit * (1.0 + self.margin), 0))
+
     def respond(self, time, lob, trade, verbose):
         """
         update margin on basis of what happened in marke
@@ -342,123 +537,26 @@ class TraderZip(Trader):
         :param trade: Trade being responded to
         :param verbose: Should verbose logging be printed to console
         """
+        changes = lob_changes(self, lob, trade)
+        (bid_improved, bid_hit, ask_improved, ask_lifted) = changes
 
-        def target_up(price):
-            """
-            generate a higher target price by randomly perturbing given price
-            :param price: Current price
-            :return: New price target
-            """
-            ptrb_abs = self.ca * random.random()  # absolute shift
-            ptrb_rel = price * (1.0 + (self.cr * random.random()))  # relative shift
-            target = int(round(ptrb_rel + ptrb_abs, 0))
-
-            return target
-
-        def target_down(price):
-            """
-            generate a lower target price by randomly perturbing given price
-            :param price: Current price
-            :return: New price target
-            """
-            ptrb_abs = self.ca * random.random()  # absolute shift
-            ptrb_rel = price * (1.0 - (self.cr * random.random()))  # relative shift
-            target = int(round(ptrb_rel - ptrb_abs, 0))
-
-            return target
-
-        def willing_to_trade(price):
-            """
-            am I willing to trade at this price?
-            :param price: Price to be traded out
-            :return: Is the trader willing to trade
-            """
-            willing = False
-            if self.job == 'Bid' and self.active and self.price >= price:
-                willing = True
-            if self.job == 'Ask' and self.active and self.price <= price:
-                willing = True
-            return willing
-
-        def profit_alter(price):
-            """
-            Update target profit margin
-            :param price: New target profit margin
-            """
-            old_price = self.price
-            diff = price - old_price
-            change = ((1.0 - self.momentum) * (self.beta * diff)) + (self.momentum * self.prev_change)
-            self.prev_change = change
-            new_margin = ((self.price + change) / self.limit) - 1.0
-
-            if self.job == 'Bid':
-                if new_margin < 0.0:
-                    self.margin_buy = new_margin
-                    self.margin = new_margin
-            else:
-                if new_margin > 0.0:
-                    self.margin_sell = new_margin
-                    self.margin = new_margin
-
-            # set the price from limit and profit-margin
-            self.price = int(round(self.limit * (1.0 + self.margin), 0))
+        if verbose and (bid_improved or bid_hit or ask_improved or ask_lifted):
+            print('B_improved', bid_improved, 'B_hit', bid_hit, 'A_improved', ask_improved, 'A_lifted', ask_lifted)
 
-        # what, if anything, has happened on the bid LOB?
-        bid_improved = False
-        bid_hit = False
+        self.react(lob, trade, changes)
 
+    # pylint: disable=too-many-branches
+    def react(self, lob, trade, changes):
+        """
+        alters the margin in reaction to what has happened on the LOB
+        nothing is done unless at least one of the four flags is set
+        :param lob: Limit order book
+        :param trade: Trade being responded to
+        :param changes: (bid_improved, bid_hit, ask_improved, ask_lifted), as returned by lob_changes()
+        """
+        (bid_improved, bid_hit, ask_improved, ask_lifted) = changes
         lob_best_bid_p = lob['bids']['best']
-        lob_best_bid_q = None
-        if lob_best_bid_p is not None:
-            # non-empty bid LOB
-            lob_best_bid_q = 1
-            if self.prev_best_bid_p is None:
-                self.prev_best_bid_p = lob_best_bid_p
-            elif self.prev_best_bid_p < lob_best_bid_p:
-                # best bid has improved
-                # NB doesn't check if the improvement was by self
-                bid_improved = True
-            elif trade is not None and ((self.prev_best_bid_p > lob_best_bid_p) or (
-                    (self.prev_best_bid_p == lob_best_bid_p) and (self.prev_best_bid_q > lob_best_bid_q))):
-                # previous best bid was hit
-                bid_hit = True
-        elif self.prev_best_bid_p is not None:
-            # the bid LOB has been emptied: was it cancelled or hit?
-            last_tape_item = lob['tape'][-1]
-            if last_tape_item['type'] == 'Cancel':
-                bid_hit = False
-            else:
-                bid_hit = True
-
-        # what, if anything, has happened on the ask LOB?
-        ask_improved = False
-        ask_lifted = False
         lob_best_ask_p = lob['asks']['best']
-        lob_best_ask_q = None
-        if lob_best_ask_p is not None:
-            # non-empty ask LOB
-            lob_best_ask_q = 1
-            if self.prev_best_ask_p is None:
-                self.prev_best_ask_p = lob_best_ask_p
-            elif self.prev_best_ask_p > lob_best_ask_p:
-                # best ask has improved -- NB doesn't check if the improvement was by self
-                ask_improved = True
-            elif trade is not None and ((self.prev_best_ask_p < lob_best_ask_p) or (
-                    (self.prev_best_ask_p == lob_best_ask_p) and (self.prev_best_ask_q > lob_best_ask_q))):
-                # trade happened and best ask price has got worse, or stayed same but quantity reduced
-                # assume previous best ask was lifted
-                ask_lifted = True
-        elif self.prev_best_ask_p is not None:
-            # the ask LOB is empty now but was not previously: canceled or lifted?
-            last_tape_item = lob['tape'][-1]
-            if last_tape_item['type'] == 'Cancel':
-                ask_lifted = False
-            else:
-                ask_lifted = True
-
-        if verbose and (bid_improved or bid_hit or ask_improved or ask_lifted):
-            print('B_improved', bid_improved, 'B_hit', bid_hit, 'A_improved', ask_improved, 'A_lifted', ask_lifted)
-
         deal = bid_hit or ask_lifted
 
         if self.job == 'Ask':
@@ -467,20 +565,20 @@ class TraderZip(Trader):
                 trade_price = trade['price']
                 if self.price <= trade_price:
                     # could sell for more? raise margin
-                    target_price = target_up(trade_price)
-                    profit_alter(target_price)
-                elif ask_lifted and self.active and not willing_to_trade(trade_price):
+                    target_price = self.target_up(trade_price)
+                    self.profit_alter(target_price)
+                elif ask_lifted and self.active and not self.willing_to_trade(trade_price):
                     # wouldn't have got this deal, still working order, so reduce margin
-                    target_price = target_down(trade_price)
-                    profit_alter(target_price)
+                    target_price = self.target_down(trade_price)
+                    self.profit_alter(target_price)
             else:
                 # no deal: aim for a target price higher than best bid
                 if ask_improved and self.price > lob_best_ask_p:
                     if lob_best_bid_p is not None:
-                        target_price = target_up(lob_best_bid_p)
+                        target_price = self.target_up(lob_best_bid_p)
                     else:
                         target_price = lob['asks']['worst']  # stub quote
-                    profit_alter(target_price)
+                    self.profit_alter(target_price)
 
         if self.job == 'Bid':
             # buyer
@@ -488,26 +586,20 @@ class TraderZip(Trader):
                 trade_price = trade['price']
                 if self.price >= trade_price:
                     # could buy for less? raise margin (i.e. cut the price)
-                    target_price = target_down(trade_price)
-                    profit_alter(target_price)
-                elif bid_hit and self.active and not willing_to_trade(trade_price):
+                    target_price = self.target_down(trade_price)
+                    self.profit_alter(target_price)
+                elif bid_hit and self.active and not self.willing_to_trade(trade_price):
                     # wouldn't have got this deal, still working order, so reduce margin
-                    target_price = target_up(trade_price)
-                    profit_alter(target_price)
+                    target_price = self.target_up(trade_price)
+                    self.profit_alter(target_price)
             else:
                 # no deal: aim for target price lower than best ask
                 if bid_improved and self.price < lob_best_bid_p:
                     if lob_best_ask_p is not None:
-                        target_price = target_down(lob_best_ask_p)
+                        target_price = self.target_down(lob_best_ask_p)
                     else:
                         target_price = lob['bids']['worst']  # stub quote
-                    profit_alter(target_price)
-
-        # remember the best LOB data ready for next response
-        self.prev_best_bid_p = lob_best_bid_p
-        self.prev_best_bid_q = lob_best_bid_q
-        self.prev_best_ask_p = lob_best_ask_p
-        self.prev_best_ask_q = lob_best_ask_q
+                    self.profit_alter(target_price)
 
 
 # pylint: disable=too-many-instance-attributes
@@ -517,6 +609,13 @@ class TraderAa(Trader):
     For more details see: Vytelingum, P., 2006. The Structure and Behaviour of the Continuous Double
     Auction. PhD Thesis, University of Southampton
     """
+    __slots__ = ('active', 'limit', 'job', 'r_shout_change_relative', 'r_shout_change_absolute',
+                 'short_term_learning_rate', 'long_term_learning_rate', 'moving_average_weight_decay',
+                 'moving_average_window_size', 'offer_change_rate', 'theta', 'theta_max', 'theta_min', 'market_max',
+                 'previous_transactions', 'moving_average_weights', 'moving_average_weight_sum',
+                 'estimated_equilibrium', 'eq_n', 'eq_mean', 'eq_m2', 'smiths_alpha', 'smiths_alpha_min',
+                 'smiths_alpha_max', 'prev_best_bid_p', 'prev_best_bid_q', 'prev_best_ask_p', 'prev_best_ask_q',
+                 'r_shout', 'buy_target', 'sell_target', 'buy_r', 'sell_r')
 
     def __init__(self, ttype, tid, balance, time):
         # Stuff about trader
@@ -540,12 +639,21 @@ class TraderAa(Trader):
         self.market_max = TBSE_SYS_MAX_PRICE
 
         # Variables to describe the market
-        self.previous_transactions = []
+        # only the most recent transactions and estimates are held: the history that alpha and theta depend on is
+        # summarised by running statistics, so memory and the cost of each deal stay flat over the session
+        self.previous_transactions = collections.deque(maxlen=self.moving_average_window_size)
         self.moving_average_weights = []
         for i in range(self.moving_average_window_size):
             self.moving_average_weights.append(self.moving_average_weight_decay ** i)
-        self.estimated_equilibrium = []
-        self.smiths_alpha = []
+        self.moving_average_weight_sum = sum(self.moving_average_weights)
+        self.estimated_equilibrium = collections.deque(maxlen=self.moving_average_window_size)
+        # count, mean and sum of squared deviations from the mean of every equilibrium estimate (Welford's method)
+        self.eq_n = 0
+        self.eq_mean = 0.0
+        self.eq_m2 = 0.0
+        self.smiths_alpha = collections.deque(maxlen=self.moving_average_window_size)
+        self.smiths_alpha_min = None
+        self.smiths_alpha_max = None
         self.prev_best_bid_p = None
         self.prev_best_bid_q = None
         self.prev_best_ask_p = None
@@ -569,24 +677,31 @@ class TraderAa(Trader):
             return
         if len(self.previous_transactions) < self.moving_average_window_size:
             # Not enough transactions
-            self.estimated_equilibrium.append(
-                float(sum(self.previous_transactions)) / max(len(self.previous_transactions), 1))
+            eq = float(sum(self.previous_transactions)) / max(len(self.previous_transactions), 1)
         else:
-            n_previous_transactions = self.previous_transactions[-self.moving_average_window_size:]
-            thing = [n_previous_transactions[i] * self.moving_average_weights[i] for i in
-                     range(self.moving_average_window_size)]
-            eq = sum(thing) / sum(self.moving_average_weights)
-            self.estimated_equilibrium.append(eq)
+            thing = [p * w for (p, w) in zip(self.previous_transactions, self.moving_average_weights)]
+            eq = sum(thing) / self.moving_average_weight_sum
+        self.estimated_equilibrium.append(eq)
+        self.eq_n += 1
+        delta = eq - self.eq_mean
+        self.eq_mean += delta / self.eq_n
+        self.eq_m2 += delta * (eq - self.eq_mean)
 
     def calc_alpha(self):
         """
         Calculates trader's alpha value - see AA paper for details.
+        The root mean square deviation of every estimate from the latest is found from the running statistics:
+        sum((p - latest) ** 2) = m2 + n * (mean - latest) ** 2
         """
-        alpha = 0.0
-        for p in self.estimated_equilibrium:
-            alpha += (p - self.estimated_equilibrium[-1]) ** 2
-        alpha = math.sqrt(alpha / len(self.estimated_equilibrium))
-        self.smiths_alpha.append(alpha / self.estimated_equilibrium[-1])
+        latest = self.estimated_equilibrium[-1]
+        alpha = self.eq_m2 + self.eq_n * (self.eq_mean - latest) ** 2
+        alpha = math.sqrt(max(alpha, 0.0) / self.eq_n)
+        alpha = alpha / latest
+        self.smiths_alpha.append(alpha)
+        if self.smiths_alpha_min is None or alpha < self.smiths_alpha_min:
+            self.smiths_alpha_min = alpha
+        if self.smiths_alpha_max is None or alpha > self.smiths_alpha_max:
+            self.smiths_alpha_max = alpha
 
     def calc_theta(self):
         """
@@ -594,11 +709,11 @@ class TraderAa(Trader):
         """
         gamma = 2.0  # not sensitive apparently so choose to be whatever
         # necessary for initialisation, div by 0
-        if min(self.smiths_alpha) == max(self.smiths_alpha):
+        if self.smiths_alpha_min == self.smiths_alpha_max:
             alpha_range = 0.4  # starting value i guess
         else:
-            alpha_range = (self.smiths_alpha[-1] - min(self.smiths_alpha)) / (
-                    max(self.smiths_alpha) - min(self.smiths_alpha))
+            alpha_range = (self.smiths_alpha[-1] - self.smiths_alpha_min) / (
+                    self.smiths_alpha_max - self.smiths_alpha_min)
         theta_range = self.theta_max - self.theta_min
         desired_theta = self.theta_min + theta_range * (1 - (alpha_range * math.exp(gamma * (alpha_range - 1))))
         self.theta = self.theta + self.long_term_learning_rate * (desired_theta - self.theta)
@@ -778,7 +893,6 @@ class TraderAa(Trader):
         self.last_quote = order
         return order
 
-    # pylint: disable=too-many-branches
     def respond(self, time, lob, trade, verbose):
         """
         Updates AA trader's internal variables based on activities on the LOB
@@ -789,62 +903,7 @@ class TraderAa(Trader):
         :param trade: trade which occurred to trigger this response
         :param verbose: should verbose logging be printed to the console
         """
-        bid_hit = False
-
-        lob_best_bid_p = lob['bids']['best']
-        lob_best_bid_q = None
-        if lob_best_bid_p is not None:
-            # non-empty bid LOB
-            lob_best_bid_q = 1
-            if self.prev_best_bid_p is None:
-                self.prev_best_bid_p = lob_best_bid_p
-            # elif self.prev_best_bid_p < lob_best_bid_p :
-            #     # best bid has improved
-            #     # NB doesn't check if the improvement was by self
-            #     bid_improved = True
-            elif trade is not None and ((self.prev_best_bid_p > lob_best_bid_p) or (
-                    (self.prev_best_bid_p == lob_best_bid_p) and (self.prev_best_bid_q > lob_best_bid_q))):
-                # previous best bid was hit
-                bid_hit = True
-        elif self.prev_best_bid_p is not None:
-            # the bid LOB has been emptied: was it cancelled or hit?
-            last_tape_item = lob['tape'][-1]
-            if last_tape_item['type'] == 'Cancel':
-                bid_hit = False
-            else:
-                bid_hit = True
-
-        # what, if anything, has happened on the ask LOB?
-        # ask_improved = False
-        ask_lifted = False
-
-        lob_best_ask_p = lob['asks']['best']
-        lob_best_ask_q = None
-        if lob_best_ask_p is not None:
-            # non-empty ask LOB
-            lob_best_ask_q = 1
-            if self.prev_best_ask_p is None:
-                self.prev_best_ask_p = lob_best_ask_p
-            # elif self.prev_best_ask_p > lob_best_ask_p :
-            #     # best ask has improved -- NB doesn't check if the improvement was by self
-            #     ask_improved = True
-            elif trade is not None and ((self.prev_best_ask_p < lob_best_ask_p) or (
-                    (self.prev_best_ask_p == lob_best_ask_p) and (self.prev_best_ask_q > lob_best_ask_q))):
-                # trade happened and best ask price has got worse, or stayed same but quantity reduced
-                # assume previous best ask was lifted
-                ask_lifted = True
-        elif self.prev_best_ask_p is not None:
-            # the ask LOB is empty now but was not previously: canceled or lifted?
-            last_tape_item = lob['tape'][-1]
-            if last_tape_item['type'] == 'Cancel':
-                ask_lifted = False
-            else:
-                ask_lifted = True
-
-        self.prev_best_bid_p = lob_best_bid_p
-        self.prev_best_bid_q = lob_best_bid_q
-        self.prev_best_ask_p = lob_best_ask_p
-        self.prev_best_ask_q = lob_best_ask_q
+        (_, bid_hit, _, ask_lifted) = lob_changes(self, lob, trade)
 
         deal = bid_hit or ask_lifted
 
@@ -852,17 +911,32 @@ class TraderAa(Trader):
 
         if deal:
             # if trade is not None:
-            self.previous_transactions.append(trade['price'])
-            if self.sell_target is None:
-                self.sell_target = trade['price']
-            if self.buy_target is None:
-                self.buy_target = trade['price']
-            self.calc_eq()
-            self.calc_alpha()
-            self.calc_theta()
-            self.calc_r_shout()
-            self.calc_agg()
-            self.calc_target()
+            self.observe_deal(trade['price'])
+            self.learn(trade['price'])
+
+    def observe_deal(self, price):
+        """
+        Updates the trader's model of the market with a deal: the equilibrium estimate and Smith's alpha
+        These depend only on the deals seen, so traders seeing the same deals can share one model
+        :param price: Price of the deal
+        """
+        self.previous_transactions.append(price)
+        self.calc_eq()
+        self.calc_alpha()
+
+    def learn(self, price):
+        """
+        Updates the trader's own strategy after a deal, from the model of the market
+        :param price: Price of the deal
+        """
+        if self.sell_target is None:
+            self.sell_target = price
+        if self.buy_target is None:
+            self.buy_target = price
+        self.calc_theta()
+        self.calc_r_shout()
+        self.calc_agg()
+        self.calc_target()
 
 
 # pylint: disable=too-many-instance-attributes
@@ -872,6 +946,11 @@ class TraderGdx(Trader):
     Tesauro, G., Bredin, J., 2002. Sequential Strategic Bidding in Auctions using Dynamic Programming.
     Proceedings AAMAS2002.
     """
+    __slots__ = ('prev_orders', 'job', 'active', 'limit', 'outstanding_bids', 'outstanding_asks',
+                 'outstanding_bid_prices', 'outstanding_ask_prices', 'accepted_asks', 'accepted_bids', 'curves',
+                 'price', 'prev_best_bid_p', 'prev_best_bid_q', 'prev_best_ask_p', 'prev_best_ask_q', 'first_turn',
+                 'gamma', 'holdings', 'remaining_offer_ops', 'values')
+
     def __init__(self, ttype, tid, balance, time):
         super().__init__(ttype, tid, balance, time)
         self.prev_orders = []
@@ -882,8 +961,14 @@ class TraderGdx(Trader):
         # memory of all bids and asks and accepted bids and asks
         self.outstanding_bids = []
         self.outstanding_asks = []
+        # prices of the outstanding bids and asks, and accepted bids and asks, each kept sorted ascending so that
+        # beliefs are counted by bisection rather than by scanning every price
+        self.outstanding_bid_prices = []
+        self.outstanding_ask_prices = []
         self.accepted_asks = []
         self.accepted_bids = []
+        # beliefs over each grid of candidate prices, indexed by (job, grid); valid until the memory above changes
+        self.curves = {}
 
         self.price = -1
 
@@ -945,9 +1030,11 @@ class TraderGdx(Trader):
         second_best_bid = 0
 
         # first step size of 1 get best and 2nd best
-        for i in [x * 2 for x in range(int(self.limit / 2))]:
-            thing = self.belief_buy(i) * ((self.limit - i) + self.gamma * self.values[m - 1][n - 1]) + (
-                    1 - self.belief_buy(i) * self.gamma * self.values[m][n - 1])
+        traded_value = self.gamma * self.values[m - 1][n - 1]
+        prices = [x * 2 for x in range(int(self.limit / 2))]
+        for (i, belief) in zip(prices, self.belief_curve(('Bid', self.limit), prices)):
+            thing = belief * ((self.limit - i) + traded_value) + (
+                    1 - belief * self.gamma * self.values[m][n - 1])
             if thing > best_return:
                 second_best_bid = best_bid
                 # second_best_return = best_return
@@ -962,10 +1049,12 @@ class TraderGdx(Trader):
             # best_bid = a
 
         # then step size 0.05
-        for i in [x * 0.05 for x in range(int(second_best_bid), int(best_bid))]:
-            thing = self.belief_buy(i + second_best_bid) * (
-                    (self.limit - (i + second_best_bid)) + self.gamma * self.values[m - 1][n - 1]) + (
-                            1 - self.belief_buy(i + second_best_bid) * self.gamma * self.values[m][n - 1])
+        steps = [x * 0.05 for x in range(int(second_best_bid), int(best_bid))]
+        beliefs = self.belief_curve(('Bid', second_best_bid, best_bid), [i + second_best_bid for i in steps])
+        for (i, belief) in zip(steps, beliefs):
+            thing = belief * (
+                    (self.limit - (i + second_best_bid)) + traded_value) + (
+                            1 - belief * self.gamma * self.values[m][n - 1])
             if thing > best_return:
                 best_return = thing
                 best_bid = i + second_best_bid
@@ -986,10 +1075,11 @@ class TraderGdx(Trader):
         second_best_ask = self.limit
 
         # first step size of 1 get best and 2nd best
-        for i in [x * 2 for x in range(int(self.limit / 2))]:
-            j = i + self.limit
-            thing = self.belief_sell(j) * ((j - self.limit) + self.gamma * self.values[m - 1][n - 1]) + (
-                    1 - self.belief_sell(j) * self.gamma * self.values[m][n - 1])
+        traded_value = self.gamma * self.values[m - 1][n - 1]
+        prices = [x * 2 + self.limit for x in range(int(self.limit / 2))]
+        for (j, belief) in zip(prices, self.belief_curve(('Ask', self.limit), prices)):
+            thing = belief * ((j - self.limit) + traded_value) + (
+                    1 - belief * self.gamma * self.values[m][n - 1])
             if thing > best_return:
                 second_best_ask = best_ask
                 # second_best_return = best_return
@@ -1003,10 +1093,12 @@ class TraderGdx(Trader):
             # best_ask = a
 
         # then step size 0.05
-        for i in [x * 0.05 for x in range(int(second_best_ask), int(best_ask))]:
-            thing = self.belief_sell(i + second_best_ask) * (
-                    ((i + second_best_ask) - self.limit) + self.gamma * self.values[m - 1][n - 1]) + (
-                            1 - self.belief_sell(i + second_best_ask) * self.gamma * self.values[m][n - 1])
+        steps = [x * 0.05 for x in range(int(second_best_ask), int(best_ask))]
+        beliefs = self.belief_curve(('Ask', second_best_ask, best_ask), [i + second_best_ask for i in steps])
+        for (i, belief) in zip(steps, beliefs):
+            thing = belief * (
+                    ((i + second_best_ask) - self.limit) + traded_value) + (
+                            1 - belief * self.gamma * self.values[m][n - 1])
             if thing > best_return:
                 best_return = thing
                 best_ask = i + second_best_ask
@@ -1019,18 +1111,9 @@ class TraderGdx(Trader):
         :param price: The price for which we want to calculate the belief.
         :return: The belief value (decimal).
         """
-        accepted_asks_greater = 0
-        bids_greater = 0
-        unaccepted_asks_lower = 0
-        for p in self.accepted_asks:
-            if p >= price:
-                accepted_asks_greater += 1
-        for p in [thing[0] for thing in self.outstanding_bids]:
-            if p >= price:
-                bids_greater += 1
-        for p in [thing[0] for thing in self.outstanding_asks]:
-            if p <= price:
-                unaccepted_asks_lower += 1
+        accepted_asks_greater = len(self.accepted_asks) - bisect.bisect_left(self.accepted_asks, price)
+        bids_greater = len(self.outstanding_bid_prices) - bisect.bisect_left(self.outstanding_bid_prices, price)
+        unaccepted_asks_lower = bisect.bisect_right(self.outstanding_ask_prices, price)
 
         if accepted_asks_greater + bids_greater + unaccepted_asks_lower == 0:
             return 0
@@ -1042,22 +1125,61 @@ class TraderGdx(Trader):
         :param price: The price for which we want to calculate the belief.
         :return: The belief value (decimal).
         """
-        accepted_bids_lower = 0
-        asks_lower = 0
-        unaccepted_bids_greater = 0
-        for p in self.accepted_bids:
-            if p <= price:
-                accepted_bids_lower += 1
-        for p in [thing[0] for thing in self.outstanding_asks]:
-            if p <= price:
-                asks_lower += 1
-        for p in [thing[0] for thing in self.outstanding_bids]:
-            if p >= price:
-                unaccepted_bids_greater += 1
+        accepted_bids_lower = bisect.bisect_right(self.accepted_bids, price)
+        asks_lower = bisect.bisect_right(self.outstanding_ask_prices, price)
+        unaccepted_bids_greater = len(self.outstanding_bid_prices) - bisect.bisect_left(self.outstanding_bid_prices,
+                                                                                        price)
         if accepted_bids_lower + asks_lower + unaccepted_bids_greater == 0:
             return 0
         return (accepted_bids_lower + asks_lower) / (accepted_bids_lower + asks_lower + unaccepted_bids_greater)
 
+    def belief_curve(self, grid, prices):
+        """
+        Beliefs over a grid of candidate prices, computed once per grid until the trader's memory next changes
+        :param grid: (job, ...) tuple identifying the grid: the same grid must always hold the same prices
+        :param prices: The grid's prices, sorted ascending
+        :return: List of belief values, one per price
+        """
+        curve = self.curves.get(grid)
+        if curve is None:
+            # belief_buy() and belief_sell() for every price at once, in one pass over the trader's memory
+            if grid[0] == 'Bid':
+                # a bid trades against asks at or below it, as accepted bids did, but not while others bid as much
+                curve = belief_ratios(evidence_counts(prices, (self.accepted_bids, self.outstanding_ask_prices), ()),
+                                      evidence_counts(prices, (), (self.outstanding_bid_prices,)))
+            else:
+                # an ask trades against bids at or above it, as accepted asks did, but not while others ask as little
+                curve = belief_ratios(evidence_counts(prices, (), (self.accepted_asks, self.outstanding_bid_prices)),
+                                      evidence_counts(prices, (self.outstanding_ask_prices,), ()))
+            self.curves[grid] = curve
+        return curve
+
+    def fill_values(self):
+        """
+        Fills the table of expected values by backward induction over remaining offer opportunities, or copies it
+        from a table already computed, by any GDX trader in this process, from the same inputs
+        """
+        key = (self.job, self.limit, self.gamma, self.holdings, self.remaining_offer_ops, tuple(self.accepted_bids),
+               tuple(self.accepted_asks), tuple(self.outstanding_bid_prices), tuple(self.outstanding_ask_prices))
+        table = GDX_VALUE_TABLES.get(key)
+        if table is not None:
+            self.values = [list(row) for row in table]
+            return
+
+        for n in range(1, self.remaining_offer_ops):
+            for m in range(1, self.holdings):
+                if self.job == 'Bid':
+                    # BUYER
+                    self.values[m][n] = self.calc_p_bid(m, n)
+
+                if self.job == 'Ask':
+                    # BUYER
+                    self.values[m][n] = self.calc_p_ask(m, n)
+
+        if len(GDX_VALUE_TABLES) >= GDX_VALUE_TABLES_MAX:
+            GDX_VALUE_TABLES.clear()
+        GDX_VALUE_TABLES[key] = tuple(tuple(row) for row in self.values)
+
     def respond(self, time, lob, trade, verbose):
         """
         Updates GDX trader's internal variables based on activities on the LOB
@@ -1067,7 +1189,10 @@ class TraderGdx(Trader):
         :param verbose: should verbose logging be printed to the console
         """
         # what, if anything, has happened on the bid LOB?
-        self.outstanding_bids = lob['bids']['lob']
+        if lob['bids']['lob'] is not self.outstanding_bids:
+            self.outstanding_bids = lob['bids']['lob']
+            self.outstanding_bid_prices = sorted(thing[0] for thing in self.outstanding_bids)
+            self.curves = {}
         # bid_improved = False
         # bid_hit = False
         lob_best_bid_p = lob['bids']['best']
@@ -1085,7 +1210,8 @@ class TraderGdx(Trader):
             elif trade is not None and ((self.prev_best_bid_p > lob_best_bid_p) or (
                     (self.prev_best_bid_p == lob_best_bid_p) and (self.prev_best_bid_q > lob_best_bid_q))):
                 # previous best bid was hit
-                self.accepted_bids.append(self.prev_best_bid_p)
+                bisect.insort(self.accepted_bids, self.prev_best_bid_p)
+                self.curves = {}
                 # bid_hit = True
         # elif self.prev_best_bid_p is not None:
         #     # the bid LOB has been emptied: was it cancelled or hit?
@@ -1096,7 +1222,10 @@ class TraderGdx(Trader):
         #     bid_hit = True
 
         # what, if anything, has happened on the ask LOB?
-        self.outstanding_asks = lob['asks']['lob']
+        if lob['asks']['lob'] is not self.outstanding_asks:
+            self.outstanding_asks = lob['asks']['lob']
+            self.outstanding_ask_prices = sorted(thing[0] for thing in self.outstanding_asks)
+            self.curves = {}
         # ask_improved = False
         # ask_lifted = False
         lob_best_ask_p = lob['asks']['best']
@@ -1114,7 +1243,8 @@ class TraderGdx(Trader):
                     (self.prev_best_ask_p == lob_best_ask_p) and (self.prev_best_ask_q > lob_best_ask_q))):
                 # trade happened and best ask price has got worse, or stayed same but quantity reduced
                 # assume previous best ask was lifted
-                self.accepted_asks.append(self.prev_best_ask_p)
+                bisect.insort(self.accepted_asks, self.prev_best_ask_p)
+                self.curves = {}
                 # ask_lifted = True
         # elif self.prev_best_ask_p is not None:
         # the ask LOB is empty now but was not previously: canceled or lifted?
@@ -1127,15 +1257,8 @@ class TraderGdx(Trader):
         # populate expected values
         if self.first_turn:
             self.first_turn = False
-            for n in range(1, self.remaining_offer_ops):
-                for m in range(1, self.holdings):
-                    if self.job == 'Bid':
-                        # BUYER
-                        self.values[m][n] = self.calc_p_bid(m, n)
-
-                    if self.job == 'Ask':
-                        # BUYER
-                        self.values[m][n] = self.calc_p_ask(m, n)
+            if self.job in ('Bid', 'Ask'):
+                self.fill_values()
 
         # deal = bid_hit or ask_lifted
 
@@ -1146,3 +1269,98 @@ class TraderGdx(Trader):
         self.prev_best_ask_q = lob_best_ask_q
 
     # ----------------trader-types have all been defined now-------------
+
+
+class TraderBatch:
+    """
+    Traders of one type that respond together to every market event, as in BSE.py's sequential market session
+    What has happened on the LOB is worked out once per event for the whole batch, rather than once per trader
+    """
+    def __init__(self, traders):
+        """
+        :param traders: List of the traders in the batch, all of the same type
+        """
+        self.traders = traders
+        # time spent responding to each market event, divided among the traders in the batch
+        self.latency = LatencyHistogram()
+        # memory of best price & quantity of best bid and ask, on LOB on previous update
+        self.prev_best_bid_p = None
+        self.prev_best_bid_q = None
+        self.prev_best_ask_p = None
+        self.prev_best_ask_q = None
+
+    def respond(self, time, lob, trade, verbose):
+        """
+        Responds to a market event on behalf of every trader in the batch
+        :param time: Current time
+        :param lob: Limit order book
+        :param trade: Trade being responded to, or None
+        :param verbose: Should verbose logging be printed to console
+        """
+        for trader in self.traders:
+            trader.respond(time, lob, trade, verbose)
+
+    def prepare(self, trader):
+        """
+        Brings a trader's memory of the LOB up to date before it is asked for an order
+        :param trader: Trader in the batch
+        """
+        trader.prev_best_bid_p = self.prev_best_bid_p
+        trader.prev_best_bid_q = self.prev_best_bid_q
+        trader.prev_best_ask_p = self.prev_best_ask_p
+        trader.prev_best_ask_q = self.prev_best_ask_q
+
+
+class ZipBatch(TraderBatch):
+    """
+    Batch of ZIP traders: only events that move the best prices make any trader in the batch react
+    """
+    def respond(self, time, lob, trade, verbose):
+        changes = lob_changes(self, lob, trade)
+        if any(changes):
+            for trader in self.traders:
+                trader.react(lob, trade, changes)
+
+
+class AaBatch(TraderBatch):
+    """
+    Batch of AA traders sharing one model of the market: each deal updates the equilibrium estimate and Smith's alpha
+    once for the batch, then each trader learns from it
+    """
+    def __init__(self, traders):
+        super().__init__(traders)
+        self.model = traders[0]
+        for trader in traders:
+            trader.previous_transactions = self.model.previous_transactions
+            trader.estimated_equilibrium = self.model.estimated_equilibrium
+            trader.smiths_alpha = self.model.smiths_alpha
+
+    def respond(self, time, lob, trade, verbose):
+        (_, bid_hit, _, ask_lifted) = lob_changes(self, lob, trade)
+        if bid_hit or ask_lifted:
+            self.model.observe_deal(trade['price'])
+            for trader in self.traders:
+                trader.smiths_alpha_min = self.model.smiths_alpha_min
+                trader.smiths_alpha_max = self.model.smiths_alpha_max
+                trader.learn(trade['price'])
+
+
+BATCH_TYPES = {'ZIP': ZipBatch, 'AA': AaBatch}
+
+
+def make_batches(traders):
+    """
+    Groups the traders of each type that can respond as a batch
+    :param traders: Dictionary of traders, indexed by trader ID
+    :return: Dictionary of batches, indexed by trader ID of each batched trader
+    """
+    members = {}
+    for trader in traders.values():
+        if trader.ttype in BATCH_TYPES:
+            members.setdefault(trader.ttype, []).append(trader)
+    batches = {}
+    for (ttype, group) in members.items():
+        batch = BATCH_TYPES[ttype](group)
+        for trader in group:
+            batches[trader.tid] = batch
+    return batches
@@ -0,0 +1,105 @@
+"""
+Module containing the trial pool: runs trials in parallel, each in its own worker process, when config.numWorkers is
+more than 1
+"""
+import concurrent.futures
+import io
+import itertools
+import os
+import random
+import tempfile
+import threading
+import time
+
+import config
+from tbse_market import session_complete
+
+
+def read_output(file_name, binary):
+    """
+    :param file_name: File a trial's session wrote its output to
+    :param binary: Whether the file is binary
+    :return: The file's contents, or empty if the session did not write it
+    """
+    if not os.path.isfile(file_name):
+        return b'' if binary else ''
+    if binary:
+        with open(file_name, 'rb') as trial_file:
+            return trial_file.read()
+    with open(file_name, encoding="utf-8") as trial_file:
+        return trial_file.read()
+
+
+def run_trial(session, trial_id, trader_spec, order_schedule):
+    """
+    Runs one trial in a worker process of the trial pool, retrying until its market session completes without any
+    thread crashing, or session_complete() rules out a retry. Its output is written to a temporary directory and
+    returned, so trials running at the same time never share a file.
+    :param session: Function running one market session, as tbse.market_session()
+    :param trial_id: ID of the trial
+    :param trader_spec: JSON data representing the number and types of traders on the market
+    :param order_schedule: JSON data representing the supply/demand curve of the market
+    :return: [trade_stats line, transactions.csv contents, tape file contents, latency file contents] of the
+             successful session
+    """
+    # workers forked from the same parent would otherwise all draw the same random numbers
+    random.seed()
+    trader_count = sum(n for (_, n) in trader_spec['buyers']) + sum(n for (_, n) in trader_spec['sellers'])
+    with tempfile.TemporaryDirectory() as trial_dir:
+        transactions_file = os.path.join(trial_dir, 'transactions.csv')
+        # market_session streams the tape to a temporary file of its own when config.tapeFile is None
+        tape_file = os.path.join(trial_dir, os.path.basename(config.tapeFile or ''))
+        latency_file = os.path.join(trial_dir, os.path.basename(config.latencyFile or ''))
+        while True:
+            # each attempt starts from empty output, so only the successful session is kept
+            for output_file in (transactions_file, tape_file, latency_file):
+                if os.path.isfile(output_file):
+                    os.remove(output_file)
+            dumpfile = io.StringIO()
+            session_event = threading.Event()
+            try:
+                num_threads = session(trial_id, config.sessionLength, config.virtualSessionLength, trader_spec,
+                                      order_schedule, session_event, False, dumpfile, trial_dir)
+                if session_complete(trial_id, num_threads, trader_count):
+                    break
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"Error: Market session {trial_id} failed, trying again.")
+                print(e)
+            session_event.clear()
+            time.sleep(0.5)
+        return [dumpfile.getvalue(), read_output(transactions_file, False), read_output(tape_file, True),
+                read_output(latency_file, False)]
+
+
+def run_trials(session, trials):
+    """
+    Runs trials in parallel on a pool of config.numWorkers processes, then merges their output in the order the trials
+    were given, whatever order they finish in: trade_stats lines to each trial's dump file, and trades and latencies
+    to transactions.csv, config.tapeFile and config.latencyFile as a sequential run would have appended them.
+    :param session: Function running one market session, as tbse.market_session(); it must be importable by the
+                    worker processes
+    :param trials: List of [dump file name, trial ID, trader_spec, order_schedule]; dump files are overwritten
+    """
+    dumpfiles = {}
+    try:
+        with concurrent.futures.ProcessPoolExecutor(config.numWorkers) as pool:
+            results = pool.map(run_trial, itertools.repeat(session), [entry[1] for entry in trials],
+                               [entry[2] for entry in trials], [entry[3] for entry in trials])
+            for (entry, [stats, transactions, tape, latencies]) in zip(trials, results):
+                if entry[0] not in dumpfiles:
+                    # pylint: disable=consider-using-with
+                    dumpfiles[entry[0]] = open(entry[0], 'w', encoding="utf-8")
+                dumpfiles[entry[0]].write(stats)
+                dumpfiles[entry[0]].flush()
+                if transactions:
+                    with open('transactions.csv', 'a', encoding="utf-8") as transactions_file:
+                        transactions_file.write(transactions)
+                if tape and config.tapeFile is not None:
+                    with open(config.tapeFile, 'ab') as tape_file:
+                        tape_file.write(tape)
+                if latencies and config.latencyFile is not None:
+                    with open(config.latencyFile, 'a', encoding="utf-8") as latency_file:
+                        latency_file.write(latencies)
+    finally:
+        for dumpfile in dumpfiles.values():
+            dumpfile.close()
@@ -0,0 +1,189 @@
+"""
+Module containing the discrete-event engine that runs a market session in virtual time, when config.timeMode is
+'virtual'
+"""
+import heapq
+import itertools
+import queue
+import random
+import time
+
+import config
+from tbse_customer_orders import customer_orders, next_issue_time, precompute_customer_orders, issue_customer_orders
+from tbse_exchange import Exchange
+from tbse_market import latency_stats, open_event_log, populate_market, process_order, trade_stats, trader_wakeup
+from tbse_msg_classes import BroadcastRing
+from tbse_trader_agents import make_batches
+
+
+# pylint: disable=too-many-arguments,too-many-locals,too-many-branches,too-many-statements
+def virtual_market_session(
+        sess_id,
+        sess_length,
+        virtual_end,
+        trader_spec,
+        order_schedule,
+        verbose,
+        dumpfile,
+        transactions_file,
+        tape_file,
+        latency_file):
+    """
+    Function representing a market session run in virtual time by a discrete-event engine, when config.timeMode is
+    'virtual'. Nothing waits on the wall clock: customer order arrivals, trader wakeups and the exchange's processing
+    of orders are events taken in time order from a heap, so a session runs as fast as the CPU allows.
+    Each customer order is issued at its own issue time, and each trader wakes every 10 ms of session time as in
+    real-time mode. The compute time each trader is measured to take on waking, scaled by config.virtualComputeScale,
+    is charged to its own clock: its order reaches the exchange, and it next wakes, that much later.
+    With config.batchRespond, ZIP and AA traders instead respond as batches of each type to every order the exchange
+    processes, as in BSE.py, and only bookkeep and quote when they wake; a batch's respond time is shared among its
+    traders' respond latency histograms.
+    :param sess_id: ID of the session
+    :param sess_length: Length of session in real world seconds, which sets the scale of virtual to real time
+    :param virtual_end: Number of virtual seconds before the session ends
+    :param trader_spec: JSON data representing the number and types of traders on the market
+    :param order_schedule: JSON data representing the supply/demand curve of the market
+    :param verbose: Should additional information be printed to the console
+    :param dumpfile: File the session's trade_stats are written to
+    :param transactions_file: File the session's trades are appended to as CSV, if config.tapeCsv
+    :param tape_file: Binary file the tape is streamed to; None for a temporary file
+    :param latency_file: File the session's latency_stats are appended to; None to not write them
+    :return: Number of traders that ran to the end of the session plus two, the number of threads a real-time
+             session would have had running
+    """
+    seed = None
+    if config.virtualSeed is not None:
+        # seeded per session, so trials differ from each other but each can be replayed
+        seed = f'{config.virtualSeed}-{sess_id}'
+    elif config.eventLogDir is not None:
+        # seeded afresh and the seed recorded, so the session can be re-run
+        seed = random.getrandbits(63)
+    if seed is not None:
+        random.seed(seed)
+    event_log = open_event_log(sess_id, seed)
+    time_scale = virtual_end / sess_length
+    # virtual time between rounds of customer orders, and between a trader's wakeups
+    tick = 0.01 * time_scale
+
+    exchange = Exchange(config.orderbookBackend, config.tapeWindow, tape_file)
+
+    # extra output from each stage of the engine, off however verbose is set, as in market_session()
+    orders_verbose = process_verbose = respond_verbose = bookkeep_verbose = False
+    traders = {}
+    trader_stats = populate_market(trader_spec, traders, True, verbose)
+    order_stream = None
+    if config.precomputeOrders:
+        order_stream = precompute_customer_orders(order_schedule, trader_stats, virtual_end, tick, config.orderSeed)
+    market_data = BroadcastRing(config.marketDataRingSize)
+    readers = {}
+    fill_qs = {}
+    for tid in traders:
+        readers[tid] = market_data.reader()
+        fill_qs[tid] = queue.Queue()
+    batches = {}
+    if config.batchRespond:
+        batches = make_batches(traders)
+    # each batch once, in the order of its first trader
+    batch_list = list({id(batch): batch for batch in batches.values()}.values())
+
+    if verbose:
+        print(f'\n{sess_id};  ')
+
+    # heap of (virtual time, sequence number, kind, payload); the sequence number keeps ties in scheduling order
+    events = []
+    event_seq = itertools.count()
+
+    def schedule(event_time, kind, payload):
+        heapq.heappush(events, (event_time, next(event_seq), kind, payload))
+
+    schedule(0.0, 'customers', None)
+    for tid in traders:
+        # trader threads never start in step, so neither do their first wakeups
+        schedule(random.random() * tick, 'trader', tid)
+
+    completed_coid = {}
+    pending_cust_orders = []
+    next_order = 0  # index in order_stream of the next customer order to be issued
+    cuid = 0  # Customer order id
+    n_crashed = 0
+    while events:
+        (virtual_time, _, kind, payload) = heapq.heappop(events)
+        if virtual_time >= virtual_end:
+            break
+
+        if kind == 'customers':
+            if order_stream is None:
+                [pending_cust_orders, kills, cuid] = customer_orders(virtual_time, cuid, traders, trader_stats,
+                                                                     order_schedule, pending_cust_orders,
+                                                                     orders_verbose)
+                # come back when the next pending order is due, or after a tick to draw the next batch
+                issue_time = next_issue_time(pending_cust_orders)
+                if issue_time is None:
+                    issue_time = virtual_time + tick
+            else:
+                [next_order, kills] = issue_customer_orders(virtual_time, order_stream, next_order, traders,
+                                                            orders_verbose)
+                issue_time = None
+                if next_order < len(order_stream['times']):
+                    issue_time = order_stream['times'][next_order]
+            # if any newly-issued customer orders mean quotes on the LOB need to be cancelled, kill them
+            for kill in kills:
+                if traders[kill].last_quote is not None:
+                    if verbose:
+                        print(f'Killing order {str(traders[kill].last_quote)}')
+                    if event_log is not None:
+                        event_log.record_kill(virtual_time, traders[kill].last_quote)
+                    exchange.del_order(virtual_time, traders[kill].last_quote)
+            if issue_time is not None:
+                schedule(issue_time, 'customers', None)
+
+        elif kind == 'trader':
+            time_left = (virtual_end - virtual_time) / virtual_end
+            time1 = time.perf_counter()
+            try:
+                order = trader_wakeup(traders[payload], exchange, readers[payload], fill_qs[payload], virtual_time,
+                                      time_left, respond_verbose, bookkeep_verbose, batches.get(payload))
+            except SystemExit:
+                # this trader's thread would have died: it takes no further part in the session
+                n_crashed += 1
+                if payload in batches:
+                    batches[payload].traders.remove(traders[payload])
+                continue
+            compute_time = (time.perf_counter() - time1) * time_scale * config.virtualComputeScale
+            if order is not None:
+                schedule(virtual_time + compute_time, 'order', order)
+            schedule(virtual_time + compute_time + tick, 'trader', payload)
+
+        else:
+            if event_log is not None:
+                event_log.record_order(virtual_time, payload)
+            trade = process_order(exchange, payload, virtual_time, completed_coid, market_data, fill_qs,
+                                  process_verbose)
+            if batch_list:
+                lob = exchange.publish_lob(virtual_time, False)
+                for batch in batch_list:
+                    time1 = time.perf_counter_ns()
+                    batch.respond(virtual_time, lob, trade, respond_verbose)
+                    batch.latency.record((time.perf_counter_ns() - time1) // max(len(batch.traders), 1))
+
+    if event_log is not None:
+        event_log.close(virtual_end, len(exchange.tape))
+
+    # end of an experiment -- the tape has been streamed to tape_file, optionally export its trades as CSV
+    if config.tapeCsv:
+        exchange.tape_dump(transactions_file, 'a', 'keep')
+    exchange.close()
+
+    # each batched trader is charged an equal share of its batch's respond time to every market event
+    for batch in batch_list:
+        for trader in batch.traders:
+            trader.latency['respond'].merge(batch.latency)
+
+    # write trade_stats and latency_stats for this experiment NB end-of-session summary only
+    if n_crashed == 0:
+        trade_stats(sess_id, traders, dumpfile)
+        if latency_file is not None:
+            with open(latency_file, 'a', encoding="utf-8") as latency_dump:
+                latency_stats(sess_id, traders, latency_dump)
+
+    return len(traders) + 2 - n_crashed
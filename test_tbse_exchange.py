@@ -0,0 +1,66 @@
+"""
+Tests of the exchange's LOB publishing and the market events traders wake on
+    $ python3 -m unittest test_tbse_exchange
+"""
+import unittest
+
+from tbse_exchange import Exchange
+from tbse_msg_classes import Order
+
+
+class TestMarketEvents(unittest.TestCase):
+    """
+    A change to the book wakes traders only if it changes what they are published
+    """
+    def setUp(self):
+        self.exchange = Exchange()
+        self.coid = 0
+
+    def tearDown(self):
+        self.exchange.close()
+
+    def quote(self, tid, otype, price):
+        """
+        :param tid: Trader ID
+        :param otype: 'Bid' or 'Ask'
+        :param price: Price of the quote
+        :return: The trade, or None if the quote did not trade
+        """
+        self.coid += 1
+        order = Order(tid, otype, price, 1, self.coid, self.coid, None)
+        return self.exchange.process_order2(self.coid, order, False)[0]
+
+    def test_identical_requote(self):
+        """
+        a trader re-quoting the same price and quantity leaves market_seq and the published LOB as they were
+        """
+        self.quote('B00', 'Bid', 100)
+        self.quote('S00', 'Ask', 120)
+        lob = self.exchange.publish_lob(0, False)
+        market_seq = self.exchange.market_seq
+        self.quote('B00', 'Bid', 100)
+        self.assertEqual(self.exchange.market_seq, market_seq)
+        self.assertIs(self.exchange.publish_lob(0, False)['bids'], lob['bids'])
+
+    def test_changed_requote(self):
+        """
+        a trader re-quoting at a new price bumps market_seq and publishes the new price
+        """
+        self.quote('B00', 'Bid', 100)
+        market_seq = self.exchange.market_seq
+        self.quote('B00', 'Bid', 101)
+        self.assertNotEqual(self.exchange.market_seq, market_seq)
+        self.assertEqual(self.exchange.publish_lob(0, False)['bids']['best'], 101)
+
+    def test_trade(self):
+        """
+        a trade bumps market_seq, as it changes the book and the tape
+        """
+        self.quote('B00', 'Bid', 100)
+        market_seq = self.exchange.market_seq
+        self.assertIsNotNone(self.quote('S00', 'Ask', 100))
+        self.assertNotEqual(self.exchange.market_seq, market_seq)
+
+
+if __name__ == "__main__":
+    unittest.main()